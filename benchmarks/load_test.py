@@ -0,0 +1,331 @@
+"""
+End-to-end load test for chat fan-out.
+
+Starts the API with uvicorn, creates N rooms with M WebSocket clients each,
+sends messages at a fixed total rate and measures send-to-receive latency for
+every delivery. Results are written as JSON so runs can be compared across
+commits.
+
+Usage (from the repository root):
+
+    python benchmarks/load_test.py --rooms 10 --clients 20 --rate 200 --duration 30
+
+By default the server runs against the in-memory Redis stand-in
+(``REDIS_URL=memory://``, requires ``fakeredis``), which limits it to one
+worker. Pass ``--redis-url redis://localhost:6379/0`` to benchmark against a
+real Redis, optionally with ``--workers``.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API = "/api/v1"
+MARKER = "bench"
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+class ProcessStats:
+    """CPU time and RSS of the server and its worker processes.
+
+    Uses psutil when installed and falls back to /proc on Linux.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def pids(self) -> List[int]:
+        if psutil is not None:
+            parent = psutil.Process(self.pid)
+            return [self.pid] + [child.pid for child in parent.children(recursive=True)]
+        pids = [self.pid]
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def sample(self) -> Dict[int, Dict[str, float]]:
+        """CPU seconds and RSS bytes per process"""
+        samples = {}
+        for pid in self.pids():
+            if psutil is not None:
+                try:
+                    process = psutil.Process(pid)
+                    cpu = process.cpu_times()
+                    samples[pid] = {"cpu": cpu.user + cpu.system, "rss": process.memory_info().rss}
+                except psutil.Error:
+                    pass
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                with open(f"/proc/{pid}/statm") as f:
+                    resident = int(f.read().split()[1])
+                samples[pid] = {
+                    "cpu": (int(fields[11]) + int(fields[12])) / self._clock_ticks,
+                    "rss": resident * self._page_size,
+                }
+            except (OSError, IndexError, ValueError):
+                continue
+        return samples
+
+
+class Client:
+    """One WebSocket member of a room."""
+
+    def __init__(self, index: int, room_id: str, user_id: str):
+        self.index = index
+        self.room_id = room_id
+        self.user_id = user_id
+        self.ws = None
+        self.sent = 0
+        self.received = 0
+        # Messages of rooms in digest mode left out of the digest's sample
+        self.digested = 0
+        self.latencies: List[float] = []
+
+    async def connect(self, ws_base: str):
+        self.ws = await websockets.connect(
+            f"{ws_base}{API}/ws/{self.room_id}/{self.user_id}", max_queue=None
+        )
+        # The first frame is the room history
+        await self.ws.recv()
+
+    async def receive(self):
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter_ns()
+                data = json.loads(raw)
+                if data.get("type") == "ping":
+                    await self.ws.send('{"type":"pong"}')
+                    continue
+                # Messages a room's actor sent together arrive as one batch or digest frame
+                if data.get("type") == "digest":
+                    self.digested += data["count"] - len(data["messages"])
+                for frame in data["messages"] if data.get("type") in ("batch", "digest") else (data,):
+                    content = frame.get("content", "")
+                    if content.startswith(MARKER):
+                        sent_ns = int(content.split(":", 2)[2])
+                        self.latencies.append((now - sent_ns) / 1_000_000)
+                        self.received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, interval: float, deadline: float):
+        # Spread the first sends so clients don't fire in lockstep
+        await asyncio.sleep(random.uniform(0, interval))
+        next_send = time.perf_counter()
+        while next_send < deadline:
+            content = f"{MARKER}:{self.index}:{time.perf_counter_ns()}"
+            await self.ws.send(json.dumps({"type": "text", "content": content}))
+            self.sent += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+
+def start_server(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "REDIS_URL": args.redis_url,
+        "RATE_LIMIT_REQUESTS": str(10 ** 9),
+        "MAX_MESSAGES_PER_ROOM": str(args.max_messages),
+        "LOAD_SHEDDING_ENABLED": str(args.load_shedding),
+    })
+    command = [
+        sys.executable, "-m", "uvicorn", "src.main:app",
+        "--host", args.host, "--port", str(args.port),
+        "--log-level", "warning",
+    ]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    output = None if args.verbose else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=output, stderr=output)
+
+
+async def wait_ready(base: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                response = await http.get(f"{base}/docs")
+                if response.status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+async def setup_clients(base: str, args) -> List[Client]:
+    clients: List[Client] = []
+    async with httpx.AsyncClient(base_url=base, timeout=30) as http:
+        for _ in range(args.rooms):
+            room = (await http.post(f"{API}/rooms", json={"name": "bench"})).json()
+            for _ in range(args.clients):
+                user = (await http.post(f"{API}/users", json={"username": "bench"})).json()
+                clients.append(Client(len(clients), room["id"], user["id"]))
+    return clients
+
+
+async def run(args) -> Dict[str, Any]:
+    base = f"http://{args.host}:{args.port}"
+    ws_base = f"ws://{args.host}:{args.port}"
+
+    server = None if args.external else start_server(args)
+    try:
+        await wait_ready(base)
+        clients = await setup_clients(base, args)
+        for start in range(0, len(clients), 100):
+            await asyncio.gather(*(c.connect(ws_base) for c in clients[start:start + 100]))
+
+        receivers = [asyncio.create_task(c.receive()) for c in clients]
+        stats = ProcessStats(server.pid) if server else None
+        before = stats.sample() if stats else {}
+
+        # Each client sends at rate / total clients messages per second
+        interval = len(clients) / args.rate
+        started = time.perf_counter()
+        await asyncio.gather(*(c.send(interval, started + args.duration) for c in clients))
+        send_elapsed = time.perf_counter() - started
+
+        # Let in-flight deliveries drain
+        sent = sum(c.sent for c in clients)
+        expected = sent * args.clients
+        drain_deadline = time.perf_counter() + args.drain
+        while sum(c.received + c.digested for c in clients) < expected and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        after = stats.sample() if stats else {}
+        for c in clients:
+            await c.ws.close()
+        await asyncio.gather(*receivers, return_exceptions=True)
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    latencies = sorted(latency for c in clients for latency in c.latencies)
+    received = len(latencies)
+    digested = sum(c.digested for c in clients)
+    workers = []
+    for pid, end in after.items():
+        start = before.get(pid)
+        if start is None:
+            continue
+        workers.append({
+            "pid": pid,
+            "cpu_percent": round((end["cpu"] - start["cpu"]) / elapsed * 100, 1),
+            "rss_mb": round(end["rss"] / (1024 * 1024), 1),
+        })
+
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "config": {
+            "rooms": args.rooms,
+            "clients_per_room": args.clients,
+            "rate": args.rate,
+            "duration": args.duration,
+            "workers": args.workers,
+            "redis_url": args.redis_url,
+        },
+        "results": {
+            "sent": sent,
+            "expected_deliveries": expected,
+            "received": received,
+            "digested": digested,
+            "lost": expected - received - digested,
+            "send_rate": round(sent / send_elapsed, 1),
+            "deliveries_per_sec": round(received / elapsed, 1),
+            "latency_ms": {
+                "p50": percentile(latencies, 0.50),
+                "p99": percentile(latencies, 0.99),
+                "p999": percentile(latencies, 0.999),
+                "max": latencies[-1] if latencies else None,
+                "mean": sum(latencies) / received if received else None,
+            },
+            "workers": workers,
+        },
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat fan-out load test")
+    parser.add_argument("--rooms", type=int, default=10, help="number of rooms")
+    parser.add_argument("--clients", type=int, default=10, help="WebSocket clients per room")
+    parser.add_argument("--rate", type=float, default=100.0, help="total messages sent per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of sending")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to wait for late deliveries")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--redis-url", default="memory://", help="REDIS_URL for the server")
+    parser.add_argument("--max-messages", type=int, default=100, help="MAX_MESSAGES_PER_ROOM")
+    parser.add_argument("--load-shedding", action="store_true", help="keep load shedding enabled")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--external", action="store_true",
+                        help="use a server already running on --host/--port")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/load-<commit>-<time>.json)")
+    args = parser.parse_args(argv)
+    if args.redis_url.startswith("memory://") and args.workers > 1:
+        parser.error("the in-memory stand-in is per process; use a real Redis with --workers")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(ROOT, "benchmarks", "results", f"load-{result['commit'] or 'unknown'}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    latency = result["results"]["latency_ms"]
+    print(json.dumps(result["results"], indent=2))
+    print(f"p50={latency['p50']}ms p99={latency['p99']}ms p999={latency['p999']}ms -> {output}")
+
+
+if __name__ == "__main__":
+    main()
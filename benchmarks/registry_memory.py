@@ -0,0 +1,84 @@
+"""
+Memory used per WebSocket connection by the connection registry.
+
+Registers N simulated connections, spread over rooms of ``--room-size``
+members, with ``ConnectionRegistry`` and with the nested-dict layout the
+connection manager used before it (room -> user -> socket, user -> set of
+rooms, set of socket ids), and reports the bytes each layout allocates per
+connection as measured by ``tracemalloc``. Socket objects are created before
+measuring so only the bookkeeping is counted; room and user IDs are built
+per connection, as they are when parsed from each request.
+
+Usage (from the repository root):
+
+    python benchmarks/registry_memory.py --connections 10000 100000 500000
+"""
+
+from typing import Callable, Dict, List, Set
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.registry import ConnectionRegistry  # noqa: E402
+
+
+class FakeSocket:
+    __slots__ = ()
+
+
+def nested_dicts(sockets: List[FakeSocket], room_size: int) -> object:
+    active_connections: Dict[str, Dict[str, FakeSocket]] = {}
+    user_rooms: Dict[str, Set[str]] = {}
+    socket_ids: Set[int] = set()
+    for n, websocket in enumerate(sockets):
+        room_id, user_id = f"room-{n // room_size}", f"user-{n}"
+        socket_ids.add(id(websocket))
+        active_connections.setdefault(room_id, {})[user_id] = websocket
+        user_rooms.setdefault(user_id, set()).add(room_id)
+    return active_connections, user_rooms, socket_ids
+
+
+def registry(sockets: List[FakeSocket], room_size: int) -> object:
+    connections = ConnectionRegistry()
+    for n, websocket in enumerate(sockets):
+        room_id, user_id = f"room-{n // room_size}", f"user-{n}"
+        connections.add_socket(websocket)
+        connections.add(websocket, room_id, user_id)
+    return connections
+
+
+def measure(build: Callable[[List[FakeSocket], int], object], count: int, room_size: int) -> float:
+    """Bytes allocated per connection by ``build``."""
+    sockets = [FakeSocket() for _ in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        layout = build(sockets, room_size)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del layout
+    return used / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--room-size", type=int, default=50, help="members per room")
+    args = parser.parse_args()
+
+    print(f"{'connections':>12} {'nested dicts':>14} {'registry':>10} {'saved':>7}")
+    for count in args.connections:
+        old = measure(nested_dicts, count, args.room_size)
+        new = measure(registry, count, args.room_size)
+        print(f"{count:>12,} {old:>12.0f} B {new:>8.0f} B {1 - new / old:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+End-to-end latency of ``GET /rooms/{room_id}/messages`` for 1,000-message pages.
+
+Compares the raw passthrough (stored JSON joined into the body) with the
+validated path (parse into ``Message`` objects, then serialize). Runs against
+the in-memory Redis stand-in unless ``BENCH_REDIS_URL`` points at a real
+Redis:
+
+    pytest benchmarks/test_history.py --benchmark-only --no-cov
+
+p50/p99 per variant are stored in the benchmark's ``extra_info``.
+"""
+
+import asyncio
+import os
+import uuid
+
+import pytest
+from httpx import AsyncClient
+
+from src.config.settings import get_settings
+from src.dependencies import get_database
+from src.main import app
+from src.middleware.rate_limiter import rate_limiter
+from src.models.message import Message
+
+settings = get_settings()
+PAGE_SIZE = 1000
+ROUNDS = 200
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+def room_id(loop):
+    redis_url = os.environ.get("BENCH_REDIS_URL")
+    if redis_url is None:
+        pytest.importorskip("fakeredis")
+        redis_url = "memory://"
+    original_url = settings.REDIS_URL
+    settings.REDIS_URL = redis_url
+
+    db = get_database()
+
+    async def populate() -> str:
+        await db.disconnect()
+        room = await db.create_room("bench")
+        # Write the page directly so MAX_MESSAGES_PER_ROOM trimming doesn't apply
+        messages = [
+            Message(
+                id=str(uuid.uuid4()),
+                room_id=room.id,
+                user_id=str(uuid.uuid4()),
+                content="benchmark message " * 4,
+            )
+            for _ in range(PAGE_SIZE)
+        ]
+        await db.redis_client.hset(
+            f"room:{room.id}:docs", mapping={message.id: message.model_dump_json() for message in messages}
+        )
+        await db.redis_client.zadd(
+            f"room:{room.id}:timeline", {message.id: n for n, message in enumerate(messages)}
+        )
+        return room.id
+
+    room_id = loop.run_until_complete(populate())
+    yield room_id
+    loop.run_until_complete(db.disconnect())
+    settings.REDIS_URL = original_url
+
+
+def _run(benchmark, loop, room_id, raw: bool, monkeypatch):
+    monkeypatch.setattr(settings, "HISTORY_RAW_PASSTHROUGH", raw)
+    monkeypatch.setattr(rate_limiter, "requests_per_minute", 10 ** 9)
+    client = AsyncClient(app=app, base_url="http://bench")
+    url = f"{settings.API_V1_STR}/rooms/{room_id}/messages?limit={PAGE_SIZE}"
+
+    def fetch():
+        response = loop.run_until_complete(client.get(url))
+        assert response.status_code == 200
+        return response
+
+    try:
+        # Checked once up front, so the test holds however many rounds are timed
+        assert len(fetch().json()) == PAGE_SIZE
+        benchmark.pedantic(fetch, rounds=ROUNDS, warmup_rounds=10)
+    finally:
+        loop.run_until_complete(client.aclose())
+
+    # No stats are kept under --benchmark-disable
+    if benchmark.stats is None:
+        return
+    data = benchmark.stats.stats.sorted_data
+    benchmark.extra_info["p50_ms"] = round(data[int(0.50 * len(data))] * 1000, 3)
+    benchmark.extra_info["p99_ms"] = round(data[min(int(0.99 * len(data)), len(data) - 1)] * 1000, 3)
+
+
+@pytest.mark.benchmark(group="history-1000")
+def test_history_page_raw_passthrough(benchmark, loop, room_id, monkeypatch):
+    _run(benchmark, loop, room_id, True, monkeypatch)
+
+
+@pytest.mark.benchmark(group="history-1000")
+def test_history_page_validated(benchmark, loop, room_id, monkeypatch):
+    _run(benchmark, loop, room_id, False, monkeypatch)
@@ -0,0 +1,208 @@
+"""
+Micro-benchmarks for message serialization hot paths.
+
+Run with pytest-benchmark from the repository root:
+
+    pytest benchmarks/test_serialization.py --benchmark-only --no-cov
+
+Each group compares the approach the code used before with the fast path it
+uses now, for several content sizes and page sizes.
+"""
+
+from datetime import datetime
+from typing import List
+import asyncio
+import json
+import uuid
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from src.models.message import Message, MessageType, MESSAGE_LIST_ADAPTER
+from src.services.websocket import ConnectionManager
+
+CONTENT_SIZES = [16, 1024, 16 * 1024]
+PAGE_SIZES = [1, 50, 1000]
+
+
+def make_message(content_size: int = 64) -> Message:
+    return Message(
+        id=str(uuid.uuid4()),
+        room_id=str(uuid.uuid4()),
+        user_id=str(uuid.uuid4()),
+        content="x" * content_size,
+        metadata={"client": "bench"},
+    )
+
+
+def stored_page(page_size: int, content_size: int = 64) -> List[str]:
+    """Messages as they are stored in ``room:{room_id}:docs``"""
+    return [make_message(content_size).model_dump_json() for _ in range(page_size)]
+
+
+# Model construction and validation
+
+@pytest.mark.benchmark(group="construct")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_construct_validated(benchmark, content_size):
+    data = make_message(content_size).model_dump()
+    benchmark(lambda: Message(**data))
+
+
+@pytest.mark.benchmark(group="construct")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_construct_trusted(benchmark, content_size):
+    data = make_message(content_size).model_dump()
+    benchmark(lambda: Message.model_construct(**data))
+
+
+@pytest.mark.benchmark(group="validate")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_validate_python(benchmark, content_size):
+    data = make_message(content_size).model_dump(mode="json")
+    benchmark(Message.model_validate, data)
+
+
+@pytest.mark.benchmark(group="validate")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_validate_json(benchmark, content_size):
+    raw = make_message(content_size).model_dump_json()
+    benchmark(Message.model_validate_json, raw)
+
+
+# Dumping a single message
+
+@pytest.mark.benchmark(group="dump")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_model_dump(benchmark, content_size):
+    message = make_message(content_size)
+    benchmark(message.model_dump)
+
+
+@pytest.mark.benchmark(group="dump")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_model_dump_then_json_dumps(benchmark, content_size):
+    message = make_message(content_size)
+    benchmark(lambda: json.dumps(message.model_dump(mode="json")))
+
+
+@pytest.mark.benchmark(group="dump")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_model_dump_json(benchmark, content_size):
+    message = make_message(content_size)
+    benchmark(message.model_dump_json)
+
+
+# Decoding a history page read from Redis
+
+def _decode_per_message(rows: List[str]) -> List[Message]:
+    messages = []
+    for message_json in rows:
+        message_data = json.loads(message_json)
+        message_data["created_at"] = datetime.fromisoformat(message_data["created_at"])
+        messages.append(Message(**message_data))
+    return messages
+
+
+def _decode_trusted(rows: List[str]) -> List[Message]:
+    messages = []
+    for message_json in rows:
+        message_data = json.loads(message_json)
+        message_data["created_at"] = datetime.fromisoformat(message_data["created_at"])
+        message_data["type"] = MessageType(message_data["type"])
+        messages.append(Message.model_construct(**message_data))
+    return messages
+
+
+@pytest.mark.benchmark(group="history-decode")
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+def test_history_decode_per_message(benchmark, page_size):
+    rows = stored_page(page_size)
+    benchmark(_decode_per_message, rows)
+
+
+@pytest.mark.benchmark(group="history-decode")
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+def test_history_decode_trusted_construct(benchmark, page_size):
+    rows = stored_page(page_size)
+    benchmark(_decode_trusted, rows)
+
+
+@pytest.mark.benchmark(group="history-decode")
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+def test_history_decode_type_adapter(benchmark, page_size):
+    rows = stored_page(page_size)
+    benchmark(lambda: MESSAGE_LIST_ADAPTER.validate_json("[" + ",".join(rows) + "]"))
+
+
+# Encoding a history page for the response
+
+@pytest.mark.benchmark(group="history-encode")
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+def test_history_encode_response_model(benchmark, page_size):
+    # What FastAPI does with response_model=List[Message]: validate, then encode
+    messages = MESSAGE_LIST_ADAPTER.validate_json("[" + ",".join(stored_page(page_size)) + "]")
+
+    def encode():
+        validated = MESSAGE_LIST_ADAPTER.validate_python(messages)
+        return json.dumps(jsonable_encoder(validated)).encode()
+
+    benchmark(encode)
+
+
+@pytest.mark.benchmark(group="history-encode")
+@pytest.mark.parametrize("page_size", PAGE_SIZES)
+def test_history_encode_type_adapter(benchmark, page_size):
+    messages = MESSAGE_LIST_ADAPTER.validate_json("[" + ",".join(stored_page(page_size)) + "]")
+    benchmark(MESSAGE_LIST_ADAPTER.dump_json, messages)
+
+
+# Preparing a broadcast frame
+
+def _prepare_dict_frame(message: Message) -> str:
+    # Previous broadcast path: dict, datetime fix-up loop, json.dumps
+    frame = message.dict()
+    for key, value in frame.items():
+        if isinstance(value, datetime):
+            frame[key] = value.isoformat()
+    return json.dumps(frame, default=str)
+
+
+@pytest.mark.benchmark(group="broadcast-prepare")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_broadcast_prepare_dict(benchmark, content_size):
+    message = make_message(content_size)
+    benchmark(_prepare_dict_frame, message)
+
+
+@pytest.mark.benchmark(group="broadcast-prepare")
+@pytest.mark.parametrize("content_size", CONTENT_SIZES)
+def test_broadcast_prepare_model_dump_json(benchmark, content_size):
+    message = make_message(content_size)
+    benchmark(message.model_dump_json)
+
+
+class _NullSocket:
+    # No subprotocol requested, so every member speaks JSON
+    scope = {}
+
+    async def accept(self, *args, **kwargs):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+@pytest.mark.benchmark(group="broadcast-room")
+@pytest.mark.parametrize("members", [10, 1000])
+def test_broadcast_json_to_room(benchmark, members):
+    manager = ConnectionManager()
+    room_id = "bench-room"
+    frame = make_message().model_dump_json()
+    loop = asyncio.new_event_loop()
+    try:
+        for i in range(members):
+            loop.run_until_complete(manager.connect(_NullSocket(), room_id, f"user-{i}"))
+        benchmark(lambda: loop.run_until_complete(manager.broadcast_json(room_id, frame)))
+    finally:
+        loop.close()
@@ -0,0 +1,57 @@
+"""
+One-off migration to the per-message store.
+
+Rooms used to keep their messages as JSON documents in the list
+``room:{room_id}:messages``. Messages are now stored once, in the hash
+``room:{room_id}:docs`` keyed by message ID, with their IDs in the
+archive and timeline sorted sets and in the user, search and thread
+indexes. This script writes every listed message through the same code
+as new messages, so its indexes and reply counters are built with it,
+then deletes the list. A room whose list is gone is skipped, and saving
+a message twice doesn't count its reply twice, so it is safe to run
+again after an interruption.
+
+Run it once, with the API stopped, before starting the new version:
+
+    REDIS_URL=redis://localhost:6379/0 python scripts/migrate_message_store.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.message import Message  # noqa: E402
+from src.services.database.redis import RedisDatabase  # noqa: E402
+
+
+async def migrate_room(db: RedisDatabase, room_id: str) -> int:
+    """Move one room's messages to the new layout; return how many were moved."""
+    legacy = f"room:{room_id}:messages"
+    client = db.redis_client
+    if await client.type(legacy) != "list":
+        return 0
+    rows = await client.lrange(legacy, 0, -1)
+    await db.save_messages([Message.model_validate_json(row) for row in rows])
+    await client.delete(legacy)
+    return len(rows)
+
+
+async def main() -> None:
+    db = RedisDatabase()
+    await db.connect()
+    rooms = messages = 0
+    try:
+        async for room_id in db.redis_client.sscan_iter("rooms"):
+            moved = await migrate_room(db, room_id)
+            if moved:
+                rooms += 1
+                messages += moved
+    finally:
+        await db.disconnect()
+    print(f"Migrated {messages} messages in {rooms} rooms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -17,8 +17,12 @@ setup(
         "pytest-asyncio==0.23.2",
         "httpx==0.25.2",
         "pytest-cov==4.1.0",
+        "pytest-benchmark==4.0.0",
         "black==23.11.0",
         "flake8==6.1.0"
     ],
+    extras_require={
+        "msgpack": ["msgpack>=1.0"]
+    },
     python_requires=">=3.8",
 ) 
\ No newline at end of file
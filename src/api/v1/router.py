@@ -1,19 +1,37 @@
-from fastapi import APIRouter, WebSocket, HTTPException, Depends, Path
-from typing import List
-from pydantic import BaseModel
+from fastapi import APIRouter, WebSocket, HTTPException, Depends, Path, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from pydantic import BaseModel, Field, ValidationError
 from src.models.chat_room import ChatRoom
-from src.models.user import User
-from src.models.message import Message, MessageType
+from src.models.user import User, USER_MAP_ADAPTER
+from src.models.message import Message, MessageType, MESSAGE_LIST_ADAPTER, MESSAGE_REFS_ADAPTER
 from src.services.database import DatabaseInterface
 from src.services.websocket import manager
 from src.middleware.rate_limiter import check_rate_limit
+from src.middleware.load_shedding import check_load_shedding
+from src.middleware.profiler import profiler
+from src.services.loop_monitor import loop_monitor
+from src.services.tracing import tracer
+from src.services.retention import retention_sweeper
+from src.services.reaper import connection_reaper
+from src.services.room_actors import room_actors, encode_messages
+from src.services.typing_indicators import typing_tracker
+from src.services.search import tokenize
+from src.services.metrics import MESSAGES_RECEIVED
+from src.services.importer import MessageImporter, iter_json_array, iter_ndjson
+from src.services.profiles import profile_cache
 from src.dependencies import get_database
+from src.config.settings import get_settings
+import asyncio
+import json
 import logging
 import uuid
-from datetime import datetime
+import zlib
+from datetime import datetime, timezone
 from fastapi import WebSocketDisconnect
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 api_router = APIRouter()
 
 class RoomCreate(BaseModel):
@@ -26,6 +44,24 @@ class MessageCreate(BaseModel):
     content: str
     user_id: str
     type: MessageType = MessageType.TEXT
+    reply_to: Optional[str] = None
+
+class BatchGetRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=settings.BATCH_GET_MAX_IDS)
+
+class RoomBatchGetResponse(BaseModel):
+    rooms: List[ChatRoom]
+    missing: List[str]
+
+class UserBatchGetResponse(BaseModel):
+    users: List[User]
+    missing: List[str]
+
+class MessageHistoryResponse(BaseModel):
+    """Room history with ``include_users`` or ``include_reply_counts``."""
+    messages: List[Message]
+    users: Optional[Dict[str, User]] = None
+    reply_counts: Optional[Dict[str, int]] = None
 
 @api_router.post("/rooms", response_model=ChatRoom)
 async def create_room(
@@ -43,7 +79,8 @@ async def create_room(
 @api_router.get("/rooms", response_model=List[ChatRoom])
 async def get_rooms(
     db: DatabaseInterface = Depends(get_database),
-    _: None = Depends(check_rate_limit)
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
 ):
     """Get all chat rooms."""
     try:
@@ -52,6 +89,24 @@ async def get_rooms(
         logging.error(f"Error getting rooms: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/rooms:batchGet", response_model=RoomBatchGetResponse)
+async def batch_get_rooms(
+    batch: BatchGetRequest,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit)
+):
+    """Get up to BATCH_GET_MAX_IDS chat rooms by ID in one request."""
+    try:
+        ids = list(dict.fromkeys(batch.ids))
+        found = await db.get_rooms_by_ids(ids)
+        return RoomBatchGetResponse(
+            rooms=[found[room_id] for room_id in ids if room_id in found],
+            missing=[room_id for room_id in ids if room_id not in found]
+        )
+    except Exception as e:
+        logging.error(f"Error batch getting rooms: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/rooms/{room_id}", response_model=ChatRoom)
 async def get_room(
     room_id: str = Path(..., description="The ID of the room to retrieve"),
@@ -70,6 +125,24 @@ async def get_room(
         logging.error(f"Error getting room: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/rooms/{room_id}/presence")
+async def get_room_presence(
+    room_id: str,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Get the users currently connected to a room on any worker.
+
+    A single sorted-set read; a room that doesn't exist has nobody present.
+    """
+    try:
+        users = await db.get_presence(room_id, settings.PRESENCE_TIMEOUT)
+        return {"room_id": room_id, "users": users, "count": len(users)}
+    except Exception as e:
+        logging.error(f"Error getting presence: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/users", response_model=User)
 async def create_user(
     user: UserCreate,
@@ -86,7 +159,8 @@ async def create_user(
 @api_router.get("/users", response_model=List[User])
 async def get_users(
     db: DatabaseInterface = Depends(get_database),
-    _: None = Depends(check_rate_limit)
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
 ):
     """Get all users."""
     try:
@@ -95,6 +169,24 @@ async def get_users(
         logging.error(f"Error getting users: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/users:batchGet", response_model=UserBatchGetResponse)
+async def batch_get_users(
+    batch: BatchGetRequest,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit)
+):
+    """Get up to BATCH_GET_MAX_IDS users by ID in one request."""
+    try:
+        ids = list(dict.fromkeys(batch.ids))
+        found = await profile_cache.get_many(db, ids)
+        return UserBatchGetResponse(
+            users=[found[user_id] for user_id in ids if user_id in found],
+            missing=[user_id for user_id in ids if user_id not in found]
+        )
+    except Exception as e:
+        logging.error(f"Error batch getting users: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(
     user_id: str = Path(..., description="The ID of the user to retrieve"),
@@ -113,6 +205,39 @@ async def get_user(
         logging.error(f"Error getting user: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/users/{user_id}/messages")
+async def get_user_messages(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Get a user's messages across all rooms, newest first.
+
+    Pass ``next_cursor`` from a response as ``cursor`` to get the next page;
+    it is null on the last page.
+    """
+    try:
+        user = await db.get_user(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        try:
+            rows, next_cursor = await db.get_user_messages_raw(user_id, limit, cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return Response(
+            content='{"messages":[' + ",".join(rows) + '],"next_cursor":' + json.dumps(next_cursor) + "}",
+            media_type="application/json"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting user messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @api_router.post("/rooms/{room_id}/messages", response_model=Message)
 async def create_message(
     room_id: str,
@@ -121,6 +246,7 @@ async def create_message(
     _: None = Depends(check_rate_limit)
 ):
     """Create a new message in a room."""
+    MESSAGES_RECEIVED.inc("http")
     try:
         # Verify room and user exist
         room = await db.get_room(room_id)
@@ -130,6 +256,8 @@ async def create_message(
         user = await db.get_user(message.user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        if message.reply_to is not None and not await db.existing_messages(room_id, [message.reply_to]):
+            raise HTTPException(status_code=404, detail="Parent message not found")
 
         # Create message
         msg = Message(
@@ -138,6 +266,7 @@ async def create_message(
             user_id=message.user_id,
             content=message.content,
             type=message.type,
+            reply_to=message.reply_to,
             created_at=datetime.utcnow()
         )
 
@@ -149,32 +278,391 @@ async def create_message(
         logging.error(f"Error creating message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/rooms/{room_id}/messages", response_model=List[Message])
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert an aware datetime to naive UTC, the form messages are stored in."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+async def _history_page(
+    db: DatabaseInterface,
+    room_id: str,
+    limit: int = 50,
+    include_users: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    include_reply_counts: bool = False
+) -> Tuple[str, Optional[str], Optional[str]]:
+    """Encode a page of history as a JSON array, plus its authors' profiles and reply counts if asked.
+
+    Reply counts are read in the same round trip as the page and only
+    messages in the page with at least one reply are listed.
+    """
+    counts = None
+    if settings.HISTORY_RAW_PASSTHROUGH:
+        # Stored documents already match the wire format; join them as-is
+        if include_reply_counts:
+            rows, counts = await db.get_room_history_raw(room_id, limit, start, end)
+        else:
+            rows = await db.get_room_messages_raw(room_id, limit, start, end)
+        page = "[" + ",".join(rows) + "]"
+        refs = MESSAGE_REFS_ADAPTER.validate_json(page) if include_users or counts else []
+    else:
+        if include_reply_counts:
+            rows, counts = await db.get_room_history_raw(room_id, limit, start, end)
+            messages = MESSAGE_LIST_ADAPTER.validate_json("[" + ",".join(rows) + "]")
+        else:
+            messages = await db.get_room_messages(room_id, limit, start, end)
+        # Messages were just validated; serialize them directly rather than
+        # letting FastAPI validate and encode the response a second time
+        page = MESSAGE_LIST_ADAPTER.dump_json(messages).decode()
+        refs = messages
+
+    users = None
+    if include_users:
+        found = await profile_cache.get_many(db, (ref.user_id for ref in refs))
+        users = USER_MAP_ADAPTER.dump_json(found).decode()
+    reply_counts = None
+    if counts is not None:
+        reply_counts = json.dumps({ref.id: counts[ref.id] for ref in refs if counts.get(ref.id, 0) > 0})
+    return page, users, reply_counts
+
+def _history_body(head: str, page: str, users: Optional[str], reply_counts: Optional[str]) -> str:
+    """Join an encoded history page and its extras into one JSON object."""
+    body = head + '"messages":' + page
+    if users is not None:
+        body += ',"users":' + users
+    if reply_counts is not None:
+        body += ',"reply_counts":' + reply_counts
+    return body + "}"
+
+@api_router.get("/rooms/{room_id}/messages", response_model=Union[List[Message], MessageHistoryResponse])
 async def get_messages(
     room_id: str,
     limit: int = 50,
+    include_users: bool = False,
+    include_reply_counts: bool = False,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
     db: DatabaseInterface = Depends(get_database),
-    _: None = Depends(check_rate_limit)
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
 ):
-    """Get messages from a room."""
+    """Get messages from a room, newest first.
+
+    ``from`` (inclusive) and ``to`` (exclusive) restrict the page to a time
+    range; pass the oldest ``created_at`` of a page as ``to`` to get the
+    page before it. With ``include_users`` or ``include_reply_counts`` the
+    response is a ``MessageHistoryResponse`` holding the messages plus a
+    ``users`` map with the profile of every author in the page and/or a
+    ``reply_counts`` map from message ID to number of replies.
+    """
     try:
         # Verify room exists
         room = await db.get_room(room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
 
-        return await db.get_room_messages(room_id, limit)
+        page, users, reply_counts = await _history_page(
+            db, room_id, limit, include_users, _naive_utc(from_), _naive_utc(to), include_reply_counts
+        )
+        if users is None and reply_counts is None:
+            return Response(content=page, media_type="application/json")
+        return Response(content=_history_body("{", page, users, reply_counts), media_type="application/json")
     except HTTPException:
         raise
     except Exception as e:
         logging.error(f"Error getting messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/rooms/{room_id}/messages/{message_id}/thread")
+async def get_thread(
+    room_id: str,
+    message_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Get the replies to a message, oldest first, and its reply count.
+
+    Pass ``next_cursor`` from a response as ``cursor`` to get the next page;
+    it is null on the last page.
+    """
+    try:
+        room = await db.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+
+        try:
+            rows, reply_count, next_cursor = await db.get_thread_raw(room_id, message_id, limit, cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return Response(
+            content=(
+                '{"reply_count":' + str(reply_count) + ',"messages":[' + ",".join(rows)
+                + '],"next_cursor":' + json.dumps(next_cursor) + "}"
+            ),
+            media_type="application/json"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting thread: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _search(db: DatabaseInterface, q: str, room_id: Optional[str], limit: int) -> Response:
+    terms = tokenize(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Query has no searchable terms")
+    rows = await db.search_messages_raw(terms, room_id, limit)
+    return Response(content="[" + ",".join(rows) + "]", media_type="application/json")
+
+@api_router.get("/rooms/{room_id}/search", response_model=List[Message])
+async def search_room_messages(
+    room_id: str,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Search a room's messages; every term must match. Newest first."""
+    try:
+        room = await db.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+        return await _search(db, q, room_id, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error searching messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/search", response_model=List[Message])
+async def search_messages(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Search messages across all rooms; every term must match. Newest first."""
+    try:
+        return await _search(db, q, None, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error searching messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _accepts_gzip(request: Request) -> bool:
+    """Whether the client lists gzip in Accept-Encoding with a non-zero q-value."""
+    for coding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() != "gzip":
+            continue
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+async def _export_stream(
+    db: DatabaseInterface,
+    room_id: str,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    compress: bool
+) -> AsyncIterator[bytes]:
+    """Yield a room's messages as NDJSON, one body chunk per Redis read."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    try:
+        async for rows in db.iter_room_messages_raw(room_id, since, until):
+            chunk = ("\n".join(rows) + "\n").encode()
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated body
+        logging.error(f"Error exporting messages for room {room_id}: {e}")
+    if compressor is not None:
+        yield compressor.flush()
+
+@api_router.get("/rooms/{room_id}/messages/export")
+async def export_messages(
+    request: Request,
+    room_id: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Stream a room's full message history as NDJSON, oldest first."""
+    try:
+        room = await db.get_room(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+
+        compress = _accepts_gzip(request)
+        headers = {"Content-Disposition": f'attachment; filename="room-{room_id}.ndjson"'}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+            headers["Vary"] = "Accept-Encoding"
+        return StreamingResponse(
+            _export_stream(db, room_id, _naive_utc(since), _naive_utc(until), compress),
+            media_type="application/x-ndjson",
+            headers=headers
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error exporting messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/messages/import")
+async def import_messages(
+    request: Request,
+    db: DatabaseInterface = Depends(get_database),
+    _: None = Depends(check_rate_limit),
+    __: None = Depends(check_load_shedding)
+):
+    """Bulk-import messages for one or many rooms from an NDJSON or JSON-array body."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        items = iter_ndjson(request.stream())
+    elif content_type == "application/json":
+        items = iter_json_array(request.stream())
+    else:
+        raise HTTPException(
+            status_code=415,
+            detail="Send application/x-ndjson or a JSON array as application/json"
+        )
+
+    importer = MessageImporter(db)
+    try:
+        return await importer.run(items)
+    except Exception as e:
+        logging.error(f"Error importing messages after {importer.imported} imported: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"{e} ({importer.imported} messages were imported before the failure)"
+        )
+
+@api_router.get("/admin/loop-lag")
+async def get_loop_lag():
+    """Get event-loop lag percentiles for this worker."""
+    percentiles = loop_monitor.percentiles()
+    return {
+        "lag_ms": {name: round(value * 1000, 3) for name, value in percentiles.items()},
+        "current_lag_ms": round(loop_monitor.current_lag() * 1000, 3),
+        "threshold_ms": round(loop_monitor.threshold * 1000, 3),
+        "overloaded": loop_monitor.is_overloaded()
+    }
+
+@api_router.get("/admin/redis/slowlog")
+async def get_redis_slowlog(limit: int = Query(100, ge=1, le=1000)):
+    """Get the slowest recent Redis commands and pipelines, newest first."""
+    return {
+        "threshold_ms": round(tracer.slow_threshold * 1000, 3),
+        "entries": tracer.slow_operations(limit)
+    }
+
+@api_router.delete("/admin/redis/slowlog")
+async def clear_redis_slowlog():
+    """Clear the Redis slow log."""
+    tracer.clear_slow_operations()
+    return {"status": "cleared"}
+
+@api_router.post("/admin/tracing/export")
+async def export_traces():
+    """Export buffered Redis spans to a JSON trace file."""
+    if not tracer.enabled:
+        raise HTTPException(status_code=409, detail="Tracing is disabled")
+    try:
+        path, count = await asyncio.to_thread(tracer.export)
+        return {"path": path, "spans": count}
+    except Exception as e:
+        logging.error(f"Error exporting traces: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/admin/retention/sweep")
+async def run_retention_sweep(db: DatabaseInterface = Depends(get_database)):
+    """Run one retention sweep step now instead of waiting for the next interval."""
+    try:
+        result = await retention_sweeper.sweep_once(db)
+    except Exception as e:
+        logging.error(f"Error running retention sweep: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=409, detail="Another worker is sweeping")
+    return result
+
+async def _history_frame(db: DatabaseInterface, room_id: str, include_users: bool = False) -> str:
+    """Build the encoded history frame sent when a socket joins a room."""
+    page, users, reply_counts = await _history_page(
+        db, room_id, include_users=include_users, include_reply_counts=settings.HISTORY_REPLY_COUNTS
+    )
+    return _history_body('{"type":"history","room_id":' + json.dumps(room_id) + ",", page, users, reply_counts)
+
+async def _handle_frame(db: DatabaseInterface, websocket: WebSocket, room_id: str, user_id: str, data: dict):
+    """Handle one frame received on a room WebSocket."""
+    if isinstance(data, dict) and data.get("type") == MessageType.TYPING.value:
+        # Typing indicators are throttled and broadcast in batches, never stored
+        typing_tracker.update(room_id, user_id, data.get("is_typing", True) is not False)
+        return
+    if not isinstance(data, dict) or "type" not in data or "content" not in data:
+        return
+    MESSAGES_RECEIVED.inc("websocket")
+    reply_to = data.get("reply_to")
+    if reply_to is not None and (
+        not isinstance(reply_to, str) or not await db.existing_messages(room_id, [reply_to])
+    ):
+        # Only a message stored in this room can be replied to
+        await manager.send(websocket, _error_frame("Parent message not found", room_id))
+        return
+
+    try:
+        message = Message(
+            id=str(uuid.uuid4()),
+            room_id=room_id,
+            user_id=user_id,
+            content=data["content"],
+            type=data["type"],
+            reply_to=reply_to,
+            created_at=datetime.utcnow()
+        )
+    except ValidationError as e:
+        # Report it on this room and keep the socket reading
+        error = e.errors()[0]
+        await manager.send(websocket, _error_frame(f"Invalid {error['loc'][0]}: {error['msg']}", room_id))
+        return
+
+    typing_tracker.stopped(room_id, user_id)
+    if room_actors.running:
+        # The room's actor saves and broadcasts it; this socket goes back to reading
+        if not room_actors.submit(message, websocket):
+            await manager.send(websocket, _error_frame("Room is busy, message not sent", room_id))
+        return
+
+    # Save message and broadcast to room
+    await db.save_message(message)
+    frames = await encode_messages(db, [message])
+    await manager.broadcast_json(room_id, frames[0])
+
 @api_router.websocket("/ws/{room_id}/{user_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     room_id: str = Path(..., description="The ID of the room to connect to"),
     user_id: str = Path(..., description="The ID of the user connecting"),
+    include_users: bool = False,
     db: DatabaseInterface = Depends(get_database)
 ):
     """WebSocket endpoint for chat."""
@@ -191,40 +679,138 @@ async def websocket_endpoint(
             return
 
         # Connect to WebSocket
-        await manager.connect(websocket, room_id, user_id)
+        if not await manager.connect(websocket, room_id, user_id):
+            return
         
         try:
             # Send chat history
-            messages = await db.get_room_messages(room_id)
-            await websocket.send_json({
-                "type": "history",
-                "messages": [msg.dict() for msg in messages]
-            })
+            await manager.send(websocket, await _history_frame(db, room_id, include_users))
 
             # Handle messages
+            route = f"WS {websocket.scope['route'].path}"
             while True:
-                data = await websocket.receive_json()
-                if not isinstance(data, dict) or "type" not in data or "content" not in data:
-                    continue
+                data = await manager.receive(websocket)
+                # Any frame, including a pong, shows the connection is alive
+                connection_reaper.touch(websocket)
+                if profiler.should_profile(websocket.scope["headers"]):
+                    async with profiler.profile("websocket", route):
+                        await _handle_frame(db, websocket, room_id, user_id, data)
+                else:
+                    await _handle_frame(db, websocket, room_id, user_id, data)
+
+        except WebSocketDisconnect:
+            await manager.close_socket(user_id, websocket)
+        except Exception as e:
+            logger.error(f"WebSocket error: {e}")
+            await manager.close_socket(user_id, websocket)
+            await websocket.close(code=1011, reason="Internal server error")
+    except Exception as e:
+        logger.error(f"WebSocket setup error: {e}")
+        await websocket.close(code=1011, reason="Internal server error")
 
-                message = Message(
-                    id=str(uuid.uuid4()),
-                    room_id=room_id,
-                    user_id=user_id,
-                    content=data["content"],
-                    type=MessageType(data["type"]),
-                    created_at=datetime.utcnow()
-                )
+def _error_frame(detail: str, room_id: Optional[str] = None) -> str:
+    return json.dumps({"type": "error", "room_id": room_id, "detail": detail})
 
-                # Save message and broadcast to room
-                await db.save_message(message)
-                await manager.broadcast_to_room(room_id, message.dict())
+async def _subscribe(
+    db: DatabaseInterface,
+    websocket: WebSocket,
+    user_id: str,
+    room_ids: List[str],
+    include_users: bool
+) -> None:
+    """Subscribe a session socket to rooms and send each room's history frame."""
+    new_ids = [
+        room_id for room_id in dict.fromkeys(room_ids)
+        if not manager.is_subscribed(websocket, room_id, user_id)
+    ]
+    subscribed = manager.registry.socket_room_count(websocket, user_id)
+    if subscribed + len(new_ids) > settings.WS_SESSION_MAX_ROOMS:
+        await manager.send(websocket, _error_frame(f"At most {settings.WS_SESSION_MAX_ROOMS} rooms per session"))
+        return
+    found = await db.existing_rooms(new_ids)
+    for room_id in new_ids:
+        if room_id not in found:
+            await manager.send(websocket, _error_frame("Room not found", room_id))
+        else:
+            manager.subscribe(websocket, room_id, user_id)
+    # Fetch the histories concurrently rather than one room after another
+    frames = await asyncio.gather(*(
+        _history_frame(db, room_id, include_users) for room_id in new_ids if room_id in found
+    ))
+    for frame in frames:
+        await manager.send(websocket, frame)
+
+async def _handle_session_frame(
+    db: DatabaseInterface,
+    websocket: WebSocket,
+    user_id: str,
+    data: dict,
+    include_users: bool = False
+):
+    """Handle one frame received on a session WebSocket."""
+    if not isinstance(data, dict):
+        return
+    kind = data.get("type")
+    room_ids = data.get("room_ids") or ([data["room_id"]] if data.get("room_id") else [])
+    if not all(isinstance(room_id, str) for room_id in room_ids):
+        await manager.send(websocket, _error_frame("Room IDs must be strings"))
+        return
+
+    if kind == "subscribe":
+        await _subscribe(db, websocket, user_id, room_ids, include_users)
+    elif kind == "unsubscribe":
+        for room_id in room_ids:
+            if not manager.is_subscribed(websocket, room_id, user_id):
+                await manager.send(websocket, _error_frame("Not subscribed to the room", room_id))
+                continue
+            await manager.disconnect(room_id, user_id, websocket)
+            await manager.send(websocket, json.dumps({"type": "unsubscribed", "room_id": room_id}))
+    elif kind in ("pong", "ping"):
+        return
+    elif len(room_ids) != 1 or not manager.is_subscribed(websocket, room_ids[0], user_id):
+        await manager.send(websocket, _error_frame("Not subscribed to the room", data.get("room_id")))
+    else:
+        await _handle_frame(db, websocket, room_ids[0], user_id, data)
+
+@api_router.websocket("/ws/{user_id}")
+async def session_endpoint(
+    websocket: WebSocket,
+    user_id: str = Path(..., description="The ID of the user connecting"),
+    include_users: bool = False,
+    db: DatabaseInterface = Depends(get_database)
+):
+    """WebSocket session for one user across many rooms.
+
+    Rooms are joined and left with ``subscribe`` / ``unsubscribe`` frames
+    carrying ``room_id`` or ``room_ids``. Every frame in either direction
+    names its room, so one socket replaces one connection per room.
+    """
+    try:
+        user = await db.get_user(user_id)
+        if not user:
+            await websocket.close(code=4004, reason="User not found")
+            return
+
+        if not await manager.accept(websocket, user_id, " for a session"):
+            return
+
+        try:
+            route = f"WS {websocket.scope['route'].path}"
+            while True:
+                data = await manager.receive(websocket)
+                # Any frame, including a pong, shows the connection is alive
+                connection_reaper.touch(websocket)
+                if profiler.should_profile(websocket.scope["headers"]):
+                    async with profiler.profile("websocket", route):
+                        await _handle_session_frame(db, websocket, user_id, data, include_users)
+                else:
+                    await _handle_session_frame(db, websocket, user_id, data, include_users)
 
         except WebSocketDisconnect:
-            await manager.disconnect(websocket, room_id, user_id)
+            await manager.close_socket(user_id, websocket)
         except Exception as e:
             logger.error(f"WebSocket error: {e}")
-            await manager.disconnect(websocket, room_id, user_id)
+            await manager.close_socket(user_id, websocket)
             await websocket.close(code=1011, reason="Internal server error")
     except Exception as e:
         logger.error(f"WebSocket setup error: {e}")
@@ -22,8 +22,40 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
     # Chat Settings
-    MAX_MESSAGES_PER_ROOM: int = 100
+    MAX_MESSAGES_PER_ROOM: int = 100  # newest messages served as a room's history
     MESSAGE_EXPIRY_DAYS: int = 30
+    ARCHIVE_MAX_MESSAGES: int = 100000  # messages kept per room for search, threads and user indexes
+    # Serve history by joining stored JSON documents without re-parsing them.
+    # Stored messages are written with the API's own serializer, so this is
+    # only worth disabling if the stored and wire formats ever diverge.
+    HISTORY_RAW_PASSTHROUGH: bool = True
+    EXPORT_CHUNK_SIZE: int = 500  # messages read from Redis per round trip when exporting
+    IMPORT_BATCH_SIZE: int = 1000  # messages validated and written per pipeline when importing
+    IMPORT_MAX_ERRORS: int = 100  # per-item errors listed in an import report
+    IMPORT_MAX_ITEM_BYTES: int = 1048576  # largest single message accepted in an import body
+    BATCH_GET_MAX_IDS: int = 100  # IDs accepted by one batchGet request
+    USER_INDEX_MAX_MESSAGES: int = 10000  # newest messages kept in each user's message index
+
+    # Profile cache (author profiles embedded in history and broadcasts)
+    PROFILE_CACHE_TTL: float = 300.0  # seconds
+    PROFILE_CACHE_SIZE: int = 10000
+    BROADCAST_EMBED_AUTHOR: bool = False  # add the author's profile to broadcast message frames
+
+    # Retention (messages older than MESSAGE_EXPIRY_DAYS are swept in the background)
+    RETENTION_ENABLED: bool = True
+    RETENTION_INTERVAL: float = 5.0  # seconds between sweep steps
+    RETENTION_BATCH_ROOMS: int = 100  # rooms per SSCAN call
+    RETENTION_TIME_BUDGET_MS: float = 50.0  # work per sweep step before yielding
+    RETENTION_MAX_TRIM: int = 500  # messages removed per room per step
+
+    # Search
+    SEARCH_ENABLED: bool = True  # index message terms on write
+    SEARCH_MAX_TERMS: int = 64  # distinct terms indexed per message
+    SEARCH_MAX_POSTINGS: int = 10000  # newest messages kept per term and room
+    SEARCH_MAX_SCAN: int = 10000  # postings read per query before giving up
+
+    # Threads (replies indexed by reply_to)
+    HISTORY_REPLY_COUNTS: bool = True  # add reply counts to WebSocket history frames
     
     # Rate limiting
     RATE_LIMIT_REQUESTS: int = 60
@@ -31,14 +63,68 @@ class Settings(BaseSettings):
     
     # Monitoring
     ENABLE_METRICS: bool = True
+    LOOP_LAG_SAMPLE_INTERVAL: float = 0.1  # seconds
+    LOOP_LAG_WINDOW: int = 600  # samples kept for percentiles
+
+    # Redis tracing
+    REDIS_SLOW_THRESHOLD_MS: float = 10.0  # 0 disables the slow log
+    REDIS_SLOWLOG_SIZE: int = 256
+    TRACING_ENABLED: bool = False
+    TRACE_BUFFER_SIZE: int = 10000  # spans kept for export
+    TRACE_EXPORT_DIR: str = "traces"
+
+    # Profiling (off by default)
+    PROFILING_ENABLED: bool = False
+    PROFILING_SAMPLE_RATE: float = 0.01  # fraction of requests and WebSocket frames
+    PROFILING_HEADER: str = "X-Profile"  # always profile requests carrying this header
+    PROFILING_OUTPUT_DIR: str = "profiles"
+    PROFILING_INTERVAL_MS: float = 1.0  # stack sampling interval
+
+    # Load shedding
+    LOAD_SHEDDING_ENABLED: bool = True
+    LOAD_SHEDDING_LAG_THRESHOLD_MS: int = 250
     
     # Security
     CORS_ORIGINS: list[str] = ["*"]
     CORS_HEADERS: list[str] = ["*"]
     
     # WebSocket Settings
-    WS_HEARTBEAT_INTERVAL: int = 30
-    WS_PING_INTERVAL: int = 20
+    WS_HEARTBEAT_INTERVAL: int = 30  # seconds between presence refreshes of every local socket
+    WS_PING_INTERVAL: int = 20  # seconds of silence before the server pings a socket
+    WS_PONG_TIMEOUT: int = 10  # seconds to answer a ping before the socket is closed
+    WS_REAPER_ENABLED: bool = True
+    WS_REAPER_TICK: float = 1.0  # timer wheel resolution in seconds
+    WS_SESSION_MAX_ROOMS: int = 100  # rooms one session socket can subscribe to
+    WS_MSGPACK_ENABLED: bool = True  # offer the chat.msgpack subprotocol (needs the msgpack package)
+
+    # Broadcast fan-out (rooms larger than one shard are sent by concurrent shard tasks)
+    FANOUT_SHARD_SIZE: int = 1000  # members per shard; smaller rooms are sent in one loop
+    FANOUT_ROOM_CONCURRENCY: int = 4  # shards of one room being sent at once
+    FANOUT_MAX_CONCURRENCY: int = 32  # shards being sent at once across the worker
+
+    # Room actors (WebSocket messages are saved and broadcast in order by one task per active room)
+    ROOM_ACTORS_ENABLED: bool = True
+    ROOM_BATCH_WINDOW: float = 0.005  # seconds an actor waits for more messages before saving a batch
+    ROOM_BATCH_MAX: int = 100  # messages saved and broadcast together at most
+    ROOM_QUEUE_MAX: int = 1000  # queued messages per room before senders get an error frame
+
+    # Hot rooms (busy rooms send periodic digest frames instead of every message; needs room actors)
+    DIGEST_ENABLED: bool = True
+    DIGEST_RATE: float = 50.0  # messages per second a room can receive before switching to digests
+    DIGEST_MIN_MEMBERS: int = 100  # local members a room needs before it can switch
+    DIGEST_INTERVAL: float = 1.0  # seconds between digest frames; also the rate measurement window
+    DIGEST_MAX_MESSAGES: int = 50  # messages sampled into one digest frame
+
+    # Presence (who is online per room, shared by all workers)
+    PRESENCE_ENABLED: bool = True
+    PRESENCE_FLUSH_INTERVAL: float = 1.0  # seconds joins/leaves are coalesced before writing and broadcasting
+    PRESENCE_TIMEOUT: int = 90  # seconds without a heartbeat before a user counts as offline
+
+    # Typing indicators (kept in memory per worker, never stored)
+    TYPING_ENABLED: bool = True
+    TYPING_THROTTLE: float = 2.0  # seconds between typing events accepted from one user in a room
+    TYPING_TIMEOUT: float = 6.0  # seconds a user stays typing without another event
+    TYPING_FLUSH_INTERVAL: float = 1.0  # seconds between coalesced typing frames
     
     class Config:
         case_sensitive = True
@@ -18,6 +18,11 @@ class ChatClient {
 
         this.ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
+            if (data.type === 'ping') {
+                // Idle connections are closed unless they answer the server's pings
+                this.ws.send(JSON.stringify({ type: 'pong' }));
+                return;
+            }
             const handler = this.messageHandlers.get(data.type);
             if (handler) {
                 handler(data);
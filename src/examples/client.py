@@ -5,11 +5,45 @@ import aiohttp
 from typing import Dict, Any, Callable, Optional
 from datetime import datetime
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_PROTOCOL = "chat.json"
+MSGPACK_PROTOCOL = "chat.msgpack"
+
+# Field names on msgpack frames (the server's SHORT_KEYS)
+SHORT_KEYS = {
+    "type": "t", "id": "i", "room_id": "r", "room_ids": "rs", "user_id": "u", "user": "a",
+    "username": "un", "content": "c", "created_at": "ts", "updated_at": "ua", "metadata": "md",
+    "reply_to": "rt", "reply_counts": "rc", "messages": "m", "count": "n", "users": "us",
+    "joined": "j", "left": "l", "is_typing": "ty", "detail": "d", "next_cursor": "nc",
+}
+LONG_KEYS = {short: name for name, short in SHORT_KEYS.items()}
+# Maps keyed by IDs, and user data, keep their keys
+OPAQUE = {"metadata", "reply_counts", "users", "md", "rc", "us"}
+
+def rename(value: Any, keys: Dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        return {keys.get(k, k): v if k in OPAQUE else rename(v, keys) for k, v in value.items()}
+    if isinstance(value, list):
+        return [rename(item, keys) for item in value]
+    return value
+
+def pack(frame: Dict[str, Any]) -> bytes:
+    return msgpack.packb(rename(frame, SHORT_KEYS), use_bin_type=True)
+
+def unpack(data: bytes) -> Any:
+    return rename(msgpack.unpackb(data, raw=False), LONG_KEYS)
+
 class ChatClient:
-    def __init__(self, room_id: str, user_id: str, base_url: str = "http://localhost:8000"):
+    def __init__(self, room_id: str, user_id: str, base_url: str = "http://localhost:8000", binary: bool = False):
         self.room_id = room_id
         self.user_id = user_id
         self.base_url = base_url
+        # Ask for compact msgpack frames; JSON is used if the server (or this client) lacks msgpack
+        self.binary = binary and msgpack is not None
         self.ws = None
         self.message_handlers: Dict[str, Callable] = {}
         self.connected = False
@@ -17,7 +51,9 @@ class ChatClient:
     async def connect(self):
         """Connect to the WebSocket server"""
         ws_url = f"ws://localhost:8000/ws/{self.room_id}/{self.user_id}"
-        self.ws = await websockets.connect(ws_url)
+        subprotocols = [MSGPACK_PROTOCOL, JSON_PROTOCOL] if self.binary else None
+        self.ws = await websockets.connect(ws_url, subprotocols=subprotocols)
+        self.binary = self.ws.subprotocol == MSGPACK_PROTOCOL
         self.connected = True
         print("Connected to chat server")
 
@@ -43,7 +79,10 @@ class ChatClient:
             "reply_to": reply_to
         }
 
-        await self.ws.send(json.dumps(message))
+        await self._send(message)
+
+    async def _send(self, frame: Dict[str, Any]):
+        await self.ws.send(pack(frame) if self.binary else json.dumps(frame))
 
     def on_message(self, handler: Callable):
         """Register a handler for new messages"""
@@ -66,10 +105,17 @@ class ChatClient:
         try:
             while True:
                 message = await self.ws.recv()
-                data = json.loads(message)
-                handler = self.message_handlers.get(data["type"])
-                if handler:
-                    await handler(data)
+                data = unpack(message) if isinstance(message, bytes) else json.loads(message)
+                if data.get("type") == "ping":
+                    # Idle connections are closed unless they answer the server's pings
+                    await self._send({"type": "pong"})
+                    continue
+                # Messages sent together arrive as one batch frame, oldest first; busy
+                # rooms send a digest frame with a sample of the messages instead
+                for frame in data["messages"] if data["type"] in ("batch", "digest") else (data,):
+                    handler = self.message_handlers.get(frame["type"])
+                    if handler:
+                        await handler(frame)
         except websockets.exceptions.ConnectionClosed:
             print("Connection closed")
             self.connected = False
@@ -1,11 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from contextlib import asynccontextmanager
 from src.config.settings import get_settings
 from src.api.v1.router import api_router
 from src.dependencies import get_database
+from src.middleware.metrics import MetricsMiddleware
+from src.middleware.profiler import ProfilingMiddleware
+from src.services.metrics import metrics, CONTENT_TYPE
+from src.services.loop_monitor import loop_monitor
+from src.services.retention import retention_sweeper
+from src.services.presence import presence_tracker
+from src.services.reaper import connection_reaper
+from src.services.room_actors import room_actors
+from src.services.typing_indicators import typing_tracker
+from src.services.websocket import manager
 import logging
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
@@ -23,8 +33,20 @@ async def lifespan(app: FastAPI):
     try:
         await get_database().connect()
         logger.info("Connected to Redis")
+        loop_monitor.start()
+        retention_sweeper.start(get_database())
+        presence_tracker.start(get_database(), manager)
+        connection_reaper.start(manager)
+        typing_tracker.start(manager)
+        room_actors.start(get_database(), manager)
         yield
     finally:
+        await room_actors.stop()
+        await typing_tracker.stop()
+        await connection_reaper.stop()
+        await presence_tracker.stop(get_database(), manager)
+        await retention_sweeper.stop()
+        await loop_monitor.stop()
         await get_database().disconnect()
         logger.info("Disconnected from Redis")
 
@@ -71,6 +93,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency metrics
+if settings.ENABLE_METRICS:
+    app.add_middleware(MetricsMiddleware)
+
+# Sampled request profiling
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -145,6 +175,13 @@ async def custom_swagger_ui_html():
         }
     )
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Expose metrics in the Prometheus text exposition format"""
+    if not metrics.enabled:
+        return Response(status_code=404)
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
 @app.get("/docs", include_in_schema=False)
 async def docs_redirect():
     """Redirect /docs to root path"""
@@ -3,5 +3,14 @@ Middleware package.
 """
 
 from .rate_limiter import RateLimiter
+from .metrics import MetricsMiddleware
+from .load_shedding import check_load_shedding
+from .profiler import ProfilingMiddleware, profiler
 
-__all__ = ['RateLimiter'] 
\ No newline at end of file
+__all__ = [
+    'RateLimiter',
+    'MetricsMiddleware',
+    'check_load_shedding',
+    'ProfilingMiddleware',
+    'profiler'
+] 
\ No newline at end of file
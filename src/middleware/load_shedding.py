@@ -0,0 +1,20 @@
+from fastapi import HTTPException
+import logging
+from src.services.loop_monitor import loop_monitor, REQUESTS_SHED
+
+logger = logging.getLogger(__name__)
+
+# Create a dependency function for non-critical endpoints
+async def check_load_shedding():
+    """Reject the request with 503 while the event loop is overloaded"""
+    if loop_monitor.is_overloaded():
+        REQUESTS_SHED.inc("http")
+        logger.warning(f"Shedding request, event loop lag {loop_monitor.current_lag() * 1000:.0f}ms")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is overloaded. Please try again later.",
+            headers={"Retry-After": "1"}
+        )
+    return None
+
+__all__ = ['check_load_shedding']
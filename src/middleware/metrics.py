@@ -0,0 +1,26 @@
+from starlette.types import ASGIApp, Receive, Scope, Send
+import time
+from src.services.metrics import metrics, HTTP_LATENCY
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP handler latency per route template."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # The router stores the matched route in the scope; use its template
+            # so that per-ID paths collapse into a single series
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "__unmatched__"
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], path)
+
+__all__ = ['MetricsMiddleware']
@@ -0,0 +1,159 @@
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from starlette.types import ASGIApp, Receive, Scope, Send
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from src.config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class _StackSampler(threading.Thread):
+    """Samples the call stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._stop_event = threading.Event()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            try:
+                filename = os.path.relpath(filename)
+            except ValueError:
+                pass
+            label = self._labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+        return label
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class ProfileSession:
+    """Tags of an in-progress profile; the route can be refined once known."""
+
+    __slots__ = ("kind", "route")
+
+    def __init__(self, kind: str, route: str):
+        self.kind = kind
+        self.route = route
+
+class Profiler:
+    """Statistical profiler for sampled requests and WebSocket frames.
+
+    Profiles are written as collapsed stacks ("frame;frame;frame count"),
+    the input format of flamegraph.pl and speedscope. The sampler sees the
+    whole event-loop thread, so time spent by other tasks that ran while the
+    profiled request was awaiting shows up in the same profile. Only one
+    profile is taken at a time.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = settings.PROFILING_ENABLED,
+        sample_rate: float = settings.PROFILING_SAMPLE_RATE,
+        header: str = settings.PROFILING_HEADER,
+        output_dir: str = settings.PROFILING_OUTPUT_DIR,
+        interval: float = settings.PROFILING_INTERVAL_MS / 1000
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode("latin-1")
+        self.output_dir = output_dir
+        self.interval = interval
+        self._active = False
+
+    def should_profile(self, headers: Iterable[Tuple[bytes, bytes]] = ()) -> bool:
+        """Decide whether to profile, by explicit header or random sampling"""
+        if not self.enabled or self._active:
+            return False
+        for name, _ in headers:
+            if name == self.header:
+                return True
+        return random.random() < self.sample_rate
+
+    @asynccontextmanager
+    async def profile(self, kind: str, route: str):
+        """Sample the event-loop thread for the duration of the block"""
+        self._active = True
+        session = ProfileSession(kind, route)
+        sampler = _StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            yield session
+        finally:
+            duration = time.perf_counter() - start
+            sampler.stop()
+            self._active = False
+            try:
+                await asyncio.to_thread(self._write, session, duration, sampler.stacks)
+            except Exception as e:
+                logger.error(f"Error writing profile for {session.route}: {e}")
+
+    def _write(self, session: ProfileSession, duration: float, stacks: Counter) -> Optional[str]:
+        if not stacks:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        kind, route = session.kind, session.route
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", route).strip("_") or "root"
+        timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(
+            self.output_dir,
+            f"{timestamp}-{kind}-{slug}-{duration * 1000:.1f}ms.collapsed"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {kind} profile for {route} ({duration * 1000:.1f}ms) to {path}")
+        return path
+
+# Create a singleton instance
+profiler = Profiler()
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling a sampled fraction of HTTP requests."""
+
+    def __init__(self, app: ASGIApp, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        async with self.profiler.profile("http", scope["path"]) as session:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Tag the profile with the route template once routing is done
+                route = scope.get("route")
+                if route is not None:
+                    session.route = f"{scope['method']} {route.path}"
+
+__all__ = ['Profiler', 'ProfilingMiddleware', 'profiler']
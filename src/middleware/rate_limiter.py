@@ -2,8 +2,10 @@ from fastapi import HTTPException, Request
 from datetime import datetime, timedelta
 from typing import Dict, Tuple
 import logging
+from src.config.settings import get_settings
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
 
 class RateLimiter:
     def __init__(self, requests_per_minute: int = 60):
@@ -36,7 +38,7 @@ class RateLimiter:
         self.requests[client_ip] = (now, count + 1)
 
 # Create a singleton instance
-rate_limiter = RateLimiter()
+rate_limiter = RateLimiter(settings.RATE_LIMIT_REQUESTS)
 
 # Create a dependency function
 async def check_rate_limit(request: Request):
@@ -1,12 +1,16 @@
-from .message import Message, MessageType
+from .message import Message, MessageType, MessageRef, MESSAGE_LIST_ADAPTER, MESSAGE_REFS_ADAPTER
 from .chat_room import ChatRoom
-from .user import User, ChatResponse, TypingStatus
+from .user import User, ChatResponse, TypingStatus, USER_MAP_ADAPTER
 
 __all__ = [
     'Message',
     'MessageType',
+    'MESSAGE_LIST_ADAPTER',
+    'MessageRef',
+    'MESSAGE_REFS_ADAPTER',
     'ChatRoom',
     'User',
+    'USER_MAP_ADAPTER',
     'ChatResponse',
     'TypingStatus'
 ] 
\ No newline at end of file
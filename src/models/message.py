@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from enum import Enum
 
 class MessageType(str, Enum):
@@ -32,4 +32,14 @@ class Message(BaseModel):
                 "reply_to": None,
                 "type": "text"
             }
-        } 
\ No newline at end of file
+        }
+
+# Precompiled adapter for (de)serializing message pages in one pass
+MESSAGE_LIST_ADAPTER = TypeAdapter(List[Message])
+
+class MessageRef(BaseModel):
+    """The identifying fields of a stored message, for reading pages without full validation"""
+    id: str
+    user_id: str
+
+MESSAGE_REFS_ADAPTER = TypeAdapter(List[MessageRef])
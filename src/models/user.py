@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
 from datetime import datetime
 from typing import Optional, Dict, Any
 from enum import Enum
@@ -32,4 +32,7 @@ class User(BaseModel):
                 }
             }
         }
-    ) 
\ No newline at end of file
+    )
+
+# Precompiled adapter for encoding user_id -> profile maps
+USER_MAP_ADAPTER = TypeAdapter(Dict[str, User])
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
 from src.models.chat_room import ChatRoom
 from src.models.user import User
 from src.models.message import Message
@@ -27,6 +28,11 @@ class DatabaseInterface(ABC):
         """Get a chat room by ID."""
         pass
     
+    @abstractmethod
+    async def get_rooms_by_ids(self, room_ids: Iterable[str]) -> Dict[str, ChatRoom]:
+        """Get chat rooms by ID, keyed by ID; unknown IDs are left out."""
+        pass
+    
     @abstractmethod
     async def get_rooms(self) -> List[ChatRoom]:
         """Get all chat rooms."""
@@ -42,6 +48,11 @@ class DatabaseInterface(ABC):
         """Get a user by ID."""
         pass
     
+    @abstractmethod
+    async def get_users_by_ids(self, user_ids: Iterable[str]) -> Dict[str, User]:
+        """Get users by ID, keyed by ID; unknown IDs are left out."""
+        pass
+    
     @abstractmethod
     async def get_users(self) -> List[User]:
         """Get all users."""
@@ -53,6 +64,124 @@ class DatabaseInterface(ABC):
         pass
     
     @abstractmethod
-    async def get_room_messages(self, room_id: str, limit: int = 50) -> List[Message]:
-        """Get messages from a room."""
-        pass 
\ No newline at end of file
+    async def save_messages(self, messages: List[Message]) -> None:
+        """Save a batch of messages in order."""
+        pass
+    
+    @abstractmethod
+    async def existing_rooms(self, room_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of room IDs that exist."""
+        pass
+    
+    @abstractmethod
+    async def existing_users(self, user_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of user IDs that exist."""
+        pass
+    
+    @abstractmethod
+    async def existing_messages(self, room_id: str, message_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of message IDs stored in a room."""
+        pass
+    
+    @abstractmethod
+    async def get_room_messages(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[Message]:
+        """Get messages from a room, newest first, optionally created in [start, end)."""
+        pass
+    
+    @abstractmethod
+    async def get_room_messages_raw(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[str]:
+        """Get messages from a room as their stored JSON documents."""
+        pass
+
+    @abstractmethod
+    async def get_room_history_raw(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Tuple[List[str], Dict[str, int]]:
+        """Stored JSON documents of a page of history and the reply counts of its messages by ID."""
+        pass
+
+    @abstractmethod
+    def iter_room_messages_raw(
+        self,
+        room_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> AsyncIterator[List[str]]:
+        """Iterate over a room's stored JSON documents in chunks, oldest first."""
+        pass
+
+    @abstractmethod
+    async def sweep_expired_messages(
+        self,
+        batch_size: int,
+        time_budget: float,
+        lock_ttl: float
+    ) -> Optional[Dict[str, int]]:
+        """Remove expired messages from the next rooms in the retention sweep."""
+        pass
+
+    @abstractmethod
+    async def search_messages_raw(
+        self,
+        terms: List[str],
+        room_id: Optional[str] = None,
+        limit: int = 20
+    ) -> List[str]:
+        """Stored JSON documents of messages containing every term, newest first."""
+        pass
+
+    @abstractmethod
+    async def get_user_messages_raw(
+        self,
+        user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        """A user's messages across rooms, newest first, and the cursor of the next page."""
+        pass
+
+    @abstractmethod
+    async def get_thread_raw(
+        self,
+        room_id: str,
+        message_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[str], int, Optional[str]]:
+        """Replies to a message, oldest first, its reply count, and the cursor of the next page."""
+        pass
+
+    @abstractmethod
+    async def update_presence(
+        self,
+        present: Dict[str, Iterable[str]],
+        absent: Dict[str, Iterable[str]],
+        timeout: float
+    ) -> Dict[str, List[str]]:
+        """Mark users present in or gone from rooms on this worker; return who left each room.
+
+        A user has left once no worker has them present, whether they
+        disconnected or their entries timed out.
+        """
+        pass
+
+    @abstractmethod
+    async def get_presence(self, room_id: str, timeout: float) -> List[str]:
+        """IDs of the users seen in a room within the last ``timeout`` seconds."""
+        pass
@@ -1,18 +1,54 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
+import time
 import uuid
 import logging
-from typing import List, Optional
+from functools import wraps
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
 from redis.asyncio import Redis
+from redis.exceptions import WatchError
 from src.models.chat_room import ChatRoom
 from src.models.user import User
-from src.models.message import Message
+from src.models.message import Message, MESSAGE_LIST_ADAPTER
 from src.config.settings import get_settings
+from src.services.metrics import REDIS_LATENCY, MESSAGES_SAVED, WORKER_ID
+from src.services.tracing import TracedRedis, current_operation
+from src.services.search import ALL_ROOMS, postings_key, tokenize
 from .interface import DatabaseInterface
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+_EPOCH = datetime(1970, 1, 1)
+
+# Names this process in presence entries; a PID alone can repeat across hosts
+_PRESENCE_WORKER = f"{WORKER_ID}-{uuid.uuid4().hex[:8]}"
+
+def _score(value: datetime) -> int:
+    """Timeline score for a timestamp: microseconds since the epoch, exact in a double."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+def _presence_user(member: str) -> str:
+    """The user ID of a presence entry; entries written before workers were named are bare IDs."""
+    return member.rpartition("/")[0] or member
+
+def _operation(func):
+    """Time a database method and tag the Redis calls it makes with its name."""
+    timed = REDIS_LATENCY.timed(func)
+    name = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_operation.set(name)
+        try:
+            return await timed(*args, **kwargs)
+        finally:
+            current_operation.reset(token)
+
+    return wrapper
+
 class RedisDatabase(DatabaseInterface):
     """Redis implementation of the database interface."""
     
@@ -29,9 +65,23 @@ class RedisDatabase(DatabaseInterface):
         return self._client
 
     async def connect(self) -> None:
-        """Connect to Redis."""
+        """Connect to Redis.
+
+        ``REDIS_URL=memory://`` uses an in-process fakeredis server instead,
+        for local benchmarks and development without a Redis server. It is
+        per process, so it only makes sense with a single worker. Its
+        commands are traced like those sent to a real server.
+        """
         if not self._client:
-            self._client = await Redis.from_url(
+            if settings.REDIS_URL.startswith("memory://"):
+                try:
+                    from fakeredis.aioredis import FakeRedis
+                except ImportError:
+                    raise RuntimeError("REDIS_URL=memory:// requires the fakeredis package")
+                fake = FakeRedis(encoding="utf-8", decode_responses=True)
+                self._client = TracedRedis(connection_pool=fake.connection_pool)
+                return
+            self._client = await TracedRedis.from_url(
                 settings.REDIS_URL,
                 encoding="utf-8",
                 decode_responses=True
@@ -48,6 +98,7 @@ class RedisDatabase(DatabaseInterface):
         if not self._client:
             await self.connect()
             
+    @_operation
     async def create_room(self, name: str) -> ChatRoom:
         """Create a new chat room."""
         await self._ensure_connection()
@@ -74,6 +125,35 @@ class RedisDatabase(DatabaseInterface):
         await self._client.sadd("rooms", room_id)
         return room
         
+    @staticmethod
+    def _room_from_hash(room_data: Dict[str, str]) -> ChatRoom:
+        return ChatRoom(
+            id=room_data["id"],
+            name=room_data["name"],
+            created_at=datetime.fromisoformat(room_data["created_at"])
+        )
+        
+    @staticmethod
+    def _user_from_hash(user_data: Dict[str, str]) -> User:
+        return User(
+            id=user_data["id"],
+            username=user_data["username"],
+            created_at=datetime.fromisoformat(user_data["created_at"])
+        )
+        
+    async def _hgetall_many(self, prefix: str, ids: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """HGETALL ``{prefix}:{id}`` for each ID in one pipeline; missing hashes are left out."""
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return {}
+        await self._ensure_connection()
+        pipe = self._client.pipeline(transaction=False)
+        for id_ in ids:
+            pipe.hgetall(f"{prefix}:{id_}")
+        results = await pipe.execute()
+        return {id_: data for id_, data in zip(ids, results) if data}
+        
+    @_operation
     async def get_room(self, room_id: str) -> Optional[ChatRoom]:
         """Get a chat room by ID."""
         await self._ensure_connection()
@@ -82,25 +162,22 @@ class RedisDatabase(DatabaseInterface):
         if not room_data:
             return None
             
-        return ChatRoom(
-            id=room_data["id"],
-            name=room_data["name"],
-            created_at=datetime.fromisoformat(room_data["created_at"])
-        )
+        return self._room_from_hash(room_data)
         
+    @_operation
+    async def get_rooms_by_ids(self, room_ids: Iterable[str]) -> Dict[str, ChatRoom]:
+        """Get chat rooms by ID with one pipelined read; unknown IDs are left out."""
+        found = await self._hgetall_many("room", room_ids)
+        return {room_id: self._room_from_hash(data) for room_id, data in found.items()}
+        
+    @_operation
     async def get_rooms(self) -> List[ChatRoom]:
         """Get all chat rooms."""
         await self._ensure_connection()
         room_ids = await self._client.smembers("rooms")
-        rooms = []
-        
-        for room_id in room_ids:
-            room = await self.get_room(room_id)
-            if room:
-                rooms.append(room)
-                
-        return rooms
+        return list((await self.get_rooms_by_ids(room_ids)).values())
         
+    @_operation
     async def create_user(self, username: str) -> User:
         """Create a new user."""
         await self._ensure_connection()
@@ -127,6 +204,7 @@ class RedisDatabase(DatabaseInterface):
         await self._client.sadd("users", user_id)
         return user
         
+    @_operation
     async def get_user(self, user_id: str) -> Optional[User]:
         """Get a user by ID."""
         await self._ensure_connection()
@@ -135,64 +213,682 @@ class RedisDatabase(DatabaseInterface):
         if not user_data:
             return None
             
-        return User(
-            id=user_data["id"],
-            username=user_data["username"],
-            created_at=datetime.fromisoformat(user_data["created_at"])
-        )
+        return self._user_from_hash(user_data)
+        
+    @_operation
+    async def get_users_by_ids(self, user_ids: Iterable[str]) -> Dict[str, User]:
+        """Get users by ID with one pipelined read; unknown IDs are left out."""
+        found = await self._hgetall_many("user", user_ids)
+        return {user_id: self._user_from_hash(data) for user_id, data in found.items()}
         
+    @_operation
     async def get_users(self) -> List[User]:
         """Get all users."""
         await self._ensure_connection()
         user_ids = await self._client.smembers("users")
-        users = []
+        return list((await self.get_users_by_ids(user_ids)).values())
         
-        for user_id in user_ids:
-            user = await self.get_user(user_id)
-            if user:
-                users.append(user)
-                
-        return users
+    def _write_messages(self, pipe, messages: List[Message], stored_replies: Set[str] = frozenset()) -> None:
+        """Queue the commands storing messages on a pipeline, grouped by room.
+
+        Each message is stored once, as the JSON document the API serves, in
+        the room's ``room:{room_id}:docs`` hash keyed by message ID. Its ID
+        goes into two sorted sets scored by ``created_at``: the room's
+        archive, ``room:{room_id}:archive``, which lists every stored
+        message, and its timeline, ``room:{room_id}:timeline``, the history
+        served by the API, capped at MAX_MESSAGES_PER_ROOM. A message trimmed
+        from the timeline stays in the archive, and in the indexes below,
+        until the retention sweep removes it from all of them (see
+        ``sweep_expired_messages``). Each write also sets the room's keys to
+        expire MESSAGE_EXPIRY_DAYS later, so a room the sweep never reaches
+        still loses its messages once they have all expired.
+
+        The message is also added to its author's index,
+        ``user:{user_id}:messages``, and with SEARCH_ENABLED its terms are
+        added to the search postings. Both expire like the room's keys, so
+        a user or term no longer seen doesn't keep its key. A reply is added
+        to its parent's thread index, ``room:{room_id}:thread:{reply_to}``,
+        and the parent's field in ``room:{room_id}:reply_counts`` is
+        incremented for each reply not in ``stored_replies``, the replies
+        already in their thread. Threads aren't capped on their own: the
+        retention sweep removes a reply from both, so the count always
+        matches the thread.
+        """
+        # room_id -> (documents by ID, scores by ID)
+        by_room: Dict[str, Tuple[Dict[str, str], Dict[str, int]]] = {}
+        by_user: Dict[str, Dict[str, int]] = {}
+        postings: Dict[str, Dict[str, int]] = {}
+        threads: Dict[Tuple[str, str], Dict[str, int]] = {}
+        for message in messages:
+            score = _score(message.created_at)
+            docs, scores = by_room.setdefault(message.room_id, ({}, {}))
+            # Stored in the same JSON shape the API serves
+            docs[message.id] = message.model_dump_json()
+            scores[message.id] = score
+            by_user.setdefault(message.user_id, {})[f"{message.room_id}/{message.id}"] = score
+            if message.reply_to:
+                threads.setdefault((message.room_id, message.reply_to), {})[message.id] = score
+            if settings.SEARCH_ENABLED:
+                for term in tokenize(message.content):
+                    postings.setdefault(postings_key(message.room_id, term), {})[message.id] = score
+                    postings.setdefault(postings_key(ALL_ROOMS, term), {})[
+                        f"{message.room_id}/{message.id}"
+                    ] = score
+
+        for room_id, (docs, scores) in by_room.items():
+            doc_key = f"room:{room_id}:docs"
+            archive = f"room:{room_id}:archive"
+            timeline = f"room:{room_id}:timeline"
+            pipe.hset(doc_key, mapping=docs)
+            pipe.zadd(archive, scores)
+            pipe.zadd(timeline, scores)
+            pipe.zremrangebyrank(timeline, 0, -(self._max_messages + 1))
+            for key in (doc_key, archive, timeline):
+                pipe.expire(key, self._message_expiry)
+        for user_id, members in by_user.items():
+            key = f"user:{user_id}:messages"
+            pipe.zadd(key, members)
+            pipe.zremrangebyrank(key, 0, -(settings.USER_INDEX_MAX_MESSAGES + 1))
+            pipe.expire(key, self._message_expiry)
+        for key, members in postings.items():
+            pipe.zadd(key, members)
+            pipe.zremrangebyrank(key, 0, -(settings.SEARCH_MAX_POSTINGS + 1))
+            pipe.expire(key, self._message_expiry)
+        for (room_id, parent_id), members in threads.items():
+            key = f"room:{room_id}:thread:{parent_id}"
+            counts = f"room:{room_id}:reply_counts"
+            pipe.zadd(key, members)
+            added = len(members.keys() - stored_replies)
+            if added:
+                pipe.hincrby(counts, parent_id, added)
+            # Every reply they hold is older than their last write
+            pipe.expire(key, self._message_expiry)
+            pipe.expire(counts, self._message_expiry)
         
+    async def _store_messages(self, messages: List[Message]) -> None:
+        """Write messages in one transaction, counting each reply once.
+
+        Saving a reply that is already in its thread, say from a retried
+        import, mustn't bump its parent's counter again. The thread keys
+        are watched while the replies already in them are read, and the
+        transaction is retried if another write touches them first.
+        """
+        replies: Dict[str, Dict[str, None]] = {}
+        for message in messages:
+            if message.reply_to:
+                replies.setdefault(f"room:{message.room_id}:thread:{message.reply_to}", {})[message.id] = None
+        async with self._client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    stored: Set[str] = set()
+                    if replies:
+                        await pipe.watch(*replies)
+                        for key, ids in replies.items():
+                            scores = await pipe.zmscore(key, list(ids))
+                            stored.update(id_ for id_, score in zip(ids, scores) if score is not None)
+                        pipe.multi()
+                    self._write_messages(pipe, messages, stored)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    @_operation
     async def save_message(self, message: Message) -> None:
-        """Save a message."""
+        """Save a message and index it in the same transaction."""
         await self._ensure_connection()
-        message_data = message.model_dump()  # Using model_dump instead of dict
-        message_data["created_at"] = message.created_at.isoformat()
-        message_data["type"] = message.type.value
+        await self._store_messages([message])
+        MESSAGES_SAVED.inc()
+        
+    @_operation
+    async def save_messages(self, messages: List[Message]) -> None:
+        """Save a batch of messages with one transactional round trip.
+
+        Messages for the same room are stored with a single HSET and ZADD
+        each, and each touched room's timeline is trimmed once per batch.
+        """
+        if not messages:
+            return
+        await self._ensure_connection()
+        await self._store_messages(messages)
+        MESSAGES_SAVED.inc(amount=len(messages))
+        
+    async def _existing(self, prefix: str, ids: Iterable[str]) -> Set[str]:
+        ids = list(ids)
+        if not ids:
+            return set()
+        await self._ensure_connection()
+        pipe = self._client.pipeline(transaction=False)
+        for id_ in ids:
+            pipe.exists(f"{prefix}:{id_}")
+        results = await pipe.execute()
+        return {id_ for id_, found in zip(ids, results) if found}
+        
+    @_operation
+    async def existing_rooms(self, room_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of room IDs that exist, checked in one pipeline."""
+        return await self._existing("room", room_ids)
+        
+    @_operation
+    async def existing_users(self, user_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of user IDs that exist, checked in one pipeline."""
+        return await self._existing("user", user_ids)
         
-        # Add message to room's message list
-        await self._client.lpush(
-            f"room:{message.room_id}:messages",
-            json.dumps(message_data)
+    @_operation
+    async def existing_messages(self, room_id: str, message_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of message IDs stored in a room, checked in one pipeline."""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+        await self._ensure_connection()
+        pipe = self._client.pipeline(transaction=False)
+        for message_id in message_ids:
+            pipe.hexists(f"room:{room_id}:docs", message_id)
+        results = await pipe.execute()
+        return {message_id for message_id, found in zip(message_ids, results) if found}
+        
+    async def _trim_room(self, room_id: str, cutoff: int) -> int:
+        """Remove up to RETENTION_MAX_TRIM of a room's oldest messages.
+
+        Messages created before ``cutoff`` go first, then the oldest of those
+        past ARCHIVE_MAX_MESSAGES. Messages already trimmed from the timeline
+        are still in the archive, so they are removed, with their index
+        entries, like any other.
+        """
+        archive = f"room:{room_id}:archive"
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zrangebyscore(archive, "-inf", f"({cutoff}", start=0, num=settings.RETENTION_MAX_TRIM)
+        pipe.zcard(archive)
+        expired, size = await pipe.execute()
+        excess = min(
+            size - len(expired) - settings.ARCHIVE_MAX_MESSAGES,
+            settings.RETENTION_MAX_TRIM - len(expired)
         )
+        if excess > 0:
+            # Expired messages are the oldest, so the excess follows them
+            expired += await self._client.zrange(archive, len(expired), len(expired) + excess - 1)
+        if expired:
+            await self._remove_messages(room_id, expired)
+        return len(expired)
+        
+    async def _remove_messages(self, room_id: str, message_ids: List[str]) -> None:
+        """Remove stored messages from a room, its archive and timeline, and every index."""
+        docs = f"room:{room_id}:docs"
+        counts = f"room:{room_id}:reply_counts"
+        rows = await self._client.hmget(docs, message_ids)
+        pipe = self._client.pipeline(transaction=True)
+        # A parent's counter stays while its replies, which may outlive it, are stored
+        # (parent ID, position of its HINCRBY in the pipeline)
+        parents: List[Tuple[str, int]] = []
+        for row in rows:
+            if row is None:
+                continue
+            message_data = json.loads(row)
+            self._unindex(pipe, room_id, message_data)
+            if message_data.get("reply_to"):
+                parents.append((message_data["reply_to"], len(pipe)))
+                pipe.hincrby(counts, message_data["reply_to"], -1)
+        pipe.hdel(docs, *message_ids)
+        pipe.zrem(f"room:{room_id}:archive", *message_ids)
+        pipe.zrem(f"room:{room_id}:timeline", *message_ids)
+        results = await pipe.execute()
+
+        # Drop counters that reached zero so the hash only holds threads with replies
+        empty = [parent for parent, position in parents if int(results[position]) <= 0]
+        if empty:
+            await self._client.hdel(counts, *empty)
+        
+    @staticmethod
+    def _unindex(pipe, room_id: str, message_data: Dict) -> None:
+        """Queue removal of a stored message from the author, search and thread indexes."""
+        member = f"{room_id}/{message_data['id']}"
+        pipe.zrem(f"user:{message_data['user_id']}:messages", member)
+        if settings.SEARCH_ENABLED:
+            for term in tokenize(message_data["content"]):
+                pipe.zrem(postings_key(room_id, term), message_data["id"])
+                pipe.zrem(postings_key(ALL_ROOMS, term), member)
+        if message_data.get("reply_to"):
+            pipe.zrem(f"room:{room_id}:thread:{message_data['reply_to']}", message_data["id"])
         
-        # Trim message list to max size
-        await self._client.ltrim(
-            f"room:{message.room_id}:messages",
-            0,
-            self._max_messages - 1
+    @_operation
+    async def sweep_expired_messages(
+        self,
+        batch_size: int,
+        time_budget: float,
+        lock_ttl: float
+    ) -> Optional[Dict[str, int]]:
+        """Remove expired messages, and those past ARCHIVE_MAX_MESSAGES, from the next rooms due.
+
+        Rooms are visited with SSCAN from a cursor kept in Redis
+        (``retention:cursor``), ``batch_size`` at a time, until ``time_budget``
+        seconds have passed, so each call does a small, bounded amount of
+        work and the sweep resumes where the last one stopped, on any worker.
+        ``retention:lock`` lets only one worker sweep per ``lock_ttl``
+        seconds. Returns None if another worker holds the lock.
+        """
+        await self._ensure_connection()
+        acquired = await self._client.set(
+            "retention:lock", WORKER_ID, nx=True, px=max(int(lock_ttl * 1000), 1)
         )
+        if not acquired:
+            return None
+
+        deadline = time.perf_counter() + time_budget
+        cutoff = _score(datetime.utcnow() - self._message_expiry)
+        cursor = int(await self._client.get("retention:cursor") or 0)
+        rooms = removed = 0
+        while True:
+            cursor, room_ids = await self._client.sscan("rooms", cursor, count=batch_size)
+            for room_id in room_ids:
+                removed += await self._trim_room(room_id, cutoff)
+                rooms += 1
+            if cursor == 0 or time.perf_counter() >= deadline:
+                break
+        await self._client.set("retention:cursor", cursor)
+        return {"rooms": rooms, "removed": removed, "cursor": cursor}
+        
+    async def _resolve_postings(
+        self,
+        hits: List[Tuple[str, float]],
+        room_id: Optional[str]
+    ) -> List[str]:
+        """Stored documents for (member, score) index entries, skipping messages no longer stored.
+
+        Documents are read from the rooms' ``docs`` hashes with one HMGET
+        per room. Cross-room members are ``{room_id}/{message_id}``. Entries
+        of removed messages are left for the retention sweep or their key's
+        expiry, so removing them can't shift a reader's position in the index.
+        """
+        # room_id -> message IDs, in index order
+        by_room: Dict[str, List[str]] = {}
+        targets = []
+        for member, _ in hits:
+            if room_id is None:
+                target_room, message_id = member.split("/", 1)
+            else:
+                target_room, message_id = room_id, member
+            by_room.setdefault(target_room, []).append(message_id)
+            targets.append((target_room, message_id))
+        pipe = self._client.pipeline(transaction=False)
+        for target_room, message_ids in by_room.items():
+            pipe.hmget(f"room:{target_room}:docs", message_ids)
+        found = {}
+        for (target_room, message_ids), docs in zip(by_room.items(), await pipe.execute()):
+            found.update(((target_room, message_id), row) for message_id, row in zip(message_ids, docs))
+        return [found[target] for target in targets if found[target] is not None]
+        
+    @_operation
+    async def search_messages_raw(
+        self,
+        terms: List[str],
+        room_id: Optional[str] = None,
+        limit: int = 20
+    ) -> List[str]:
+        """Stored JSON documents of messages containing every term, newest first.
+
+        Walks the shortest posting list newest first in chunks, paging by
+        score, keeping members present in every other list (ZMSCORE), until
+        ``limit`` matches are found or SEARCH_MAX_SCAN postings have been
+        read. Without ``room_id`` the cross-room postings are searched.
+        """
+        await self._ensure_connection()
+        if not terms:
+            return []
+        keys = [postings_key(room_id or ALL_ROOMS, term) for term in dict.fromkeys(terms)]
+        pipe = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zcard(key)
+        sizes = await pipe.execute()
+        if min(sizes) == 0:
+            return []
+        keys = [key for _, key in sorted(zip(sizes, keys))]
+        first, others = keys[0], keys[1:]
+
+        rows: List[str] = []
+        chunk_size = max(limit, 100)
+        cursor = None
+        scanned = 0
+        while len(rows) < limit and scanned < settings.SEARCH_MAX_SCAN:
+            chunk, cursor, _ = await self._page_index(first, chunk_size, cursor)
+            scanned += len(chunk)
+            if others and chunk:
+                members = [member for member, _ in chunk]
+                pipe = self._client.pipeline(transaction=False)
+                for key in others:
+                    pipe.zmscore(key, members)
+                scores = await pipe.execute()
+                chunk = [
+                    hit for i, hit in enumerate(chunk)
+                    if all(found[i] is not None for found in scores)
+                ]
+            # Resolve only as many as still needed; removed messages leave room for more
+            position = 0
+            while position < len(chunk) and len(rows) < limit:
+                needed = limit - len(rows)
+                rows.extend(await self._resolve_postings(chunk[position:position + needed], room_id))
+                position += needed
+            if cursor is None:
+                break
+        return rows
+        
+    async def _page_index(
+        self,
+        key: str,
+        limit: int,
+        cursor: Optional[str],
+        reverse: bool = True,
+        pipe=None
+    ) -> Tuple[List[Tuple[str, float]], Optional[str], list]:
+        """One page of (member, score) entries of an index sorted set and the next cursor.
+
+        The cursor is ``{score}:{skip}``: the score of the last entry
+        returned and how many entries with that score were already returned,
+        so pages stay stable while entries are added. One entry past the
+        page is read to tell whether there is a next page, so the cursor is
+        None once the index is exhausted. Commands queued on ``pipe`` run in
+        the same round trip; their results are returned last.
+        """
+        bound, skip = ("+inf" if reverse else "-inf"), 0
+        if cursor:
+            score, _, seen = cursor.partition(":")
+            bound, skip = int(score), int(seen or 0)
+        if pipe is None:
+            pipe = self._client.pipeline(transaction=False)
+        if reverse:
+            pipe.zrevrangebyscore(key, bound, "-inf", start=skip, num=limit + 1, withscores=True)
+        else:
+            pipe.zrangebyscore(key, bound, "+inf", start=skip, num=limit + 1, withscores=True)
+        *extra, hits = await pipe.execute()
+
+        next_cursor = None
+        if len(hits) > limit:
+            hits = hits[:limit]
+            last = int(hits[-1][1])
+            same = 0
+            for _, score in reversed(hits):
+                if int(score) != last:
+                    break
+                same += 1
+            next_cursor = f"{last}:{skip + same if bound == last else same}"
+        return hits, next_cursor, extra
+        
+    async def _page_rows(
+        self,
+        key: str,
+        limit: int,
+        cursor: Optional[str],
+        room_id: Optional[str],
+        reverse: bool = True,
+        pipe=None
+    ) -> Tuple[List[str], Optional[str], list]:
+        """One page of the stored documents an index sorted set lists, and the next cursor.
+
+        Index entries of messages no longer stored are skipped, and more
+        entries are read until ``limit`` documents are found or the index
+        is exhausted, so only the last page is short. Commands queued on
+        ``pipe`` run with the first read; their results are returned last.
+        """
+        rows: List[str] = []
+        extra: list = []
+        while True:
+            hits, cursor, results = await self._page_index(key, limit - len(rows), cursor, reverse, pipe)
+            if pipe is not None:
+                extra, pipe = results, None
+            if hits:
+                rows.extend(await self._resolve_postings(hits, room_id))
+            if len(rows) >= limit or cursor is None:
+                return rows, cursor, extra
+        
+    @_operation
+    async def get_user_messages_raw(
+        self,
+        user_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        """A user's messages across rooms, newest first, with the cursor of the next page."""
+        await self._ensure_connection()
+        rows, next_cursor, _ = await self._page_rows(f"user:{user_id}:messages", limit, cursor, None)
+        return rows, next_cursor
         
-        # Set message expiry
-        await self._client.expire(
-            f"room:{message.room_id}:messages",
-            int(self._message_expiry.total_seconds())
+    @_operation
+    async def get_thread_raw(
+        self,
+        room_id: str,
+        message_id: str,
+        limit: int = 50,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[str], int, Optional[str]]:
+        """Replies to a message, oldest first, with its reply count and the next cursor.
+
+        Replies are indexed in ``room:{room_id}:thread:{message_id}``; the
+        count comes from the room's reply counters in the same round trip as
+        the first read.
+        """
+        await self._ensure_connection()
+        key = f"room:{room_id}:thread:{message_id}"
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hget(f"room:{room_id}:reply_counts", message_id)
+        rows, next_cursor, (count,) = await self._page_rows(
+            key, limit, cursor, room_id, reverse=False, pipe=pipe
         )
+        return rows, max(int(count or 0), 0), next_cursor
+        
+    @_operation
+    async def update_presence(
+        self,
+        present: Dict[str, Iterable[str]],
+        absent: Dict[str, Iterable[str]],
+        timeout: float
+    ) -> Dict[str, List[str]]:
+        """Write a batch of this worker's presence changes; return who left each room.
+
+        Presence is kept per room in ``room:{room_id}:presence``, a sorted
+        set of ``{user_id}/{worker}`` entries scored by their last heartbeat
+        in epoch seconds, one per worker a user is connected through. The
+        same entries are kept, all scored 0, in ``room:{room_id}:connections``
+        so a user's entries can be found by prefix. Users in ``present`` get
+        this worker's entry refreshed to now, users in ``absent`` lose it,
+        and entries of the touched rooms older than ``timeout`` (left behind
+        by a worker that stopped without cleaning up) are removed.
+
+        A user who lost an entry is returned, by room, only if they have no
+        entry left on any worker. That check is a second round trip, made
+        only when an entry was removed.
+        """
+        await self._ensure_connection()
+        now = time.time()
+        cutoff = f"({now - timeout}"
+        pipe = self._client.pipeline(transaction=True)
+        # (room ID, position of its ZRANGEBYSCORE in the pipeline)
+        positions: List[Tuple[str, int]] = []
+        for room_id in {**present, **absent}:
+            key = f"room:{room_id}:presence"
+            connections = f"room:{room_id}:connections"
+            users = [f"{user_id}/{_PRESENCE_WORKER}" for user_id in present.get(room_id, ())]
+            if users:
+                pipe.zadd(key, dict.fromkeys(users, now))
+                pipe.zadd(connections, dict.fromkeys(users, 0))
+            gone = [f"{user_id}/{_PRESENCE_WORKER}" for user_id in absent.get(room_id, ())]
+            if gone:
+                pipe.zrem(key, *gone)
+                pipe.zrem(connections, *gone)
+            positions.append((room_id, len(pipe)))
+            pipe.zrangebyscore(key, "-inf", cutoff)
+            pipe.zremrangebyscore(key, "-inf", cutoff)
+        if not positions:
+            return {}
+        results = await pipe.execute()
+
+        # room ID -> users who lost an entry, by whether it timed out
+        candidates: Dict[str, Set[str]] = {}
+        pipe = self._client.pipeline(transaction=True)
+        for room_id, position in positions:
+            expired = results[position]
+            if expired:
+                pipe.zrem(f"room:{room_id}:connections", *expired)
+            users = set(absent.get(room_id, ())) | {_presence_user(member) for member in expired}
+            if users:
+                candidates[room_id] = users
+        if not candidates:
+            return {}
+        checks: List[Tuple[str, str]] = []
+        for room_id, users in candidates.items():
+            for user_id in users:
+                # Entries of user_id sort between "user_id/" and "user_id0"
+                pipe.zrangebylex(
+                    f"room:{room_id}:connections", f"[{user_id}/", f"({user_id}0", start=0, num=1
+                )
+                checks.append((room_id, user_id))
+        remaining = (await pipe.execute())[-len(checks):]
+        left: Dict[str, List[str]] = {}
+        for (room_id, user_id), entries in zip(checks, remaining):
+            if not entries:
+                left.setdefault(room_id, []).append(user_id)
+        return left
         
-    async def get_room_messages(self, room_id: str, limit: int = 50) -> List[Message]:
-        """Get messages from a room."""
+    @_operation
+    async def get_presence(self, room_id: str, timeout: float) -> List[str]:
+        """IDs of the users seen in a room within the last ``timeout`` seconds."""
         await self._ensure_connection()
-        messages_data = await self._client.lrange(
-            f"room:{room_id}:messages",
-            0,
-            limit - 1
+        members = await self._client.zrangebyscore(
+            f"room:{room_id}:presence", time.time() - timeout, "+inf"
         )
+        return list(dict.fromkeys(_presence_user(member) for member in members))
         
-        messages = []
-        for message_json in messages_data:
-            message_data = json.loads(message_json)
-            message_data["created_at"] = datetime.fromisoformat(message_data["created_at"])
-            messages.append(Message(**message_data))
-            
-        return messages 
\ No newline at end of file
+    async def _room_rows(
+        self,
+        room_id: str,
+        limit: int,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        reply_counts: bool = False
+    ) -> Tuple[List[str], Dict[str, str]]:
+        """Read a page of stored documents, newest first, and the page's reply counters if asked.
+
+        The newest page's IDs come from the room's timeline. A time range
+        is read from the archive, so it can reach messages the timeline has
+        already trimmed. The documents, and the counters of those IDs, are
+        read in a second round trip.
+        """
+        if start is None and end is None:
+            message_ids = await self._client.zrevrange(f"room:{room_id}:timeline", 0, limit - 1)
+        else:
+            message_ids = await self._client.zrevrangebyscore(
+                f"room:{room_id}:archive",
+                f"({_score(end)}" if end is not None else "+inf",
+                _score(start) if start is not None else "-inf",
+                start=0,
+                num=limit
+            )
+        if not message_ids:
+            return [], {}
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hmget(f"room:{room_id}:docs", message_ids)
+        if reply_counts:
+            pipe.hmget(f"room:{room_id}:reply_counts", message_ids)
+        rows, *counts = await pipe.execute()
+        found = {}
+        if counts:
+            found = {
+                message_id: count for message_id, count in zip(message_ids, counts[0]) if count is not None
+            }
+        return [row for row in rows if row is not None], found
+        
+    @_operation
+    async def get_room_messages(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[Message]:
+        """Get messages from a room, newest first.
+
+        With ``start`` and/or ``end`` the page holds the messages of the
+        room's timeline created at or after ``start`` and before ``end``.
+        """
+        await self._ensure_connection()
+        messages_data, _ = await self._room_rows(room_id, limit, start, end)
+        
+        # Validate the whole page in one pass instead of building each message separately
+        return MESSAGE_LIST_ADAPTER.validate_json("[" + ",".join(messages_data) + "]")
+        
+    @_operation
+    async def get_room_messages_raw(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[str]:
+        """Get messages from a room as their stored JSON documents, newest first."""
+        await self._ensure_connection()
+        rows, _ = await self._room_rows(room_id, limit, start, end)
+        return rows
+        
+    @_operation
+    async def get_room_history_raw(
+        self,
+        room_id: str,
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Tuple[List[str], Dict[str, int]]:
+        """Like get_room_messages_raw, plus the reply counters of the page's messages by ID.
+
+        Only the page's fields are read, with one HMGET in the same pipeline
+        as the page's documents, whatever the size of the room's hash.
+        """
+        await self._ensure_connection()
+        rows, counts = await self._room_rows(room_id, limit, start, end, reply_counts=True)
+        return rows, {parent_id: int(count) for parent_id, count in counts.items()}
+        
+    async def iter_room_messages_raw(
+        self,
+        room_id: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> AsyncIterator[List[str]]:
+        """Iterate over a room's stored JSON documents in chunks, oldest first.
+
+        Pages through the archive ``EXPORT_CHUNK_SIZE`` IDs at a time, so
+        the whole retained history is read, not just the timeline's window,
+        resuming each page at the last score seen, so messages written or
+        trimmed while iterating don't shift the window, and reads each
+        page's documents with one HMGET. ``since`` and ``until`` are
+        inclusive bounds on ``created_at``.
+        """
+        await self._ensure_connection()
+        archive = f"room:{room_id}:archive"
+        docs = f"room:{room_id}:docs"
+        chunk_size = settings.EXPORT_CHUNK_SIZE
+        low = _score(since) if since is not None else "-inf"
+        high = _score(until) if until is not None else "+inf"
+        # Entries at score ``low`` already returned; members sharing a score are in a fixed order
+        skip = 0
+        while True:
+            # Tag and time each round trip; the context can't span a yield
+            token = current_operation.set("iter_room_messages_raw")
+            try:
+                with REDIS_LATENCY.time("iter_room_messages_raw"):
+                    hits = await self._client.zrangebyscore(
+                        archive, low, high, start=skip, num=chunk_size, withscores=True
+                    )
+                    rows = await self._client.hmget(docs, [message_id for message_id, _ in hits]) if hits else []
+            finally:
+                current_operation.reset(token)
+            if not hits:
+                return
+            yield [row for row in rows if row is not None]
+            if len(hits) < chunk_size:
+                return
+
+            last = int(hits[-1][1])
+            same = 0
+            for _, score in reversed(hits):
+                if int(score) != last:
+                    break
+                same += 1
+            skip = skip + same if low == last else same
+            low = last
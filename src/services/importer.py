@@ -0,0 +1,315 @@
+"""
+Bulk message import.
+
+The request body is parsed item by item as it streams in, either as NDJSON
+(one message per line) or as a single JSON array, and messages are written
+in pipelined batches. Memory use is bounded by the batch size, not by the
+size of the body.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from pydantic import BaseModel, Field, ValidationError, field_validator
+import codecs
+import json
+import uuid
+
+from src.config.settings import get_settings
+from src.models.message import Message, MessageType
+from src.services.database import DatabaseInterface
+from src.services.metrics import MESSAGES_RECEIVED
+
+settings = get_settings()
+
+# (decoded item, parse error) for each item in the body
+ParsedItem = Tuple[Any, Optional[str]]
+
+
+class ImportFormatError(ValueError):
+    """The body can't be parsed any further."""
+
+
+class ImportedMessage(BaseModel):
+    """One message in an import body; ``id`` and ``created_at`` are kept when given."""
+
+    id: Optional[str] = None
+    room_id: str
+    user_id: str
+    content: str
+    created_at: Optional[datetime] = None
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
+    reply_to: Optional[str] = None
+    type: MessageType = MessageType.TEXT
+
+    @field_validator("created_at")
+    @classmethod
+    def _naive_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Store aware timestamps as naive UTC, like every other message."""
+        if value is None or value.tzinfo is None:
+            return value
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def iter_ndjson(
+    chunks: AsyncIterator[bytes],
+    max_item_bytes: int = settings.IMPORT_MAX_ITEM_BYTES
+) -> AsyncIterator[ParsedItem]:
+    """Parse one JSON document per line; blank lines are skipped.
+
+    A line longer than ``max_item_bytes`` is reported as an error and
+    discarded as it arrives, without buffering the rest of it.
+    """
+    buffer = b""
+    # Set while discarding the rest of an oversized line
+    skipping = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif line.strip():
+                yield _parse_line(line, max_item_bytes)
+        if len(buffer) > max_item_bytes:
+            if not skipping:
+                yield _too_large(max_item_bytes)
+                skipping = True
+            buffer = b""
+    if buffer.strip() and not skipping:
+        yield _parse_line(buffer, max_item_bytes)
+
+
+def _too_large(max_item_bytes: int) -> ParsedItem:
+    return None, f"Line exceeds {max_item_bytes} bytes"
+
+
+def _parse_line(line: bytes, max_item_bytes: int) -> ParsedItem:
+    if len(line) > max_item_bytes:
+        return _too_large(max_item_bytes)
+    try:
+        return json.loads(line), None
+    except ValueError as e:
+        return None, f"Invalid JSON: {e}"
+
+
+class _ArrayParser:
+    """Incremental parser for the elements of a top-level JSON array."""
+
+    def __init__(self, max_item_bytes: int):
+        self.max_item_bytes = max_item_bytes
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        # start -> first (after "[") -> value (after ",") / next (after a value) -> done
+        self._state = "start"
+        # Set once the body can't be parsed any further
+        self.error: Optional[str] = None
+
+    def feed(self, data: bytes, final: bool = False) -> List[Any]:
+        """Return the items completed by ``data``; check ``error`` afterwards"""
+        if self.error is not None:
+            return []
+        self._buffer += self._text.decode(data, final)
+        buffer = self._buffer
+        items = []
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buffer):
+                break
+            char = buffer[pos]
+            if self._state == "done":
+                self.error = "Unexpected data after the JSON array"
+                break
+            if self._state == "start":
+                if char != "[":
+                    self.error = "Expected a JSON array or NDJSON body"
+                    break
+                self._state = "first"
+                pos += 1
+            elif self._state == "next":
+                if char not in ",]":
+                    self.error = "Expected ',' or ']' after an item"
+                    break
+                self._state = "value" if char == "," else "done"
+                pos += 1
+            elif char == "]" and self._state == "first":
+                self._state = "done"
+                pos += 1
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buffer, pos)
+                except ValueError as e:
+                    if final or len(buffer) - pos > self.max_item_bytes:
+                        self.error = f"Invalid JSON: {e}"
+                    break  # Otherwise wait for the rest of the item
+                if end == len(buffer) and not final:
+                    break  # A number at the end of the buffer may continue
+                items.append(item)
+                self._state = "next"
+                pos = end
+        self._buffer = buffer[pos:]
+        if final and self.error is None and self._state != "done":
+            self.error = "Unterminated JSON array"
+        return items
+
+
+async def iter_json_array(
+    chunks: AsyncIterator[bytes],
+    max_item_bytes: int = settings.IMPORT_MAX_ITEM_BYTES
+) -> AsyncIterator[ParsedItem]:
+    """Parse the elements of a JSON array body as they arrive."""
+    parser = _ArrayParser(max_item_bytes)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item, None
+        if parser.error is not None:
+            raise ImportFormatError(parser.error)
+    for item in parser.feed(b"", final=True):
+        yield item, None
+    if parser.error is not None:
+        raise ImportFormatError(parser.error)
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc']) or 'message'}: {e['msg']}"
+        for e in error.errors()
+    )
+
+
+class MessageImporter:
+    """Validates and writes imported messages in batches.
+
+    Room and user IDs are checked once per batch with pipelined EXISTS
+    calls and remembered for the rest of the import, so a body that
+    references a handful of rooms costs a handful of lookups.
+    """
+
+    def __init__(
+        self,
+        db: DatabaseInterface,
+        batch_size: int = settings.IMPORT_BATCH_SIZE,
+        max_errors: int = settings.IMPORT_MAX_ERRORS
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+        self._rooms: Dict[str, bool] = {}
+        self._users: Dict[str, bool] = {}
+        self._batch: List[Tuple[int, ImportedMessage]] = []
+
+    def _error(self, index: int, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"index": index, "error": message})
+
+    async def run(self, items: AsyncIterator[ParsedItem]) -> Dict[str, Any]:
+        """Import every item and return the summary report"""
+        index = -1
+        try:
+            async for index, (item, parse_error) in _enumerate(items):
+                if parse_error is not None:
+                    self._error(index, parse_error)
+                    continue
+                try:
+                    self._batch.append((index, ImportedMessage.model_validate(item)))
+                except ValidationError as e:
+                    self._error(index, _format_validation_error(e))
+                    continue
+                if len(self._batch) >= self.batch_size:
+                    await self._flush()
+        except ImportFormatError as e:
+            # Items before the syntax error are still imported
+            self._error(index + 1, str(e))
+        await self._flush()
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+    async def _check(self, ids: Set[str], known: Dict[str, bool], lookup) -> None:
+        unknown = [id_ for id_ in ids if id_ not in known]
+        if unknown:
+            found = await lookup(unknown)
+            for id_ in unknown:
+                known[id_] = id_ in found
+
+    async def _stored(self, batch: List[Tuple[int, ImportedMessage]]) -> Set[Tuple[str, str]]:
+        """(room ID, message ID) of the batch's given IDs and reply parents that are already stored"""
+        wanted: Dict[str, Set[str]] = {}
+        for _, m in batch:
+            if m.id:
+                wanted.setdefault(m.room_id, set()).add(m.id)
+            if m.reply_to:
+                wanted.setdefault(m.room_id, set()).add(m.reply_to)
+        stored: Set[Tuple[str, str]] = set()
+        for room_id, ids in wanted.items():
+            stored.update((room_id, id_) for id_ in await self.db.existing_messages(room_id, ids))
+        return stored
+
+    async def _flush(self) -> None:
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        await self._check({m.room_id for _, m in batch}, self._rooms, self.db.existing_rooms)
+        await self._check({m.user_id for _, m in batch}, self._users, self.db.existing_users)
+        stored = await self._stored(batch)
+        # A parent can be stored or come earlier in the same batch
+        parents = stored | {(m.room_id, m.id) for _, m in batch if m.id}
+        # Given IDs taken by earlier messages in the batch
+        taken: Set[Tuple[str, str]] = set()
+
+        messages = []
+        for index, item in batch:
+            if not self._rooms[item.room_id]:
+                self._error(index, "Room not found")
+            elif not self._users[item.user_id]:
+                self._error(index, "User not found")
+            elif item.id and ((item.room_id, item.id) in stored or (item.room_id, item.id) in taken):
+                # Saving it again would leave the old document's index entries behind
+                self._error(index, "Message already exists")
+            elif item.reply_to and (item.room_id, item.reply_to) not in parents:
+                self._error(index, "Parent message not found")
+            else:
+                if item.id:
+                    taken.add((item.room_id, item.id))
+                # Fields were validated by ImportedMessage; skip validating them again
+                messages.append(Message.model_construct(
+                    id=item.id or str(uuid.uuid4()),
+                    room_id=item.room_id,
+                    user_id=item.user_id,
+                    content=item.content,
+                    created_at=item.created_at or datetime.utcnow(),
+                    metadata=item.metadata,
+                    reply_to=item.reply_to,
+                    type=item.type
+                ))
+        await self.db.save_messages(messages)
+        self.imported += len(messages)
+        MESSAGES_RECEIVED.inc("import", amount=len(messages))
+
+
+async def _enumerate(items: AsyncIterator[ParsedItem]) -> AsyncIterator[Tuple[int, ParsedItem]]:
+    index = 0
+    async for item in items:
+        yield index, item
+        index += 1
+
+
+__all__ = [
+    'ImportFormatError',
+    'ImportedMessage',
+    'MessageImporter',
+    'iter_json_array',
+    'iter_ndjson'
+]
@@ -0,0 +1,107 @@
+"""
+Event-loop lag sampler.
+
+A background task sleeps for a fixed interval and records how late it wakes
+up. Lateness means callbacks were queued behind other work, so the recent
+samples tell us how saturated this worker's loop is.
+"""
+
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Optional
+import asyncio
+import logging
+
+from src.config.settings import get_settings
+from src.services.metrics import metrics, WORKER_ID
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Number of most recent samples used to decide whether the loop is overloaded
+RECENT_SAMPLES = 5
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        interval: float = settings.LOOP_LAG_SAMPLE_INTERVAL,
+        window: int = settings.LOOP_LAG_WINDOW,
+        threshold: float = settings.LOAD_SHEDDING_LAG_THRESHOLD_MS / 1000,
+        shedding_enabled: bool = settings.LOAD_SHEDDING_ENABLED,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.shedding_enabled = shedding_enabled
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._due: Optional[float] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop."""
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop sampling."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._due = None
+
+    async def _run(self) -> None:
+        loop = self._loop
+        while True:
+            self._due = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(loop.time() - self._due, 0.0))
+
+    def current_lag(self) -> float:
+        """Worst lag among the most recent samples, including an overdue wakeup."""
+        recent = max(islice(reversed(self._samples), RECENT_SAMPLES), default=0.0)
+        if self._due is not None and self._loop is not None:
+            # If the sampler is late right now, count that too
+            recent = max(recent, self._loop.time() - self._due)
+        return recent
+
+    def percentiles(self) -> Dict[str, float]:
+        """Lag percentiles in seconds over the sample window."""
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+        last = len(ordered) - 1
+        return {
+            "p50": ordered[min(int(0.50 * len(ordered)), last)],
+            "p90": ordered[min(int(0.90 * len(ordered)), last)],
+            "p99": ordered[min(int(0.99 * len(ordered)), last)],
+            "max": ordered[last],
+        }
+
+    def is_overloaded(self) -> bool:
+        """Whether new work should be shed to protect existing sessions."""
+        return self.shedding_enabled and self.current_lag() > self.threshold
+
+
+# Create a global loop monitor instance
+loop_monitor = LoopLagMonitor()
+
+metrics.gauge(
+    "chat_event_loop_lag_seconds", "Event-loop lag percentiles over the sample window.",
+    ("worker", "quantile"),
+    callback=lambda: {
+        (WORKER_ID, quantile): value
+        for quantile, value in zip(("0.5", "0.9", "0.99", "1"), loop_monitor.percentiles().values())
+    }
+)
+REQUESTS_SHED = metrics.counter(
+    "chat_requests_shed_total", "Requests and WebSocket accepts rejected by load shedding.",
+    ("transport",)
+)
+
+__all__ = ['LoopLagMonitor', 'loop_monitor', 'REQUESTS_SHED']
@@ -0,0 +1,159 @@
+"""
+Cluster-wide room presence.
+
+Each worker records who is connected to which room in
+``room:{room_id}:presence`` (see ``update_presence``). Joins and leaves are
+queued as sockets connect and disconnect and written together every
+``PRESENCE_FLUSH_INTERVAL`` seconds, and every ``WS_HEARTBEAT_INTERVAL``
+seconds all local members are refreshed in the same batch, so a worker makes
+one pipelined write per interval rather than one per socket. Users not
+refreshed for ``PRESENCE_TIMEOUT`` seconds count as offline.
+
+A user connected through several workers has an entry per worker, so a
+leave only takes them offline once their last connection is gone.
+
+After each flush, every affected room gets one ``presence`` frame listing
+who joined and who left since the last one.
+"""
+
+from typing import Dict, Optional, Set
+import asyncio
+import logging
+import time
+
+from src.config.settings import get_settings
+from src.services.database import DatabaseInterface
+from src.services.metrics import metrics
+from src.services.protocol import Frame
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+PRESENCE_FLUSH_DURATION = metrics.histogram(
+    "chat_presence_flush_seconds", "Duration of presence writes."
+)
+PRESENCE_CHANGES = metrics.counter(
+    "chat_presence_changes_total", "Presence changes written by kind.", ("kind",)
+)
+
+
+class PresenceTracker:
+    def __init__(
+        self,
+        enabled: bool = settings.PRESENCE_ENABLED,
+        flush_interval: float = settings.PRESENCE_FLUSH_INTERVAL,
+        heartbeat_interval: float = settings.WS_HEARTBEAT_INTERVAL,
+        timeout: float = settings.PRESENCE_TIMEOUT
+    ):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        # room_id -> user IDs that joined / left since the last flush
+        self._joined: Dict[str, Set[str]] = {}
+        self._left: Dict[str, Set[str]] = {}
+        self._next_heartbeat = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def joined(self, room_id: str, user_id: str) -> None:
+        """Queue a user joining a room."""
+        if self.enabled:
+            self._left.get(room_id, set()).discard(user_id)
+            self._joined.setdefault(room_id, set()).add(user_id)
+
+    def left(self, room_id: str, user_id: str) -> None:
+        """Queue a user leaving a room."""
+        if self.enabled:
+            self._joined.get(room_id, set()).discard(user_id)
+            self._left.setdefault(room_id, set()).add(user_id)
+
+    def start(self, db: DatabaseInterface, manager) -> None:
+        """Start flushing on the running loop; ``manager`` holds the local sockets."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run(db, manager))
+
+    async def stop(self, db: DatabaseInterface, manager) -> None:
+        """Stop flushing and mark this worker's members as gone."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            for room_id, members in manager.room_members():
+                for user_id in members:
+                    self.left(room_id, user_id)
+            try:
+                await db.update_presence({}, self._left, self.timeout)
+            except Exception as e:
+                logger.error(f"Presence cleanup failed: {e}")
+            self._joined.clear()
+            self._left.clear()
+
+    async def flush(self, db: DatabaseInterface, manager, heartbeat: bool = False) -> None:
+        """Write queued changes, with a refresh of every local member if ``heartbeat``,
+        and broadcast them."""
+        joined, self._joined = self._joined, {}
+        left, self._left = self._left, {}
+        present: Dict[str, Set[str]] = {room_id: set(users) for room_id, users in joined.items() if users}
+        if heartbeat:
+            for room_id, members in manager.room_members():
+                present.setdefault(room_id, set()).update(members)
+        absent = {room_id: users for room_id, users in left.items() if users}
+        if not present and not absent:
+            return
+
+        try:
+            with PRESENCE_FLUSH_DURATION.time():
+                gone = await db.update_presence(present, absent, self.timeout)
+        except Exception:
+            self._requeue(joined, left)
+            raise
+
+        PRESENCE_CHANGES.inc("join", amount=sum(len(users) for users in joined.values()))
+        PRESENCE_CHANGES.inc("leave", amount=sum(len(users) for users in left.values()))
+        # A user still connected through another socket or worker hasn't left
+        for room_id in {**joined, **gone}:
+            frame = {
+                "type": "presence",
+                "room_id": room_id,
+                "joined": sorted(joined.get(room_id, ())),
+                "left": sorted(gone.get(room_id, ()))
+            }
+            if frame["joined"] or frame["left"]:
+                await manager.broadcast_json(room_id, Frame.of(frame))
+
+    def _requeue(self, joined: Dict[str, Set[str]], left: Dict[str, Set[str]]) -> None:
+        """Put back the changes of a failed flush so the next one retries them.
+
+        A user who joined or left again while the write was in flight keeps
+        that newer change; the old one is dropped rather than replayed over it.
+        """
+        newer = {
+            room_id: self._joined.get(room_id, set()) | self._left.get(room_id, set())
+            for room_id in {**joined, **left}
+        }
+        for changes, queue in ((joined, self._joined), (left, self._left)):
+            for room_id, users in changes.items():
+                stale = users - newer[room_id]
+                if stale:
+                    queue.setdefault(room_id, set()).update(stale)
+
+    async def _run(self, db: DatabaseInterface, manager) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            heartbeat = now >= self._next_heartbeat
+            if heartbeat:
+                self._next_heartbeat = now + self.heartbeat_interval
+            try:
+                await self.flush(db, manager, heartbeat)
+            except Exception as e:
+                logger.error(f"Presence flush failed: {e}")
+
+
+# Create a global tracker instance
+presence_tracker = PresenceTracker()
+
+__all__ = ['PresenceTracker', 'presence_tracker']
@@ -0,0 +1,79 @@
+"""
+Hot cache of user profiles.
+
+History pages and broadcast frames can embed the profiles of their authors.
+A room's history usually comes from a handful of users, so profiles are
+kept in a small in-process LRU with a TTL and only misses go to Redis, in
+one pipelined read per lookup.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+import time
+
+from src.config.settings import get_settings
+from src.models.user import User
+from src.services.database import DatabaseInterface
+from src.services.metrics import metrics, WORKER_ID
+
+settings = get_settings()
+
+PROFILE_CACHE_REQUESTS = metrics.counter(
+    "chat_profile_cache_requests_total", "User profile cache lookups by result.", ("result",)
+)
+
+
+class ProfileCache:
+    """LRU of ``User`` profiles with a time-to-live per entry."""
+
+    def __init__(self, ttl: float = settings.PROFILE_CACHE_TTL, max_size: int = settings.PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # user_id -> (expires at, profile), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, User]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_many(self, db: DatabaseInterface, user_ids: Iterable[str]) -> Dict[str, User]:
+        """Profiles for the given IDs; unknown users are left out"""
+        now = time.monotonic()
+        found: Dict[str, User] = {}
+        missing: List[str] = []
+        for user_id in dict.fromkeys(user_ids):
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                found[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+
+        PROFILE_CACHE_REQUESTS.inc("hit", amount=len(found))
+        if missing:
+            PROFILE_CACHE_REQUESTS.inc("miss", amount=len(missing))
+            fetched = await db.get_users_by_ids(missing)
+            expires = time.monotonic() + self.ttl
+            for user_id, user in fetched.items():
+                self._entries[user_id] = (expires, user)
+                self._entries.move_to_end(user_id)
+                found[user_id] = user
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return found
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Create a singleton cache
+profile_cache = ProfileCache()
+
+metrics.gauge(
+    "chat_profile_cache_entries", "User profiles held in the cache per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): len(profile_cache)}
+)
+
+__all__ = ['ProfileCache', 'profile_cache']
@@ -0,0 +1,183 @@
+"""
+WebSocket frame encodings.
+
+Clients pick one with the ``Sec-WebSocket-Protocol`` header. ``chat.json``,
+also used when no protocol is requested, sends every frame as JSON text.
+``chat.msgpack`` sends binary msgpack frames in both directions, with the
+field names shortened as in ``SHORT_KEYS``. Values are the same as in JSON.
+Maps keyed by IDs and user-supplied ``metadata`` are passed through
+untouched.
+
+Outgoing frames are ``Frame`` objects carrying the JSON text and a way to
+build the short-keyed data. Message frames build it straight from the
+model, so a broadcast is neither parsed back from JSON nor renamed key by
+key. Only frames made from stored JSON, such as history, are parsed.
+
+msgpack is an optional dependency (``pip install msgpack``). Without it the
+server never selects ``chat.msgpack``, so clients that also offered
+``chat.json``, or nothing else, get JSON.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import json
+
+from src.models.message import Message
+from src.models.user import User
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_PROTOCOL = "chat.json"
+MSGPACK_PROTOCOL = "chat.msgpack"
+
+MSGPACK_AVAILABLE = msgpack is not None
+
+SHORT_KEYS: Dict[str, str] = {
+    "type": "t",
+    "id": "i",
+    "room_id": "r",
+    "room_ids": "rs",
+    "user_id": "u",
+    "user": "a",
+    "username": "un",
+    "content": "c",
+    "created_at": "ts",
+    "updated_at": "ua",
+    "metadata": "md",
+    "reply_to": "rt",
+    "reply_counts": "rc",
+    "messages": "m",
+    "count": "n",
+    "users": "us",
+    "joined": "j",
+    "left": "l",
+    "is_typing": "ty",
+    "detail": "d",
+    "next_cursor": "nc",
+}
+LONG_KEYS: Dict[str, str] = {short: name for name, short in SHORT_KEYS.items()}
+
+# Fields whose values are maps keyed by IDs, or user data, and keep their keys
+_OPAQUE = frozenset(("metadata", "reply_counts", "users"))
+_OPAQUE_KEYS = _OPAQUE | {SHORT_KEYS[name] for name in _OPAQUE}
+
+
+def negotiate(requested: Iterable[str], allow_msgpack: bool = True) -> Optional[str]:
+    """The first protocol in the client's list that the server speaks, if any."""
+    for protocol in requested:
+        if protocol == JSON_PROTOCOL or (protocol == MSGPACK_PROTOCOL and allow_msgpack and MSGPACK_AVAILABLE):
+            return protocol
+    return None
+
+
+def _rename(value: Any, keys: Dict[str, str]) -> Any:
+    # Frames are mostly flat, so only containers are walked into
+    if type(value) is dict:
+        get = keys.get
+        return {
+            get(key, key): item if key in _OPAQUE_KEYS or type(item) not in (dict, list) else _rename(item, keys)
+            for key, item in value.items()
+        }
+    if type(value) is list:
+        return [_rename(item, keys) if type(item) in (dict, list) else item for item in value]
+    return value
+
+
+class Frame:
+    """An outgoing frame, encoded for each protocol at most once, when a socket first needs it.
+
+    ``wire`` returns the frame's data with short keys. Without it the JSON
+    text is parsed and renamed.
+    """
+
+    __slots__ = ("text", "_wire", "_data", "_packed")
+
+    def __init__(self, text: str, wire: Optional[Callable[[], Any]] = None):
+        self.text = text
+        self._wire = wire
+        self._data: Any = None
+        self._packed: Optional[bytes] = None
+
+    @classmethod
+    def of(cls, fields: Dict[str, Any]) -> "Frame":
+        """A frame of top-level fields whose values hold no keys to shorten."""
+        return cls(json.dumps(fields), lambda: {SHORT_KEYS.get(key, key): value for key, value in fields.items()})
+
+    def data(self) -> Any:
+        """The frame's data with short keys."""
+        if self._data is None:
+            self._data = self._wire() if self._wire is not None else _rename(json.loads(self.text), SHORT_KEYS)
+        return self._data
+
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(self.data(), use_bin_type=True)
+        return self._packed
+
+
+def _user_data(user: User) -> Dict[str, Any]:
+    return {
+        "i": user.id,
+        "un": user.username,
+        "ts": user.created_at.isoformat(),
+        "ua": user.updated_at.isoformat(),
+        "md": user.metadata
+    }
+
+
+def _message_data(message: Message, author: Optional[User]) -> Dict[str, Any]:
+    # Keys as in SHORT_KEYS, in the order model_dump_json writes them
+    data = {
+        "i": message.id,
+        "r": message.room_id,
+        "u": message.user_id,
+        "c": message.content,
+        "ts": message.created_at.isoformat(),
+        "md": message.metadata,
+        "rt": message.reply_to,
+        "t": message.type.value
+    }
+    if author is not None:
+        data["a"] = _user_data(author)
+    return data
+
+
+def message_frame(message: Message, author: Optional[User] = None) -> Frame:
+    """A message frame, with its author's profile as ``user`` if given."""
+    text = message.model_dump_json()
+    if author is not None:
+        text = text[:-1] + ',"user":' + author.model_dump_json() + "}"
+    return Frame(text, lambda: _message_data(message, author))
+
+
+def list_frame(fields: Dict[str, Any], frames: List[Frame]) -> Frame:
+    """A frame of top-level ``fields``, as in ``Frame.of``, carrying ``frames`` as its ``messages``."""
+    head = json.dumps(fields, separators=(",", ":"))[:-1]
+    text = head + ',"messages":[' + ",".join(frame.text for frame in frames) + "]}"
+
+    def wire() -> Dict[str, Any]:
+        data = {SHORT_KEYS.get(key, key): value for key, value in fields.items()}
+        data["m"] = [frame.data() for frame in frames]
+        return data
+
+    return Frame(text, wire)
+
+
+def unpack(data: bytes) -> Any:
+    """Decode a msgpack frame, restoring the full field names."""
+    return _rename(msgpack.unpackb(data, raw=False), LONG_KEYS)
+
+
+__all__ = [
+    'JSON_PROTOCOL',
+    'MSGPACK_PROTOCOL',
+    'MSGPACK_AVAILABLE',
+    'SHORT_KEYS',
+    'Frame',
+    'list_frame',
+    'message_frame',
+    'negotiate',
+    'unpack'
+]
@@ -0,0 +1,185 @@
+"""
+Dead WebSocket connection reaper.
+
+A socket that sends nothing for ``WS_PING_INTERVAL`` seconds gets a
+``{"type": "ping"}`` frame; if nothing comes back within ``WS_PONG_TIMEOUT``
+seconds it is closed and removed from the connection manager. Any frame from
+the client counts as a pong, so active clients are never pinged.
+
+Deadlines live in a hashed timer wheel: one slot per ``WS_REAPER_TICK`` and
+a single task that visits one slot per tick. Receiving a frame only records
+the time; an entry is rescheduled when its slot comes up, so an idle
+connection costs one check per ping interval and no task of its own.
+"""
+
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import logging
+import math
+import time
+
+from fastapi import WebSocket
+
+from src.config.settings import get_settings
+from src.services.metrics import metrics, WORKER_ID
+from src.services.protocol import Frame
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Application close code for an unanswered ping (4000 + HTTP 408)
+WS_CLOSE_PING_TIMEOUT = 4408
+
+PING_FRAME = Frame('{"type":"ping"}', lambda: {"t": "ping"})
+
+PINGS_SENT = metrics.counter(
+    "chat_ws_pings_sent_total", "Pings sent to idle WebSocket connections."
+)
+CONNECTIONS_REAPED = metrics.counter(
+    "chat_ws_connections_reaped_total", "WebSocket connections closed for not answering a ping."
+)
+
+
+class _Entry:
+    __slots__ = ("websocket", "user_id", "last_seen", "pinged_at")
+
+    def __init__(self, websocket: WebSocket, user_id: str, now: float):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.last_seen = now
+        self.pinged_at: Optional[float] = None
+
+
+class ConnectionReaper:
+    def __init__(
+        self,
+        enabled: bool = settings.WS_REAPER_ENABLED,
+        ping_interval: float = settings.WS_PING_INTERVAL,
+        pong_timeout: float = settings.WS_PONG_TIMEOUT,
+        tick: float = settings.WS_REAPER_TICK,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.enabled = enabled
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.tick = tick
+        self._clock = clock
+        # Enough slots to schedule the longer of the two deadlines in one turn
+        self._slots: List[Set[_Entry]] = [
+            set() for _ in range(math.ceil(max(ping_interval, pong_timeout) / tick) + 2)
+        ]
+        self._position = 0
+        # id(websocket) -> entry; WebSocket objects aren't hashable
+        self._entries: Dict[int, _Entry] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def track(self, websocket: WebSocket, user_id: str) -> None:
+        """Start watching a connection."""
+        if not self.enabled:
+            return
+        entry = _Entry(websocket, user_id, self._clock())
+        self._entries[id(websocket)] = entry
+        self._schedule(entry, self.ping_interval)
+
+    def forget(self, websocket: WebSocket) -> None:
+        """Stop watching a connection; its slot entry is dropped when the slot comes up."""
+        self._entries.pop(id(websocket), None)
+
+    def touch(self, websocket: WebSocket) -> None:
+        """Record a frame received on a connection."""
+        entry = self._entries.get(id(websocket))
+        if entry is not None:
+            entry.last_seen = self._clock()
+
+    def _schedule(self, entry: _Entry, delay: float) -> None:
+        # Deadlines past the end of the wheel are rechecked early and rescheduled
+        ticks = min(max(math.ceil(delay / self.tick), 1), len(self._slots) - 1)
+        self._slots[(self._position + ticks) % len(self._slots)].add(entry)
+
+    async def advance(self, manager) -> None:
+        """Move the wheel one tick: ping idle connections due now and reap the unresponsive."""
+        self._position = (self._position + 1) % len(self._slots)
+        due, self._slots[self._position] = self._slots[self._position], set()
+        now = self._clock()
+        to_ping: List[_Entry] = []
+        to_reap: List[_Entry] = []
+        for entry in due:
+            if self._entries.get(id(entry.websocket)) is not entry:
+                continue  # Forgotten since it was scheduled
+            if entry.pinged_at is not None and entry.last_seen < entry.pinged_at:
+                waited = now - entry.pinged_at
+                if waited >= self.pong_timeout:
+                    to_reap.append(entry)
+                else:
+                    self._schedule(entry, self.pong_timeout - waited)
+                continue
+            idle = now - entry.last_seen
+            if idle >= self.ping_interval:
+                entry.pinged_at = now
+                to_ping.append(entry)
+                self._schedule(entry, self.pong_timeout)
+            else:
+                entry.pinged_at = None
+                self._schedule(entry, self.ping_interval - idle)
+
+        if to_ping:
+            PINGS_SENT.inc(amount=len(to_ping))
+            results = await asyncio.gather(
+                *(manager.send(entry.websocket, PING_FRAME) for entry in to_ping), return_exceptions=True
+            )
+            to_reap += [entry for entry, result in zip(to_ping, results) if isinstance(result, Exception)]
+        if to_reap:
+            await self._reap(manager, to_reap)
+
+    async def _reap(self, manager, entries: List[_Entry]) -> None:
+        CONNECTIONS_REAPED.inc(amount=len(entries))
+        for entry in entries:
+            self.forget(entry.websocket)
+        await asyncio.gather(
+            *(entry.websocket.close(code=WS_CLOSE_PING_TIMEOUT, reason="Ping timeout") for entry in entries),
+            return_exceptions=True
+        )
+        for entry in entries:
+            await manager.close_socket(entry.user_id, entry.websocket)
+        logger.info(f"Reaped {len(entries)} unresponsive WebSocket connections")
+
+    def start(self, manager) -> None:
+        """Start the wheel on the running loop; ``manager`` holds the local sockets."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run(manager))
+
+    async def stop(self) -> None:
+        """Stop the wheel."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, manager) -> None:
+        next_tick = self._clock() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - self._clock()))
+            # Catch up on ticks missed while the loop was busy, so no slot is skipped
+            while next_tick <= self._clock():
+                try:
+                    await self.advance(manager)
+                except Exception as e:
+                    logger.error(f"Connection reaper tick failed: {e}")
+                next_tick += self.tick
+
+
+# Create a global reaper instance
+connection_reaper = ConnectionReaper()
+
+metrics.gauge(
+    "chat_ws_watched_connections", "WebSocket connections watched by the reaper per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): len(connection_reaper)}
+)
+
+__all__ = ['ConnectionReaper', 'connection_reaper', 'WS_CLOSE_PING_TIMEOUT']
@@ -0,0 +1,143 @@
+"""
+Compact registry of a worker's WebSocket connections.
+
+Each room membership is one ``Connection`` record with ``__slots__``. A
+room's members are kept in a dict keyed by user ID, so finding, adding or
+removing a user's record in a room is O(1) however many rooms the user is
+in. A user's records are also chained, both ways, from a single dict entry,
+so a user in one room costs one record and two dict entries, rather than a
+dict entry per room plus a set of rooms per user, and a record is unlinked
+without walking the chain.
+
+Room and user IDs are interned: every record of a room or user shares the
+string object stored when it first joined, whatever object the request that
+added it parsed.
+"""
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+
+class Connection:
+    """One room membership of a socket."""
+
+    __slots__ = ("websocket", "room_id", "user_id", "prev", "next")
+
+    def __init__(self, websocket: WebSocket, room_id: str, user_id: str):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_id = user_id
+        # The same user's previous and next records
+        self.prev: Optional["Connection"] = None
+        self.next: Optional["Connection"] = None
+
+
+class ConnectionRegistry:
+    def __init__(self):
+        # room_id -> user_id -> member record
+        self._rooms: Dict[str, Dict[str, Connection]] = {}
+        # user_id -> first of the user's records
+        self._users: Dict[str, Connection] = {}
+        # id() of every registered socket; WebSocket objects aren't hashable
+        self._sockets: Set[int] = set()
+        self._count = 0
+
+    def add_socket(self, websocket: WebSocket) -> None:
+        """Register an accepted socket that isn't in any room yet."""
+        self._sockets.add(id(websocket))
+
+    def has_socket(self, websocket: WebSocket) -> bool:
+        return id(websocket) in self._sockets
+
+    def remove_socket(self, websocket: WebSocket, user_id: str) -> List[str]:
+        """Unregister a user's socket; return the rooms it is still a member of."""
+        if id(websocket) not in self._sockets:
+            return []
+        self._sockets.discard(id(websocket))
+        return [connection.room_id for connection in self._chain(user_id) if connection.websocket is websocket]
+
+    def _chain(self, user_id: str) -> Iterator[Connection]:
+        connection = self._users.get(user_id)
+        while connection is not None:
+            yield connection
+            connection = connection.next
+
+    def get_connection(self, room_id: str, user_id: str) -> Optional[Connection]:
+        members = self._rooms.get(room_id)
+        return None if members is None else members.get(user_id)
+
+    def get(self, room_id: str, user_id: str) -> Optional[WebSocket]:
+        """The user's socket in a room, if any."""
+        connection = self.get_connection(room_id, user_id)
+        return None if connection is None else connection.websocket
+
+    def add(self, websocket: WebSocket, room_id: str, user_id: str) -> None:
+        """Make a socket the user's connection to a room, replacing any other."""
+        existing = self.get_connection(room_id, user_id)
+        if existing is not None:
+            existing.websocket = websocket
+            return
+        members = self._rooms.get(room_id)
+        if members is None:
+            members = self._rooms[room_id] = {}
+        else:
+            room_id = next(iter(members.values())).room_id
+        head = self._users.get(user_id)
+        if head is not None:
+            user_id = head.user_id
+        connection = Connection(websocket, room_id, user_id)
+        if head is not None:
+            head.prev = connection
+            connection.next = head
+        self._users[user_id] = connection
+        members[user_id] = connection
+        self._count += 1
+
+    def remove(self, room_id: str, user_id: str) -> Optional[WebSocket]:
+        """Remove the user from a room; return the socket that was removed."""
+        members = self._rooms.get(room_id)
+        connection = None if members is None else members.pop(user_id, None)
+        if connection is None:
+            return None
+        if not members:
+            del self._rooms[room_id]
+
+        if connection.next is not None:
+            connection.next.prev = connection.prev
+        if connection.prev is not None:
+            connection.prev.next = connection.next
+        elif connection.next is not None:
+            self._users[user_id] = connection.next
+        else:
+            del self._users[user_id]
+        self._count -= 1
+        return connection.websocket
+
+    def members(self, room_id: str) -> List[Connection]:
+        """A snapshot of a room's member records."""
+        members = self._rooms.get(room_id)
+        return [] if members is None else list(members.values())
+
+    def member_count(self, room_id: str) -> int:
+        return len(self._rooms.get(room_id, ()))
+
+    def rooms(self) -> Iterator[Tuple[str, List[str]]]:
+        """Each room with members and its members' user IDs."""
+        for room_id, members in list(self._rooms.items()):
+            yield room_id, list(members)
+
+    def socket_room_count(self, websocket: WebSocket, user_id: str) -> int:
+        return sum(1 for connection in self._chain(user_id) if connection.websocket is websocket)
+
+    def socket_count(self) -> int:
+        return len(self._sockets)
+
+    def subscription_count(self) -> int:
+        return self._count
+
+    def room_count(self) -> int:
+        return len(self._rooms)
+
+
+__all__ = ['ConnectionRegistry', 'Connection']
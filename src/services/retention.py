@@ -0,0 +1,83 @@
+"""
+Background retention sweep.
+
+Messages older than ``MESSAGE_EXPIRY_DAYS`` are removed one small step at a
+time: every ``RETENTION_INTERVAL`` seconds one worker trims the next batch of
+rooms for at most ``RETENTION_TIME_BUDGET_MS``, resuming from a cursor kept
+in Redis. Active rooms lose their old messages gradually, and idle rooms keep
+their recent ones.
+"""
+
+from typing import Dict, Optional
+import asyncio
+import logging
+
+from src.config.settings import get_settings
+from src.services.database import DatabaseInterface
+from src.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MESSAGES_EXPIRED = metrics.counter(
+    "chat_retention_messages_removed_total", "Messages removed by the retention sweep."
+)
+ROOMS_SWEPT = metrics.counter(
+    "chat_retention_rooms_swept_total", "Rooms visited by the retention sweep."
+)
+SWEEP_DURATION = metrics.histogram(
+    "chat_retention_sweep_seconds", "Duration of retention sweep steps."
+)
+
+
+class RetentionSweeper:
+    def __init__(
+        self,
+        enabled: bool = settings.RETENTION_ENABLED,
+        interval: float = settings.RETENTION_INTERVAL,
+        batch_size: int = settings.RETENTION_BATCH_ROOMS,
+        time_budget: float = settings.RETENTION_TIME_BUDGET_MS / 1000
+    ):
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db: DatabaseInterface) -> None:
+        """Start sweeping on the running loop."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run(db))
+
+    async def stop(self) -> None:
+        """Stop sweeping."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sweep_once(self, db: DatabaseInterface) -> Optional[Dict[str, int]]:
+        """Run one sweep step; None if another worker is sweeping"""
+        with SWEEP_DURATION.time():
+            result = await db.sweep_expired_messages(self.batch_size, self.time_budget, self.interval)
+        if result is not None:
+            ROOMS_SWEPT.inc(amount=result["rooms"])
+            MESSAGES_EXPIRED.inc(amount=result["removed"])
+        return result
+
+    async def _run(self, db: DatabaseInterface) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep_once(db)
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+
+
+# Create a global sweeper instance
+retention_sweeper = RetentionSweeper()
+
+__all__ = ['RetentionSweeper', 'retention_sweeper']
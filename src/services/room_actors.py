@@ -0,0 +1,328 @@
+"""
+Per-room message actors.
+
+Messages received over WebSocket are queued on their room's actor instead of
+being saved and broadcast by the receive loop that read them. The actor
+waits ``ROOM_BATCH_WINDOW`` seconds for more messages, saves up to
+``ROOM_BATCH_MAX`` of them with one ``save_messages`` call and broadcasts
+them in the order they were queued: a single message as a message frame as
+before, several as one ``batch`` frame. Every member of a room therefore
+sees its messages in the same order, and a sender's socket never waits on
+Redis.
+
+An actor's task exits once its queue is empty, so idle rooms cost nothing.
+
+Hot rooms switch to digest mode. A room that received more than
+``DIGEST_RATE`` messages per second over the last ``DIGEST_INTERVAL``, and
+has at least ``DIGEST_MIN_MEMBERS`` members on this worker, still has every
+message saved as usual, but its members get one ``digest`` frame per
+interval instead of a frame per batch. The frame gives the number of
+messages and a sample of at most ``DIGEST_MAX_MESSAGES`` of them. A room
+leaves digest mode once its rate falls to half the cap, after its last
+digest frame has gone out.
+"""
+
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import random
+import time
+
+from fastapi import WebSocket
+
+from src.config.settings import get_settings
+from src.models.message import Message
+from src.services.database import DatabaseInterface
+from src.services.metrics import metrics, WORKER_ID
+from src.services.profiles import profile_cache
+from src.services.protocol import Frame, list_frame, message_frame
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+ROOM_BATCH_SIZE = metrics.histogram(
+    "chat_room_batch_messages", "Messages saved and broadcast together by a room actor.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+ROOM_QUEUE_REJECTED = metrics.counter(
+    "chat_room_queue_rejected_total", "Messages refused because their room's queue was full."
+)
+ROOM_BATCH_FAILED = metrics.counter(
+    "chat_room_batch_failed_total", "Messages dropped because their batch could not be saved."
+)
+DIGEST_FRAMES = metrics.counter(
+    "chat_digest_frames_total", "Digest frames broadcast to rooms in digest mode."
+)
+DIGEST_SKIPPED = metrics.counter(
+    "chat_digest_skipped_messages_total", "Saved messages of rooms in digest mode left out of the sample."
+)
+
+# (message, socket it arrived on)
+_Item = Tuple[Message, WebSocket]
+
+
+class _Actor:
+    __slots__ = ("queue", "task")
+
+    def __init__(self):
+        self.queue: Deque[_Item] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class _Digest:
+    """Messages of a room in digest mode since its last digest frame."""
+
+    __slots__ = ("count", "sample")
+
+    def __init__(self):
+        self.count = 0
+        # (position, message); a uniform sample kept by reservoir sampling
+        self.sample: List[Tuple[int, Message]] = []
+
+    def add(self, messages: List[Message], size: int) -> None:
+        for message in messages:
+            if len(self.sample) < size:
+                self.sample.append((self.count, message))
+            else:
+                slot = random.randrange(self.count + 1)
+                if slot < size:
+                    self.sample[slot] = (self.count, message)
+            self.count += 1
+
+    def messages(self) -> List[Message]:
+        """The sampled messages, oldest first."""
+        return [message for _, message in sorted(self.sample, key=lambda item: item[0])]
+
+
+async def encode_messages(db: DatabaseInterface, messages: List[Message]) -> List[Frame]:
+    """Message frames, with their authors' profiles if ``BROADCAST_EMBED_AUTHOR``."""
+    if not settings.BROADCAST_EMBED_AUTHOR:
+        return [message_frame(message) for message in messages]
+    # One profile lookup for the whole batch
+    users = await profile_cache.get_many(db, {message.user_id for message in messages})
+    return [message_frame(message, users.get(message.user_id)) for message in messages]
+
+
+def batch_frame(room_id: str, frames: List[Frame]) -> Frame:
+    """One frame carrying several message frames, oldest first."""
+    return list_frame({"type": "batch", "room_id": room_id}, frames)
+
+
+def digest_frame(room_id: str, count: int, frames: List[Frame]) -> Frame:
+    """A digest of ``count`` messages carrying a sample of them, oldest first."""
+    return list_frame({"type": "digest", "room_id": room_id, "count": count}, frames)
+
+
+class RoomActors:
+    def __init__(
+        self,
+        enabled: bool = settings.ROOM_ACTORS_ENABLED,
+        batch_window: float = settings.ROOM_BATCH_WINDOW,
+        max_batch: int = settings.ROOM_BATCH_MAX,
+        max_queue: int = settings.ROOM_QUEUE_MAX,
+        digest_enabled: bool = settings.DIGEST_ENABLED,
+        digest_rate: float = settings.DIGEST_RATE,
+        digest_min_members: int = settings.DIGEST_MIN_MEMBERS,
+        digest_interval: float = settings.DIGEST_INTERVAL,
+        digest_max_messages: int = settings.DIGEST_MAX_MESSAGES,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.enabled = enabled
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.digest_enabled = digest_enabled
+        self.digest_rate = digest_rate
+        self.digest_min_members = digest_min_members
+        self.digest_interval = digest_interval
+        self.digest_max_messages = digest_max_messages
+        self._clock = clock
+        # room_id -> actor, for rooms with queued or in-flight messages only
+        self._actors: Dict[str, _Actor] = {}
+        # room_id -> messages received in the current interval, and when it began
+        self._counts: Dict[str, int] = {}
+        self._interval_start = clock()
+        # Rooms in digest mode, and their messages since the last digest frame
+        self._hot: Set[str] = set()
+        self._digests: Dict[str, _Digest] = {}
+        self._db: Optional[DatabaseInterface] = None
+        self._manager = None
+        self._task: Optional[asyncio.Task] = None
+        # Set while stop() drains the actors; no new messages are taken
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._actors)
+
+    @property
+    def running(self) -> bool:
+        return self._manager is not None
+
+    def hot_rooms(self) -> Set[str]:
+        """Rooms in digest mode."""
+        return set(self._hot)
+
+    def start(self, db: DatabaseInterface, manager) -> None:
+        """Accept messages; ``manager`` holds the local sockets."""
+        if self.enabled:
+            self._db = db
+            self._manager = manager
+            self._interval_start = self._clock()
+            if self.digest_enabled and (self._task is None or self._task.done()):
+                self._task = asyncio.get_running_loop().create_task(self._run_digests())
+
+    async def stop(self) -> None:
+        """Stop accepting messages, then wait for queued ones to be delivered."""
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        tasks = [actor.task for actor in self._actors.values() if actor.task is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # Deliver what the last digests held, then leave digest mode
+        await self.flush_digests(set(self._hot))
+        self._counts.clear()
+        self._db = self._manager = None
+        self._stopping = False
+
+    def submit(self, message: Message, websocket: WebSocket) -> bool:
+        """Queue a message on its room's actor; False if the queue is full or the actors are stopping."""
+        if self._stopping:
+            return False
+        actor = self._actors.get(message.room_id)
+        if actor is None:
+            actor = self._actors[message.room_id] = _Actor()
+        elif len(actor.queue) >= self.max_queue:
+            ROOM_QUEUE_REJECTED.inc()
+            return False
+        actor.queue.append((message, websocket))
+        if self.digest_enabled:
+            self._counts[message.room_id] = self._counts.get(message.room_id, 0) + 1
+        if actor.task is None:
+            actor.task = asyncio.get_running_loop().create_task(self._run(message.room_id, actor))
+        return True
+
+    async def _run(self, room_id: str, actor: _Actor) -> None:
+        try:
+            while actor.queue:
+                if self.batch_window > 0:
+                    await asyncio.sleep(self.batch_window)
+                batch = [actor.queue.popleft() for _ in range(min(len(actor.queue), self.max_batch))]
+                await self._deliver(room_id, batch)
+        finally:
+            # Nothing awaits between the empty check and here, so no message is missed
+            del self._actors[room_id]
+
+    async def _deliver(self, room_id: str, batch: List[_Item]) -> None:
+        messages = [message for message, _ in batch]
+        try:
+            await self._db.save_messages(messages)
+        except Exception as e:
+            logger.error(f"Saving {len(messages)} messages for room {room_id} failed: {e}")
+            ROOM_BATCH_FAILED.inc(amount=len(messages))
+            error = json.dumps({"type": "error", "room_id": room_id, "detail": "Message could not be saved"})
+            for websocket in {id(websocket): websocket for _, websocket in batch}.values():
+                try:
+                    await self._manager.send(websocket, error)
+                except Exception:
+                    pass
+            return
+
+        ROOM_BATCH_SIZE.observe(len(messages))
+        if room_id in self._hot:
+            digest = self._digests.get(room_id)
+            if digest is None:
+                digest = self._digests[room_id] = _Digest()
+            digest.add(messages, self.digest_max_messages)
+            return
+        try:
+            frames = await encode_messages(self._db, messages)
+            frame = frames[0] if len(frames) == 1 else batch_frame(room_id, frames)
+            await self._manager.broadcast_json(room_id, frame)
+        except Exception as e:
+            logger.error(f"Broadcasting {len(messages)} messages to room {room_id} failed: {e}")
+
+    def update_modes(self) -> Set[str]:
+        """Close the rate interval and move rooms into digest mode; return the rooms due to leave it.
+
+        Rooms due to leave stay in digest mode until ``flush_digests`` has
+        broadcast what they hold.
+        """
+        counts, self._counts = self._counts, {}
+        now = self._clock()
+        elapsed, self._interval_start = now - self._interval_start, now
+        if elapsed <= 0:
+            elapsed = self.digest_interval
+        hot = set()
+        for room_id, count in counts.items():
+            rate = count / elapsed
+            # Leaving takes a rate well below the cap, so rooms near it don't flap
+            cap = self.digest_rate / 2 if room_id in self._hot else self.digest_rate
+            if rate > cap and self._manager.member_count(room_id) >= self.digest_min_members:
+                hot.add(room_id)
+        for room_id in hot - self._hot:
+            logger.info(f"Room {room_id} switched to digest mode")
+        leaving = self._hot - hot
+        self._hot |= hot
+        return leaving
+
+    async def flush_digests(self, leaving: Iterable[str] = ()) -> None:
+        """Broadcast one digest frame to each room with digested messages, then take ``leaving``
+        rooms out of digest mode.
+
+        A leaving room stays in digest mode until no digest of it is left, so
+        a message its actor broadcasts directly never overtakes its last digest.
+        """
+        digests, self._digests = self._digests, {}
+        for room_id, digest in digests.items():
+            await self._broadcast_digest(room_id, digest)
+        for room_id in leaving:
+            # Messages delivered while the digests went out were digested too
+            digest = self._digests.pop(room_id, None)
+            while digest is not None:
+                await self._broadcast_digest(room_id, digest)
+                digest = self._digests.pop(room_id, None)
+            # No await since the last check, so the actor sees both changes together
+            self._hot.discard(room_id)
+            logger.info(f"Room {room_id} left digest mode")
+
+    async def _broadcast_digest(self, room_id: str, digest: _Digest) -> None:
+        messages = digest.messages()
+        try:
+            frames = await encode_messages(self._db, messages)
+            await self._manager.broadcast_json(room_id, digest_frame(room_id, digest.count, frames))
+        except Exception as e:
+            logger.error(f"Broadcasting the digest of room {room_id} failed: {e}")
+            return
+        DIGEST_FRAMES.inc()
+        DIGEST_SKIPPED.inc(amount=digest.count - len(messages))
+
+    async def _run_digests(self) -> None:
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            try:
+                await self.flush_digests(self.update_modes())
+            except Exception as e:
+                logger.error(f"Digest update failed: {e}")
+
+
+# Create a global actor registry instance
+room_actors = RoomActors()
+
+metrics.gauge(
+    "chat_room_actors", "Rooms with queued or in-flight messages per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): len(room_actors)}
+)
+metrics.gauge(
+    "chat_digest_rooms", "Rooms in digest mode per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): len(room_actors.hot_rooms())}
+)
+
+__all__ = ['RoomActors', 'room_actors', 'batch_frame', 'digest_frame', 'encode_messages']
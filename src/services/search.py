@@ -0,0 +1,39 @@
+"""
+Message search terms.
+
+Messages are indexed in Redis as they are written: every distinct term in a
+message's content gets a posting in ``search:{room_id}:{term}`` (member: the
+message ID) and in ``search:_all:{term}`` (member: ``{room_id}/{message_id}``),
+both scored by the message's timeline score so results come back newest
+first. This module holds the tokenizer shared by indexing and querying.
+"""
+
+from typing import List
+import re
+
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+# Key of the cross-room postings; room IDs are UUIDs, so it can't clash with a room
+ALL_ROOMS = "_all"
+
+
+def tokenize(text: str) -> List[str]:
+    """Distinct lowercase terms of ``text`` in order of first appearance, capped at SEARCH_MAX_TERMS"""
+    terms = dict.fromkeys(
+        token for token in _TOKEN_PATTERN.findall(text.lower())
+        if MIN_TERM_LENGTH <= len(token) <= MAX_TERM_LENGTH
+    )
+    return list(terms)[:settings.SEARCH_MAX_TERMS]
+
+
+def postings_key(room_id: str, term: str) -> str:
+    return f"search:{room_id}:{term}"
+
+
+__all__ = ['tokenize', 'postings_key', 'ALL_ROOMS']
@@ -0,0 +1,172 @@
+"""
+Redis command tracing and slow-operation log.
+
+``TracedRedis`` times every command and pipeline it sends. Calls slower than
+``REDIS_SLOW_THRESHOLD_MS`` land in a bounded slow log, and with
+``TRACING_ENABLED`` every call is also kept as a span that can be exported to
+a JSON file in the Chrome trace event format (chrome://tracing, Perfetto).
+"""
+
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+import json
+import os
+import re
+import time
+
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+# Name of the RedisDatabase method issuing the current Redis calls
+current_operation: ContextVar[str] = ContextVar("current_operation", default="-")
+
+_ID_PATTERN = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+"
+)
+_MAX_ARGS = 4
+_MAX_ARG_LENGTH = 64
+
+
+def key_pattern(key: Any) -> str:
+    """Collapse IDs in a key, e.g. ``room:<uuid>:messages`` -> ``room:{id}:messages``"""
+    if isinstance(key, bytes):
+        key = key.decode("utf-8", "replace")
+    return _ID_PATTERN.sub("{id}", str(key))
+
+
+def summarize_args(args: Sequence[Any]) -> str:
+    """Short, truncated rendering of command arguments for the slow log"""
+    parts = []
+    for arg in args[:_MAX_ARGS]:
+        if isinstance(arg, bytes):
+            arg = arg.decode("utf-8", "replace")
+        text = str(arg)
+        if len(text) > _MAX_ARG_LENGTH:
+            text = text[:_MAX_ARG_LENGTH] + "..."
+        parts.append(text)
+    if len(args) > _MAX_ARGS:
+        parts.append(f"... (+{len(args) - _MAX_ARGS} more)")
+    return " ".join(parts)
+
+
+class Tracer:
+    """Keeps recent Redis spans and the slow-operation ring."""
+
+    def __init__(
+        self,
+        enabled: bool = settings.TRACING_ENABLED,
+        buffer_size: int = settings.TRACE_BUFFER_SIZE,
+        slow_threshold: float = settings.REDIS_SLOW_THRESHOLD_MS / 1000,
+        slowlog_size: int = settings.REDIS_SLOWLOG_SIZE,
+        export_dir: str = settings.TRACE_EXPORT_DIR
+    ):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.export_dir = export_dir
+        # (operation, command, key pattern, args summary, start epoch, duration)
+        self._spans: Deque[Tuple[str, str, str, str, float, float]] = deque(maxlen=buffer_size)
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=slowlog_size)
+
+    @property
+    def active(self) -> bool:
+        return self.enabled or self.slow_threshold > 0
+
+    def record(self, command: str, key: Any, args: Sequence[Any], start: float, duration: float) -> None:
+        """Record one command or pipeline; ``start`` is a ``time.time()`` timestamp"""
+        slow = 0 < self.slow_threshold <= duration
+        if not self.enabled and not slow:
+            return
+        operation = current_operation.get()
+        key = key_pattern(key)
+        summary = summarize_args(args)
+        if self.enabled:
+            self._spans.append((operation, command, key, summary, start, duration))
+        if slow:
+            self._slow.append({
+                "method": operation,
+                "command": command,
+                "key_pattern": key,
+                "args": summary,
+                "duration_ms": round(duration * 1000, 3),
+                "timestamp": datetime.utcfromtimestamp(start).isoformat()
+            })
+
+    def slow_operations(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Slow operations, newest first"""
+        entries = list(reversed(self._slow))
+        return entries[:limit] if limit is not None else entries
+
+    def clear_slow_operations(self) -> None:
+        self._slow.clear()
+
+    def export(self, path: Optional[str] = None) -> Tuple[str, int]:
+        """Write buffered spans as Chrome trace events; returns the path and span count"""
+        if path is None:
+            os.makedirs(self.export_dir, exist_ok=True)
+            path = os.path.join(
+                self.export_dir, f"trace-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}.json"
+            )
+        pid = os.getpid()
+        events = [
+            {
+                "name": f"{command} {key}",
+                "cat": operation,
+                "ph": "X",
+                "ts": int(start * 1_000_000),
+                "dur": int(duration * 1_000_000),
+                "pid": pid,
+                "tid": operation,
+                "args": {"method": operation, "key_pattern": key, "args": summary}
+            }
+            for operation, command, key, summary, start, duration in list(self._spans)
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path, len(events)
+
+
+class TracedPipeline(Pipeline):
+    """Pipeline that reports each execute() as one span."""
+
+    async def execute(self, raise_on_error: bool = True):
+        if not tracer.active or not self.command_stack:
+            return await super().execute(raise_on_error)
+        stack = self.command_stack
+        commands = [args[0] for args, _ in stack]
+        label = "MULTI" if self.is_transaction or self.explicit_transaction else "PIPELINE"
+        key = stack[0][0][1] if len(stack[0][0]) > 1 else ""
+        wall = time.time()
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            tracer.record(f"{label}[{len(stack)}]", key, commands, wall, time.perf_counter() - start)
+
+
+class TracedRedis(Redis):
+    """Redis client that times every command and pipeline."""
+
+    async def execute_command(self, *args, **options):
+        if not tracer.active:
+            return await super().execute_command(*args, **options)
+        wall = time.time()
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            key = args[1] if len(args) > 1 else ""
+            tracer.record(str(args[0]), key, args[1:], wall, time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> TracedPipeline:
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# Create a singleton tracer
+tracer = Tracer()
+
+__all__ = ['Tracer', 'TracedRedis', 'TracedPipeline', 'tracer', 'current_operation', 'key_pattern']
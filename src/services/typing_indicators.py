@@ -0,0 +1,129 @@
+"""
+Typing indicators.
+
+Clients send ``{"type": "typing"}`` while typing and
+``{"type": "typing", "is_typing": false}`` when they stop. Each user's events
+are throttled to one per ``TYPING_THROTTLE`` seconds per room, and a user
+stops counting as typing ``TYPING_TIMEOUT`` seconds after their last event.
+Every ``TYPING_FLUSH_INTERVAL`` seconds each room whose set of typing users
+changed gets one frame with the whole set, however many events arrived.
+
+State lives only in this worker's memory; nothing is written to Redis.
+"""
+
+from typing import Callable, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import time
+
+from src.config.settings import get_settings
+from src.services.metrics import metrics
+from src.services.protocol import Frame
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+TYPING_EVENTS = metrics.counter(
+    "chat_typing_events_total", "Typing events received by result.", ("result",)
+)
+
+
+class TypingTracker:
+    def __init__(
+        self,
+        enabled: bool = settings.TYPING_ENABLED,
+        throttle: float = settings.TYPING_THROTTLE,
+        timeout: float = settings.TYPING_TIMEOUT,
+        flush_interval: float = settings.TYPING_FLUSH_INTERVAL,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.enabled = enabled
+        self.throttle = throttle
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self._clock = clock
+        # room_id -> user_id -> time the user stops counting as typing
+        self._typing: Dict[str, Dict[str, float]] = {}
+        # (room_id, user_id) -> time of the last accepted event
+        self._last_event: Dict[Tuple[str, str], float] = {}
+        # Rooms whose typing set changed since the last flush
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, room_id: str, user_id: str, is_typing: bool = True) -> None:
+        """Record a typing event from a user."""
+        if not self.enabled:
+            return
+        if not is_typing:
+            self.stopped(room_id, user_id)
+            return
+        room = self._typing.get(room_id, {})
+        now = self._clock()
+        key = (room_id, user_id)
+        if user_id in room and now - self._last_event.get(key, 0.0) < self.throttle:
+            TYPING_EVENTS.inc("throttled")
+            return
+        TYPING_EVENTS.inc("accepted")
+        self._last_event[key] = now
+        if user_id not in room:
+            self._dirty.add(room_id)
+        self._typing.setdefault(room_id, {})[user_id] = now + self.timeout
+
+    def stopped(self, room_id: str, user_id: str) -> None:
+        """Clear a user's typing state in a room, e.g. once they send a message or leave."""
+        room = self._typing.get(room_id)
+        if room and room.pop(user_id, None) is not None:
+            self._dirty.add(room_id)
+            self._last_event.pop((room_id, user_id), None)
+            if not room:
+                del self._typing[room_id]
+
+    def typing_users(self, room_id: str) -> Set[str]:
+        return set(self._typing.get(room_id, ()))
+
+    def _expire(self) -> None:
+        now = self._clock()
+        for room_id, room in list(self._typing.items()):
+            for user_id in [user_id for user_id, until in room.items() if until <= now]:
+                self.stopped(room_id, user_id)
+
+    async def flush(self, manager) -> None:
+        """Expire stale state and send one frame to each room whose typing set changed."""
+        self._expire()
+        dirty, self._dirty = self._dirty, set()
+        for room_id in dirty:
+            frame = Frame.of({
+                "type": "typing",
+                "room_id": room_id,
+                "users": sorted(self._typing.get(room_id, ()))
+            })
+            await manager.broadcast_json(room_id, frame)
+
+    def start(self, manager) -> None:
+        """Start flushing on the running loop; ``manager`` holds the local sockets."""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run(manager))
+
+    async def stop(self) -> None:
+        """Stop flushing."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, manager) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(manager)
+            except Exception as e:
+                logger.error(f"Typing flush failed: {e}")
+
+
+# Create a global tracker instance
+typing_tracker = TypingTracker()
+
+__all__ = ['TypingTracker', 'typing_tracker']
@@ -1,62 +1,147 @@
-from fastapi import WebSocket
-from typing import Dict, Set
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+import asyncio
 import json
 import logging
 from datetime import datetime
+from src.config.settings import get_settings
+from src.services.metrics import metrics, BROADCAST_LATENCY, MESSAGES_BROADCAST, WORKER_ID
+from src.services.loop_monitor import loop_monitor, REQUESTS_SHED
+from src.services.presence import presence_tracker
+from src.services.protocol import MSGPACK_PROTOCOL, Frame, negotiate, unpack
+from src.services.registry import Connection, ConnectionRegistry
+from src.services.reaper import connection_reaper
+from src.services.typing_indicators import typing_tracker
+
+# Close code for "try again later" (RFC 6455 registry)
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+# Upper bounds of the room sizes fan-out latency is reported for
+ROOM_SIZE_BUCKETS = (10, 100, 1000, 10000)
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def room_size_bucket(size: int) -> str:
+    """Label for a room of ``size`` members, e.g. ``"101-1000"`` or ``"10001+"``."""
+    lower = 1
+    for upper in ROOM_SIZE_BUCKETS:
+        if size <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
 
 class ConnectionManager:
-    def __init__(self):
-        # Store active connections by room_id and user_id
-        self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
-        # Store user's active rooms
-        self.user_rooms: Dict[str, Set[str]] = {}
-
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
-        """Connect a user to a room"""
-        try:
-            await websocket.accept()
-            logger.info(f"Accepting WebSocket connection for user {user_id} in room {room_id}")
+    def __init__(
+        self,
+        shard_size: int = settings.FANOUT_SHARD_SIZE,
+        room_concurrency: int = settings.FANOUT_ROOM_CONCURRENCY,
+        max_concurrency: int = settings.FANOUT_MAX_CONCURRENCY
+    ):
+        # Sockets and their room memberships (see ConnectionRegistry)
+        self.registry = ConnectionRegistry()
+        self.shard_size = shard_size
+        self.room_concurrency = room_concurrency
+        self.max_concurrency = max_concurrency
+        # Shards being sent across all rooms; made on the first fan-out, since
+        # before Python 3.10 a semaphore binds to the loop current when it is made
+        self._fanout_limit: Optional[asyncio.Semaphore] = None
+        # room_id -> [shard limit, broadcasts using it]; dropped when no broadcast is running
+        self._room_limits: Dict[str, list] = {}
+        # id() of sockets that negotiated msgpack; all others speak JSON
+        self._binary: Set[int] = set()
+
+    async def accept(self, websocket: WebSocket, user_id: str, description: str = "") -> bool:
+        """Accept a socket for a user, without joining any room.
+
+        Returns False when the connection was refused because the event loop
+        is overloaded; the socket has then already been closed with 1013.
+        """
+        subprotocol = negotiate(websocket.scope.get("subprotocols", ()), settings.WS_MSGPACK_ENABLED)
+        await websocket.accept(subprotocol=subprotocol)
+        if loop_monitor.is_overloaded():
+            REQUESTS_SHED.inc("websocket")
+            logger.warning(f"Shedding WebSocket connection for user {user_id}{description}")
+            await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason="Server overloaded")
+            return False
+        logger.info(f"Accepting WebSocket connection for user {user_id}{description}")
+        self.registry.add_socket(websocket)
+        if subprotocol == MSGPACK_PROTOCOL:
+            self._binary.add(id(websocket))
+        connection_reaper.track(websocket, user_id)
+        return True
 
-            # Initialize room if it doesn't exist
-            if room_id not in self.active_connections:
-                self.active_connections[room_id] = {}
+    async def send(self, websocket: WebSocket, frame: Union[Frame, str]) -> None:
+        """Send a frame, or an encoded JSON frame, to one socket in the protocol it negotiated."""
+        if id(websocket) in self._binary:
+            await websocket.send_bytes((Frame(frame) if isinstance(frame, str) else frame).packed())
+        else:
+            await websocket.send_text(frame if isinstance(frame, str) else frame.text)
 
-            # Store the connection
-            self.active_connections[room_id][user_id] = websocket
+    async def receive(self, websocket: WebSocket) -> Any:
+        """Receive and decode the next frame from a socket.
 
-            # Track user's rooms
-            if user_id not in self.user_rooms:
-                self.user_rooms[user_id] = set()
-            self.user_rooms[user_id].add(room_id)
+        msgpack sockets may still send JSON text frames.
+        """
+        if id(websocket) not in self._binary:
+            return await websocket.receive_json()
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return unpack(message["bytes"])
+        return json.loads(message["text"])
 
-            logger.info(f"User {user_id} connected to room {room_id}")
+    def subscribe(self, websocket: WebSocket, room_id: str, user_id: str) -> None:
+        """Add an accepted socket to a room's members."""
+        self.registry.add(websocket, room_id, user_id)
+        presence_tracker.joined(room_id, user_id)
+        logger.info(f"User {user_id} connected to room {room_id}")
+
+    def is_subscribed(self, websocket: WebSocket, room_id: str, user_id: str) -> bool:
+        return self.registry.get(room_id, user_id) is websocket
+
+    def room_members(self) -> Iterator[Tuple[str, List[str]]]:
+        """Each room with local members and the members' user IDs."""
+        return self.registry.rooms()
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str) -> bool:
+        """Connect a user to a room.
+
+        Returns False when the connection was refused because the event loop
+        is overloaded; the socket has then already been closed with 1013.
+        """
+        try:
+            if not await self.accept(websocket, user_id, f" in room {room_id}"):
+                return False
+            self.subscribe(websocket, room_id, user_id)
+            return True
         except Exception as e:
             logger.error(f"Error connecting user {user_id} to room {room_id}: {e}")
             raise
 
-    async def disconnect(self, room_id: str, user_id: str):
-        """Disconnect a user from a room"""
+    async def disconnect(self, room_id: str, user_id: str, websocket: Optional[WebSocket] = None):
+        """Disconnect a user from a room.
+
+        With ``websocket``, nothing happens unless it is still the user's
+        connection to the room, so closing a replaced socket is harmless.
+        """
         try:
-            # Remove from room connections
-            if room_id in self.active_connections:
-                if user_id in self.active_connections[room_id]:
-                    del self.active_connections[room_id][user_id]
-                    if not self.active_connections[room_id]:
-                        del self.active_connections[room_id]
-
-            # Remove from user's rooms
-            if user_id in self.user_rooms:
-                self.user_rooms[user_id].discard(room_id)
-                if not self.user_rooms[user_id]:
-                    del self.user_rooms[user_id]
+            if websocket is not None and not self.is_subscribed(websocket, room_id, user_id):
+                return
+
+            if self.registry.remove(room_id, user_id) is not None:
+                presence_tracker.left(room_id, user_id)
+                typing_tracker.stopped(room_id, user_id)
 
             # Notify others in the room
             await self.broadcast_to_room(
                 room_id,
                 {
                     "type": "system",
+                    "room_id": room_id,
                     "content": f"User {user_id} left the chat",
                     "timestamp": datetime.utcnow().isoformat()
                 },
@@ -67,9 +152,18 @@ class ConnectionManager:
         except Exception as e:
             logger.error(f"Error disconnecting user {user_id} from room {room_id}: {e}")
 
+    async def close_socket(self, user_id: str, websocket: WebSocket):
+        """Forget a closed socket and leave every room it is still in."""
+        if not self.registry.has_socket(websocket):
+            return
+        connection_reaper.forget(websocket)
+        self._binary.discard(id(websocket))
+        for room_id in self.registry.remove_socket(websocket, user_id):
+            await self.disconnect(room_id, user_id, websocket)
+
     async def broadcast_to_room(self, room_id: str, message: dict, exclude_user: str = None):
         """Broadcast a message to all users in a room"""
-        if room_id not in self.active_connections:
+        if not self.registry.member_count(room_id):
             return
 
         # Convert datetime objects to ISO format strings
@@ -82,23 +176,130 @@ class ConnectionManager:
                         if isinstance(v, datetime):
                             value[k] = v.isoformat()
 
-        message_json = json.dumps(message)
-        for user_id, connection in self.active_connections[room_id].items():
-            if user_id != exclude_user:
+        await self.broadcast_json(room_id, Frame.of(message), exclude_user)
+
+    async def broadcast_json(self, room_id: str, frame: Union[Frame, str], exclude_user: str = None):
+        """Broadcast a frame, or an encoded JSON frame, to all users in a room"""
+        members = self.registry.members(room_id)
+        if not members:
+            return
+
+        MESSAGES_BROADCAST.inc()
+        # Encoded at most once per protocol, however many members and shards
+        if isinstance(frame, str):
+            frame = Frame(frame)
+        with BROADCAST_LATENCY.time(room_size_bucket(len(members))):
+            if len(members) <= self.shard_size:
+                failed = await self._send_shard(members, frame, exclude_user)
+            else:
+                failed = await self._fan_out(room_id, members, frame, exclude_user)
+        for member in failed:
+            await self.close_socket(member.user_id, member.websocket)
+
+    async def _send_shard(
+        self, members: Sequence[Connection], frame: Frame, exclude_user: Optional[str]
+    ) -> List[Connection]:
+        """Send a frame to each member in turn; return the members it failed for."""
+        binary = self._binary
+        failed = []
+        for member in members:
+            if member.user_id != exclude_user:
                 try:
-                    await connection.send_text(message_json)
+                    if binary and id(member.websocket) in binary:
+                        await member.websocket.send_bytes(frame.packed())
+                    else:
+                        await member.websocket.send_text(frame.text)
                 except Exception as e:
-                    logger.error(f"Error sending message to user {user_id}: {e}")
-                    await self.disconnect(room_id, user_id)
+                    logger.error(f"Error sending message to user {member.user_id}: {e}")
+                    failed.append(member)
+        return failed
+
+    async def _fan_out(
+        self, room_id: str, members: List[Connection], frame: Frame, exclude_user: Optional[str]
+    ) -> List[Connection]:
+        """Send a frame to a large room in shards of ``shard_size`` members.
+
+        Each shard is a task of its own, so other work on the loop runs
+        between shards and one slow socket holds up only its shard. At most
+        ``room_concurrency`` shards of a room and ``max_concurrency`` shards
+        in all are sent at once.
+        """
+        if self._fanout_limit is None:
+            self._fanout_limit = asyncio.Semaphore(self.max_concurrency)
+        fanout_limit = self._fanout_limit
+        limit = self._room_limits.get(room_id)
+        if limit is None:
+            limit = self._room_limits[room_id] = [asyncio.Semaphore(self.room_concurrency), 0]
+        limit[1] += 1
+
+        async def send(shard: List[Connection]) -> List[Connection]:
+            async with limit[0], fanout_limit:
+                # Yield once the slot is held; sends rarely yield on their own,
+                # so otherwise every shard would run in the same loop iteration
+                await asyncio.sleep(0)
+                return await self._send_shard(shard, frame, exclude_user)
+
+        try:
+            results = await asyncio.gather(*(
+                asyncio.create_task(send(members[start:start + self.shard_size]))
+                for start in range(0, len(members), self.shard_size)
+            ))
+        finally:
+            limit[1] -= 1
+            if not limit[1]:
+                del self._room_limits[room_id]
+        return [member for failed in results for member in failed]
+
+    def connection_count(self) -> int:
+        """Number of WebSocket connections held by this worker"""
+        return self.registry.socket_count()
+
+    def subscription_count(self) -> int:
+        """Number of room memberships held by this worker's connections"""
+        return self.registry.subscription_count()
+
+    def room_count(self) -> int:
+        """Number of rooms with at least one connected member"""
+        return self.registry.room_count()
+
+    def member_count(self, room_id: str) -> int:
+        """Number of this worker's connections to a room"""
+        return self.registry.member_count(room_id)
+
+    def binary_count(self) -> int:
+        """Number of this worker's connections speaking msgpack"""
+        return len(self._binary)
 
     async def send_personal_message(self, room_id: str, user_id: str, message: dict):
         """Send a message to a specific user in a room"""
-        if room_id in self.active_connections and user_id in self.active_connections[room_id]:
+        connection = self.registry.get(room_id, user_id)
+        if connection is not None:
             try:
-                await self.active_connections[room_id][user_id].send_text(json.dumps(message))
+                await self.send(connection, Frame.of(message))
             except Exception as e:
                 logger.error(f"Error sending personal message to user {user_id}: {e}")
-                await self.disconnect(room_id, user_id)
+                await self.close_socket(user_id, connection)
 
 # Create a global connection manager instance
-manager = ConnectionManager() 
\ No newline at end of file
+manager = ConnectionManager()
+
+metrics.gauge(
+    "chat_active_websockets", "Open WebSocket connections per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): manager.connection_count()}
+)
+metrics.gauge(
+    "chat_websocket_subscriptions", "Room memberships of open WebSocket connections per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): manager.subscription_count()}
+)
+metrics.gauge(
+    "chat_rooms_with_members", "Rooms with at least one connected member per worker.", ("worker",),
+    callback=lambda: {(WORKER_ID,): manager.room_count()}
+) 
+metrics.gauge(
+    "chat_websockets_by_protocol", "Open WebSocket connections per worker by negotiated protocol.",
+    ("worker", "protocol"),
+    callback=lambda: {
+        (WORKER_ID, "json"): manager.connection_count() - manager.binary_count(),
+        (WORKER_ID, "msgpack"): manager.binary_count()
+    }
+)
@@ -6,6 +6,7 @@ from src.config.settings import get_settings
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
 from src.main import app
+from src.middleware.rate_limiter import rate_limiter
 
 settings = get_settings()
 
@@ -33,6 +34,12 @@ async def setup_database(db: RedisDatabase):
     if db.redis_client:
         await db.redis_client.flushdb()
 
+@pytest.fixture(autouse=True)
+def reset_rate_limiter():
+    """Give each test a fresh rate limit window; all test clients share one IP."""
+    rate_limiter.requests.clear()
+    yield
+
 @pytest.fixture
 async def async_client() -> AsyncGenerator[AsyncClient, None]:
     """Create an AsyncClient instance for testing."""
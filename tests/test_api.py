@@ -88,4 +88,588 @@ async def test_get_messages(db: RedisDatabase, async_client: AsyncClient):
     data = response.json()
     assert isinstance(data, list)
     assert len(data) == 1
-    assert data[0]["content"] == "Hello, World!" 
\ No newline at end of file
+    assert data[0]["content"] == "Hello, World!" 
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(db: RedisDatabase, async_client: AsyncClient):
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    await async_client.post(
+        f"/api/v1/rooms/{room_id}/messages",
+        json={"content": "Hello, World!", "user_id": user_id}
+    )
+
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'chat_messages_received_total{transport="http"}' in body
+    assert "chat_messages_saved_total" in body
+    assert 'chat_redis_operation_seconds_count{method="save_message"}' in body
+    assert 'route="/api/v1/rooms/{room_id}/messages"' in body
+
+
+@pytest.mark.asyncio
+async def test_load_shedding_rejects_non_critical_requests(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from src.services.loop_monitor import loop_monitor
+    monkeypatch.setattr(loop_monitor, "threshold", -1.0)
+
+    response = await async_client.get("/api/v1/rooms")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+    # Critical endpoints keep working
+    response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    assert response.status_code == 200
+
+    response = await async_client.get("/api/v1/admin/loop-lag")
+    assert response.status_code == 200
+    assert response.json()["overloaded"] is True
+
+
+@pytest.mark.asyncio
+async def test_redis_slowlog(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from src.services.tracing import tracer
+    # Record every call as slow
+    monkeypatch.setattr(tracer, "slow_threshold", 1e-9)
+    tracer.clear_slow_operations()
+
+    await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+
+    response = await async_client.get("/api/v1/admin/redis/slowlog")
+    assert response.status_code == 200
+    entries = response.json()["entries"]
+    assert entries
+    assert entries[0]["method"] == "create_room"
+    assert entries[0]["key_pattern"] in ("room:{id}", "rooms")
+
+    response = await async_client.get("/api/v1/admin/redis/slowlog", params={"limit": -1})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_memory_redis_is_traced(monkeypatch, tmp_path):
+    import json
+    from collections import deque
+    from src.config.settings import get_settings
+    from src.services.tracing import tracer
+    monkeypatch.setattr(get_settings(), "REDIS_URL", "memory://")
+    monkeypatch.setattr(tracer, "enabled", True)
+    monkeypatch.setattr(tracer, "_spans", deque(maxlen=100))
+
+    db = RedisDatabase()
+    await db.connect()
+    try:
+        room = await db.create_room("Traced Room")
+        assert (await db.get_room(room.id)).name == "Traced Room"
+    finally:
+        await db.disconnect()
+
+    path, count = tracer.export(str(tmp_path / "trace.json"))
+    assert count > 0
+    with open(path) as f:
+        methods = {event["args"]["method"] for event in json.load(f)["traceEvents"]}
+    assert {"create_room", "get_room"} <= methods
+
+
+@pytest.mark.asyncio
+async def test_profiling_middleware(db: RedisDatabase, tmp_path):
+    from src.main import app
+    from src.middleware.profiler import Profiler, ProfilingMiddleware
+    # Installed at startup only with PROFILING_ENABLED, so wrap the app here
+    profiler = Profiler(enabled=True, sample_rate=0.0, output_dir=str(tmp_path), interval=1e-5)
+    async with AsyncClient(app=ProfilingMiddleware(app, profiler), base_url="http://test") as client:
+        # Without the header nothing is sampled
+        response = await client.get("/api/v1/rooms")
+        assert response.status_code == 200
+        assert list(tmp_path.iterdir()) == []
+
+        response = await client.get("/api/v1/rooms", headers={"X-Profile": "1"})
+        assert response.status_code == 200
+
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == 1
+    assert profiles[0].name.endswith(".collapsed")
+    assert "-http-GET_api_v1_rooms-" in profiles[0].name
+    stack, count = profiles[0].read_text().splitlines()[0].rsplit(" ", 1)
+    assert stack and int(count) > 0
+
+
+@pytest.mark.asyncio
+async def test_export_messages(db: RedisDatabase, async_client: AsyncClient):
+    import gzip
+    import json
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    for content in ("first", "second", "third"):
+        await async_client.post(
+            f"/api/v1/rooms/{room_id}/messages",
+            json={"content": content, "user_id": user_id}
+        )
+
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages/export",
+        headers={"Accept-Encoding": "identity"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [m["content"] for m in lines] == ["first", "second", "third"]
+
+    # since/until are inclusive bounds on created_at
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages/export",
+        params={"since": lines[1]["created_at"], "until": lines[1]["created_at"]},
+        headers={"Accept-Encoding": "identity"}
+    )
+    assert [json.loads(line)["content"] for line in response.text.splitlines()] == ["second"]
+
+    # Compressed on request; decode the raw body to check the gzip stream itself
+    async with async_client.stream(
+        "GET", f"/api/v1/rooms/{room_id}/messages/export", headers={"Accept-Encoding": "gzip"}
+    ) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    assert len(gzip.decompress(body).splitlines()) == 3
+
+
+@pytest.mark.asyncio
+async def test_export_messages_beyond_timeline(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    import json
+    from src.config.settings import get_settings
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    count = get_settings().MAX_MESSAGES_PER_ROOM + 50
+    response = await async_client.post("/api/v1/messages/import", json=[
+        {
+            "room_id": room_id,
+            "user_id": user_id,
+            "content": f"message {i}",
+            "created_at": f"2024-01-01T12:{i // 60:02d}:{i % 60:02d}"
+        }
+        for i in range(count)
+    ])
+    assert response.json()["imported"] == count
+
+    # Exported from the archive in several chunks, past the timeline's window
+    monkeypatch.setattr(get_settings(), "EXPORT_CHUNK_SIZE", 40)
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages/export",
+        headers={"Accept-Encoding": "identity"}
+    )
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [m["content"] for m in lines] == [f"message {i}" for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_import_messages(db: RedisDatabase, async_client: AsyncClient):
+    import json
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+
+    lines = [
+        {"room_id": room_id, "user_id": user_id, "content": "first", "created_at": "2024-01-01T12:00:00"},
+        {"room_id": room_id, "user_id": user_id, "content": "second"},
+        {"room_id": "missing", "user_id": user_id, "content": "lost"},
+        {"room_id": room_id, "content": "no user"},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\nnot json\n"
+    response = await async_client.post(
+        "/api/v1/messages/import",
+        content=body,
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert report["imported"] == 2
+    assert report["failed"] == 3
+    assert sorted(error["index"] for error in report["errors"]) == [2, 3, 4]
+
+    # A JSON array body works too
+    response = await async_client.post(
+        "/api/v1/messages/import",
+        json=[{"room_id": room_id, "user_id": user_id, "content": "third"}]
+    )
+    assert response.json()["imported"] == 1
+
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages")
+    messages = response.json()
+    assert [m["content"] for m in messages] == ["third", "second", "first"]
+    assert messages[2]["created_at"] == "2024-01-01T12:00:00"
+
+    # Aware timestamps are stored as naive UTC
+    late = {"room_id": room_id, "user_id": user_id, "content": "late"}
+    late["created_at"] = "2024-01-01T14:00:00+02:00"
+    await async_client.post("/api/v1/messages/import", json=[late])
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages")
+    stored = {m["content"]: m["created_at"] for m in response.json()}
+    assert stored["late"] == "2024-01-01T12:00:00"
+
+    # A reply's parent must be stored in its room or come in the same batch
+    replies = [
+        {"room_id": room_id, "user_id": user_id, "content": "orphan", "reply_to": "missing"},
+        {"room_id": room_id, "user_id": user_id, "content": "parent", "id": "p1"},
+        {"room_id": room_id, "user_id": user_id, "content": "child", "reply_to": "p1"},
+    ]
+    report = (await async_client.post("/api/v1/messages/import", json=replies)).json()
+    assert report["imported"] == 2
+    assert report["errors"] == [{"index": 0, "error": "Parent message not found"}]
+
+    # Stored IDs, and IDs repeated in the body, aren't overwritten
+    again = [
+        {"room_id": room_id, "user_id": user_id, "content": "parent again", "id": "p1"},
+        {"room_id": room_id, "user_id": user_id, "content": "new", "id": "p2"},
+        {"room_id": room_id, "user_id": user_id, "content": "new again", "id": "p2"},
+    ]
+    report = (await async_client.post("/api/v1/messages/import", json=again)).json()
+    assert report["imported"] == 1
+    assert report["errors"] == [
+        {"index": 0, "error": "Message already exists"},
+        {"index": 2, "error": "Message already exists"}
+    ]
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages/p1/thread")
+    assert response.json()["reply_count"] == 1
+    stored = {m["id"]: m["content"] for m in (await async_client.get(f"/api/v1/rooms/{room_id}/messages")).json()}
+    assert (stored["p1"], stored["p2"]) == ("parent", "new")
+
+    # Oversized NDJSON lines are reported and skipped without being buffered
+    from src.services.importer import iter_ndjson
+
+    async def chunks():
+        for chunk in (b'{"a": 1}\n{"b": "', b"x" * 40, b"x" * 40, b'"}\n{"c": 3}'):
+            yield chunk
+
+    items = [item async for item in iter_ndjson(chunks(), max_item_bytes=32)]
+    assert items == [({"a": 1}, None), (None, "Line exceeds 32 bytes"), ({"c": 3}, None)]
+
+
+@pytest.mark.asyncio
+async def test_batch_get_users_and_rooms(db: RedisDatabase, async_client: AsyncClient):
+    user_ids = []
+    for name in ("alice", "bob"):
+        response = await async_client.post("/api/v1/users", json={"username": name})
+        user_ids.append(response.json()["id"])
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+
+    response = await async_client.post(
+        "/api/v1/users:batchGet",
+        json={"ids": [user_ids[1], "missing", user_ids[0], user_ids[1]]}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [user["username"] for user in data["users"]] == ["bob", "alice"]
+    assert data["missing"] == ["missing"]
+
+    response = await async_client.post("/api/v1/rooms:batchGet", json={"ids": [room_id]})
+    assert response.status_code == 200
+    assert response.json()["rooms"][0]["name"] == "Test Room"
+
+    response = await async_client.post("/api/v1/users:batchGet", json={"ids": ["x"] * 101})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_get_messages_with_users(db: RedisDatabase, async_client: AsyncClient):
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    for content in ("one", "two"):
+        await async_client.post(
+            f"/api/v1/rooms/{room_id}/messages",
+            json={"content": content, "user_id": user_id}
+        )
+
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages", params={"include_users": "true"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["messages"]) == 2
+    assert list(data["users"]) == [user_id]
+    assert data["users"][user_id]["username"] == "testuser"
+
+    # The envelope matches the documented response shape
+    from src.api.v1.router import MessageHistoryResponse
+    assert MessageHistoryResponse.model_validate(data).users[user_id].username == "testuser"
+    schema = (await async_client.get("/openapi.json")).json()
+    documented = schema["paths"]["/api/v1/rooms/{room_id}/messages"]["get"]["responses"]["200"]
+    shapes = documented["content"]["application/json"]["schema"]["anyOf"]
+    assert {"$ref": "#/components/schemas/MessageHistoryResponse"} in shapes
+
+
+@pytest.mark.asyncio
+async def test_get_messages_time_range(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from datetime import datetime, timedelta
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    base = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    at = {hour: (base + timedelta(hours=hour)).isoformat() for hour in (10, 11, 12, 13)}
+    # Imported out of order; the timeline is ordered by created_at
+    await async_client.post("/api/v1/messages/import", json=[
+        {"room_id": room_id, "user_id": user_id, "content": f"at {hour}", "created_at": at[hour]}
+        for hour in (12, 10, 13, 11)
+    ])
+
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages", params={"from": at[11], "to": at[13]}
+    )
+    assert response.status_code == 200
+    assert [m["content"] for m in response.json()] == ["at 12", "at 11"]
+
+    # Page backwards from the oldest message seen
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages", params={"to": at[11] + "+00:00", "limit": 5}
+    )
+    assert [m["content"] for m in response.json()] == ["at 10"]
+
+    # The newest page is ordered by created_at too, and the timeline holds IDs only
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages")
+    messages = response.json()
+    assert [m["content"] for m in messages] == ["at 13", "at 12", "at 11", "at 10"]
+    timeline = await db.redis_client.zrevrange(f"room:{room_id}:timeline", 0, -1)
+    assert timeline == [m["id"] for m in messages]
+
+    # Ranges are read from the archive, past the timeline's window
+    from src.models.message import Message
+    monkeypatch.setattr(db, "_max_messages", 1)
+    await db.save_message(Message(id="now", room_id=room_id, user_id=user_id, content="now"))
+    assert await db.redis_client.zcard(f"room:{room_id}:timeline") == 1
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages", params={"from": at[11], "to": at[13]}
+    )
+    assert [m["content"] for m in response.json()] == ["at 12", "at 11"]
+
+
+@pytest.mark.asyncio
+async def test_retention_sweep(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from datetime import datetime, timedelta
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    from src.config.settings import get_settings
+    expiry_days = get_settings().MESSAGE_EXPIRY_DAYS
+    expired = (datetime.utcnow() - timedelta(days=expiry_days + 1)).isoformat()
+    await async_client.post("/api/v1/messages/import", json=[
+        {"room_id": room_id, "user_id": user_id, "content": "old", "created_at": expired},
+        {"room_id": room_id, "user_id": user_id, "content": "new"},
+    ])
+
+    response = await async_client.post("/api/v1/admin/retention/sweep")
+    assert response.status_code == 200
+    assert response.json()["removed"] == 1
+
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages")
+    assert [m["content"] for m in response.json()] == ["new"]
+
+    # A message trimmed from the timeline is still swept, with its index entries
+    from src.models.message import Message
+    db._max_messages = 1
+    await db.save_messages([
+        Message(id="trimmed", room_id=room_id, user_id=user_id, content="quokka", created_at=expired),
+        Message(id="kept", room_id=room_id, user_id=user_id, content="latest")
+    ])
+    assert "trimmed" not in await db.redis_client.zrange(f"room:{room_id}:timeline", 0, -1)
+    assert await db.redis_client.ttl(f"room:{room_id}:docs") > 0
+    await db.redis_client.delete("retention:lock")
+    assert (await db.sweep_expired_messages(100, 1, 0.001))["removed"] == 1
+    assert not await db.redis_client.hexists(f"room:{room_id}:docs", "trimmed")
+    assert not await db.redis_client.exists(f"search:{room_id}:quokka")
+    assert f"{room_id}/trimmed" not in await db.redis_client.zrange(f"user:{user_id}:messages", 0, -1)
+
+    # Rooms are also trimmed to ARCHIVE_MAX_MESSAGES, oldest first
+    monkeypatch.setattr(get_settings(), "ARCHIVE_MAX_MESSAGES", 1)
+    await db.redis_client.delete("retention:lock")
+    assert (await db.sweep_expired_messages(100, 1, 0.001))["removed"] == 1
+    assert await db.redis_client.zrange(f"room:{room_id}:archive", 0, -1) == ["kept"]
+
+
+@pytest.mark.asyncio
+async def test_search_messages(db: RedisDatabase, async_client: AsyncClient):
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    await async_client.post("/api/v1/messages/import", json=[
+        {"room_id": room_id, "user_id": user_id, "content": content,
+         "created_at": (now - timedelta(minutes=minutes)).isoformat()}
+        for content, minutes in (("Deploy finished", 3), ("deploy failed, rolling back", 2), ("lunch?", 1))
+    ])
+
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/search", params={"q": "DEPLOY"})
+    assert response.status_code == 200
+    assert [m["content"] for m in response.json()] == ["deploy failed, rolling back", "Deploy finished"]
+
+    response = await async_client.get("/api/v1/search", params={"q": "deploy finished"})
+    assert [m["content"] for m in response.json()] == ["Deploy finished"]
+
+    # Messages trimmed from the room's history can still be found
+    from src.models.message import Message
+    db._max_messages = 2
+    await db.save_messages([
+        Message(id=f"q{i}", room_id=room_id, user_id=user_id, content=f"quokka {i}") for i in range(5)
+    ])
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/search", params={"q": "quokka"})
+    assert [m["id"] for m in response.json()] == ["q4", "q3", "q2", "q1", "q0"]
+    assert await db.redis_client.ttl(f"search:{room_id}:quokka") > 0
+
+
+@pytest.mark.asyncio
+async def test_get_user_messages(db: RedisDatabase, async_client: AsyncClient):
+    from datetime import datetime, timedelta
+    room_ids = []
+    for name in ("one", "two"):
+        response = await async_client.post("/api/v1/rooms", json={"name": name})
+        room_ids.append(response.json()["id"])
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    now = datetime.utcnow()
+    await async_client.post("/api/v1/messages/import", json=[
+        {"room_id": room_ids[i % 2], "user_id": user_id, "content": f"message {i}",
+         "created_at": (now - timedelta(minutes=10 - i)).isoformat()}
+        for i in range(5)
+    ])
+
+    contents = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get(f"/api/v1/users/{user_id}/messages", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        contents += [m["content"] for m in page["messages"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert contents == [f"message {i}" for i in range(4, -1, -1)]
+
+    # Pages stay full past messages trimmed from their room's history or no longer stored
+    from src.models.message import Message
+    db._max_messages = 1
+    await db.save_messages([
+        Message(id=f"extra{i}", room_id=room_ids[0], user_id=user_id, content=f"extra {i}") for i in range(3)
+    ])
+    await db.redis_client.hdel(f"room:{room_ids[0]}:docs", "extra1")
+    response = await async_client.get(f"/api/v1/users/{user_id}/messages", params={"limit": 3})
+    page = response.json()
+    assert [m["content"] for m in page["messages"]] == ["extra 2", "extra 0", "message 4"]
+    assert page["next_cursor"] is not None
+
+@pytest.mark.asyncio
+async def test_get_thread(db: RedisDatabase, async_client: AsyncClient):
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "testroom"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    parent = (await async_client.post(
+        f"/api/v1/rooms/{room_id}/messages", json={"content": "question", "user_id": user_id}
+    )).json()
+    for i in range(3):
+        await async_client.post(
+            f"/api/v1/rooms/{room_id}/messages",
+            json={"content": f"reply {i}", "user_id": user_id, "reply_to": parent["id"]}
+        )
+
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages/{parent['id']}/thread", params={"limit": 2}
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert page["reply_count"] == 3
+    assert [m["content"] for m in page["messages"]] == ["reply 0", "reply 1"]
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages/{parent['id']}/thread",
+        params={"limit": 2, "cursor": page["next_cursor"]}
+    )
+    assert [m["content"] for m in response.json()["messages"]] == ["reply 2"]
+
+    response = await async_client.get(
+        f"/api/v1/rooms/{room_id}/messages", params={"include_reply_counts": "true"}
+    )
+    assert response.status_code == 200
+    assert response.json()["reply_counts"] == {parent["id"]: 3}
+
+    # Only messages stored in the room can be replied to
+    response = await async_client.post(
+        f"/api/v1/rooms/{room_id}/messages",
+        json={"content": "stray", "user_id": user_id, "reply_to": "missing"}
+    )
+    assert response.status_code == 404
+    assert not await db.redis_client.exists(f"room:{room_id}:thread:missing")
+
+    # The count follows the thread, even once the parent is gone
+    await db._remove_messages(room_id, [parent["id"]])
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages/{parent['id']}/thread")
+    page = response.json()
+    assert page["reply_count"] == len(page["messages"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_reply_saved_twice_counts_once(db: RedisDatabase, async_client: AsyncClient):
+    from src.models.message import Message
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "testroom"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    parent = (await async_client.post(
+        f"/api/v1/rooms/{room_id}/messages", json={"content": "question", "user_id": user_id}
+    )).json()
+
+    reply = Message(id="reply", room_id=room_id, user_id=user_id, content="answer", reply_to=parent["id"])
+    await db.save_message(reply)
+    await db.save_message(reply)
+    await db.save_messages([reply, reply])
+
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/messages/{parent['id']}/thread")
+    page = response.json()
+    assert page["reply_count"] == len(page["messages"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_room_presence(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from src.services.presence import PresenceTracker
+    from src.services.websocket import manager
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "testroom"})
+    room_id = room_response.json()["id"]
+    tracker = PresenceTracker(enabled=True)
+    tracker.joined(room_id, "alice")
+    tracker.joined(room_id, "bob")
+    await tracker.flush(db, manager)
+
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/presence")
+    assert response.status_code == 200
+    assert sorted(response.json()["users"]) == ["alice", "bob"]
+
+    tracker.left(room_id, "bob")
+    await tracker.flush(db, manager)
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/presence")
+    assert response.json() == {"room_id": room_id, "users": ["alice"], "count": 1}
+
+    # Leaving one worker keeps a user present while another still has them
+    from src.services.database import redis as redis_db
+    monkeypatch.setattr(redis_db, "_PRESENCE_WORKER", "other")
+    assert await db.update_presence({room_id: ["alice"]}, {}, 60) == {}
+    monkeypatch.undo()
+    assert await db.update_presence({}, {room_id: ["alice"]}, 60) == {}
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/presence")
+    assert response.json()["users"] == ["alice"]
+    monkeypatch.setattr(redis_db, "_PRESENCE_WORKER", "other")
+    assert await db.update_presence({}, {room_id: ["alice"]}, 60) == {room_id: ["alice"]}
+    response = await async_client.get(f"/api/v1/rooms/{room_id}/presence")
+    assert response.json()["users"] == []
@@ -11,6 +11,13 @@ from fastapi.testclient import TestClient
 def test_client():
     return TestClient(app)
 
+async def recv_frame(websocket):
+    """Receive the next frame, skipping presence, typing and ping frames sent on the server's own schedule"""
+    while True:
+        data = json.loads(await websocket.recv())
+        if data.get("type") not in ("presence", "typing", "ping"):
+            return data
+
 @pytest.mark.asyncio
 async def test_websocket_connection(db: RedisDatabase, async_client: AsyncClient):
     # Create a room first
@@ -25,7 +32,7 @@ async def test_websocket_connection(db: RedisDatabase, async_client: AsyncClient
     uri = f"ws://localhost:8000/api/v1/ws/{room_id}/{user_id}"
     async with websockets.connect(uri) as websocket:
         # First receive the history message
-        history = json.loads(await websocket.recv())
+        history = await recv_frame(websocket)
         assert history["type"] == "history"
         assert isinstance(history["messages"], list)
         
@@ -37,7 +44,7 @@ async def test_websocket_connection(db: RedisDatabase, async_client: AsyncClient
         }))
         
         # Receive the message back
-        data = json.loads(await websocket.recv())
+        data = await recv_frame(websocket)
         assert data["type"] == "text"
         assert data["content"] == "Hello, World!"
         assert data["user_id"] == user_id
@@ -64,8 +71,8 @@ async def test_websocket_broadcast(db: RedisDatabase, async_client: AsyncClient)
               websockets.connect(uri2) as websocket2:
         
         # First receive the history messages
-        history1 = json.loads(await websocket1.recv())
-        history2 = json.loads(await websocket2.recv())
+        history1 = await recv_frame(websocket1)
+        history2 = await recv_frame(websocket2)
         assert history1["type"] == "history"
         assert history2["type"] == "history"
         
@@ -77,8 +84,8 @@ async def test_websocket_broadcast(db: RedisDatabase, async_client: AsyncClient)
         }))
         
         # Both clients should receive the message
-        data1 = json.loads(await websocket1.recv())
-        data2 = json.loads(await websocket2.recv())
+        data1 = await recv_frame(websocket1)
+        data2 = await recv_frame(websocket2)
         
         assert data1["type"] == "text"
         assert data1["content"] == "Hello from user1!"
@@ -86,4 +93,457 @@ async def test_websocket_broadcast(db: RedisDatabase, async_client: AsyncClient)
         
         assert data2["type"] == "text"
         assert data2["content"] == "Hello from user1!"
-        assert data2["user_id"] == user1_id 
\ No newline at end of file
+        assert data2["user_id"] == user1_id 
+
+@pytest.mark.asyncio
+async def test_websocket_session(db: RedisDatabase, async_client: AsyncClient):
+    # Create two rooms and a user
+    room_ids = []
+    for name in ("Room One", "Room Two"):
+        room_response = await async_client.post("/api/v1/rooms", json={"name": name})
+        room_ids.append(room_response.json()["id"])
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+
+    # One socket subscribes to both rooms
+    uri = f"ws://localhost:8000/api/v1/ws/{user_id}"
+    async with websockets.connect(uri) as websocket:
+        await websocket.send(json.dumps({"type": "subscribe", "room_ids": room_ids}))
+        histories = [await recv_frame(websocket), await recv_frame(websocket)]
+        assert {history["room_id"] for history in histories} == set(room_ids)
+        assert all(history["type"] == "history" for history in histories)
+
+        # Messages name their room
+        await websocket.send(json.dumps({"type": "text", "room_id": room_ids[1], "content": "Hello!"}))
+        data = await recv_frame(websocket)
+        assert data["content"] == "Hello!"
+        assert data["room_id"] == room_ids[1]
+
+        await websocket.send(json.dumps({"type": "unsubscribe", "room_id": room_ids[1]}))
+        assert await recv_frame(websocket) == {"type": "unsubscribed", "room_id": room_ids[1]}
+
+
+@pytest.mark.asyncio
+async def test_invalid_message_frame(db: RedisDatabase, async_client: AsyncClient, monkeypatch):
+    from src.api.v1 import router
+    room_response = await async_client.post("/api/v1/rooms", json={"name": "Test Room"})
+    room_id = room_response.json()["id"]
+    user_response = await async_client.post("/api/v1/users", json={"username": "testuser"})
+    user_id = user_response.json()["id"]
+    sent = []
+
+    async def send(websocket, frame):
+        sent.append(json.loads(frame))
+
+    monkeypatch.setattr(router.manager, "send", send)
+    socket = object()
+
+    # Each bad frame is answered with an error for its room, and nothing is stored
+    for data in ({"type": "shout", "content": "hi"}, {"type": "text", "content": 42}):
+        await router._handle_frame(db, socket, room_id, user_id, data)
+    assert [frame["type"] for frame in sent] == ["error", "error"]
+    assert all(frame["room_id"] == room_id for frame in sent)
+    assert sent[0]["detail"].startswith("Invalid type")
+    assert sent[1]["detail"].startswith("Invalid content")
+    assert await db.get_room_messages(room_id) == []
+
+    # The socket goes on to handle the next frame
+    await router._handle_frame(db, socket, room_id, user_id, {"type": "text", "content": "hello"})
+    assert [m.content for m in await db.get_room_messages(room_id)] == ["hello"]
+
+
+@pytest.mark.asyncio
+async def test_presence_flush_failure_keeps_newer_changes():
+    from src.services.presence import PresenceTracker
+    tracker = PresenceTracker(enabled=True)
+    writes = []
+
+    class FakeManager:
+        def room_members(self):
+            return []
+
+        async def broadcast_json(self, room_id, frame):
+            pass
+
+    class FailingDB:
+        async def update_presence(self, present, absent, timeout):
+            # The user leaves and another joins while the write is in flight
+            tracker.left("room", "alice")
+            tracker.joined("room", "bob")
+            raise ConnectionError("Redis is down")
+
+    class DB:
+        async def update_presence(self, present, absent, timeout):
+            writes.append((present, absent))
+            return absent
+
+    tracker.joined("room", "alice")
+    tracker.left("room", "bob")
+    tracker.joined("room", "carol")
+    with pytest.raises(ConnectionError):
+        await tracker.flush(FailingDB(), FakeManager())
+
+    # The newer leave and join win; the change nobody touched is retried
+    await tracker.flush(DB(), FakeManager())
+    assert writes == [({"room": {"bob", "carol"}}, {"room": {"alice"}})]
+
+
+@pytest.mark.asyncio
+async def test_connection_reaper():
+    from src.services.reaper import ConnectionReaper, WS_CLOSE_PING_TIMEOUT
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+            self.closed = None
+
+        async def send_text(self, data):
+            self.sent.append(data)
+
+        async def close(self, code=1000, reason=None):
+            self.closed = code
+
+    class FakeManager:
+        def __init__(self):
+            self.disconnected = []
+
+        async def close_socket(self, user_id, websocket):
+            self.disconnected.append(user_id)
+
+        async def send(self, websocket, frame):
+            await websocket.send_text(frame.text)
+
+    now = [0.0]
+    reaper = ConnectionReaper(enabled=True, ping_interval=3, pong_timeout=2, tick=1, clock=lambda: now[0])
+    manager = FakeManager()
+    alive, dead = FakeSocket(), FakeSocket()
+    reaper.track(alive, "alive")
+    reaper.track(dead, "dead")
+
+    for second in range(1, 8):
+        now[0] = float(second)
+        if alive.sent:
+            reaper.touch(alive)  # Answers every ping
+        await reaper.advance(manager)
+
+    assert dead.sent == ['{"type":"ping"}']
+    assert dead.closed == WS_CLOSE_PING_TIMEOUT
+    assert manager.disconnected == ["dead"]
+    assert alive.closed is None
+    assert len(reaper) == 1
+
+
+@pytest.mark.asyncio
+async def test_typing_tracker():
+    import json
+    from src.services.typing_indicators import TypingTracker
+
+    class FakeManager:
+        def __init__(self):
+            self.frames = []
+
+        async def broadcast_json(self, room_id, frame):
+            self.frames.append(json.loads(frame.text))
+
+    now = [0.0]
+    tracker = TypingTracker(enabled=True, throttle=2, timeout=5, clock=lambda: now[0])
+    manager = FakeManager()
+    for _ in range(100):
+        tracker.update("room", "alice")
+    tracker.update("room", "bob")
+    await tracker.flush(manager)
+    assert manager.frames == [{"type": "typing", "room_id": "room", "users": ["alice", "bob"]}]
+
+    # Refreshes that don't change the set send nothing
+    now[0] = 3.0
+    tracker.update("room", "alice")
+    await tracker.flush(manager)
+    assert len(manager.frames) == 1
+
+    # Bob's state expires; Alice was refreshed at 3s
+    now[0] = 6.0
+    await tracker.flush(manager)
+    assert manager.frames[-1]["users"] == ["alice"]
+    tracker.update("room", "alice", is_typing=False)
+    await tracker.flush(manager)
+    assert manager.frames[-1]["users"] == []
+
+
+def test_connection_registry():
+    from src.services.registry import ConnectionRegistry
+
+    class FakeSocket:
+        pass
+
+    registry = ConnectionRegistry()
+    sockets = [FakeSocket() for _ in range(4)]
+    for n, websocket in enumerate(sockets):
+        registry.add_socket(websocket)
+        registry.add(websocket, "room", f"user-{n}")
+    session = sockets[0]
+    registry.add(session, "other", "user-0")
+    assert registry.socket_room_count(session, "user-0") == 2
+    assert registry.subscription_count() == 5 and registry.room_count() == 2
+
+    # Removal keeps the other members in join order
+    assert registry.remove("room", "user-1") is sockets[1]
+    members = registry.members("room")
+    assert [member.user_id for member in members] == ["user-0", "user-2", "user-3"]
+    assert registry.get("room", "user-1") is None
+    assert registry.remove("room", "user-1") is None
+
+    # A user's other rooms stay linked when one in the middle of the chain goes
+    registry.add(session, "third", "user-0")
+    assert registry.remove("other", "user-0") is session
+    assert registry.get("third", "user-0") is session and registry.get("room", "user-0") is session
+    assert registry.remove("third", "user-0") is session
+    registry.add(session, "other", "user-0")
+
+    # A new socket replaces the user's connection to the room
+    replacement = FakeSocket()
+    registry.add_socket(replacement)
+    registry.add(replacement, "room", "user-2")
+    assert registry.get("room", "user-2") is replacement
+
+    assert sorted(registry.remove_socket(session, "user-0")) == ["other", "room"]
+    assert registry.remove_socket(session, "user-0") == []
+    for room_id in ("room", "other"):
+        registry.remove(room_id, "user-0")
+    assert dict(registry.rooms()) == {"room": ["user-2", "user-3"]}
+    assert registry.socket_count() == 4
+
+
+@pytest.mark.asyncio
+async def test_sharded_broadcast():
+    import asyncio
+    from src.services.websocket import ConnectionManager, room_size_bucket
+
+    sending = [0, 0]  # now, most at once
+
+    class FakeSocket:
+        def __init__(self, fail=False):
+            self.fail = fail
+            self.sent = []
+
+        async def send_text(self, text):
+            sending[0] += 1
+            sending[1] = max(sending)
+            await asyncio.sleep(0)
+            sending[0] -= 1
+            if self.fail:
+                raise RuntimeError("closed")
+            self.sent.append(text)
+
+    manager = ConnectionManager(shard_size=10, room_concurrency=2, max_concurrency=3)
+    # The global limit is made on the running loop, by the first fan-out
+    assert manager._fanout_limit is None
+    sockets = [FakeSocket(fail=n == 42) for n in range(95)]
+    for n, websocket in enumerate(sockets):
+        manager.registry.add_socket(websocket)
+        manager.registry.add(websocket, "room", f"user-{n}")
+
+    await manager.broadcast_json("room", "frame", exclude_user="user-0")
+    # Everyone else got the frame, then the failed socket's leave notice
+    assert sockets[42].sent == [] and '"type": "system"' in sockets[0].sent[0]
+    assert all(websocket.sent[0] == "frame" for websocket in sockets[1:42] + sockets[43:])
+    # Each shard sends one frame at a time, and two shards of the room run at once
+    assert sending[1] == 2
+    assert manager.registry.get("room", "user-42") is None
+    assert manager._room_limits == {}
+
+    assert [room_size_bucket(size) for size in (1, 10, 11, 5000, 20000)] == [
+        "1-10", "1-10", "11-100", "1001-10000", "10001+"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_room_actors():
+    import asyncio
+    import json
+    from datetime import datetime
+    from src.models.message import Message
+    from src.services.room_actors import RoomActors
+
+    class FakeDB:
+        def __init__(self):
+            self.saved = []
+            self.fail = False
+
+        async def save_messages(self, messages):
+            await asyncio.sleep(0)
+            if self.fail:
+                raise RuntimeError("down")
+            self.saved.append([message.content for message in messages])
+
+    class FakeManager:
+        def __init__(self):
+            self.frames = []
+
+        async def broadcast_json(self, room_id, frame):
+            self.frames.append(json.loads(frame.text))
+
+        async def send(self, websocket, frame):
+            await websocket.send_text(frame)
+
+    class FakeSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def send_text(self, text):
+            self.sent.append(json.loads(text))
+
+    def message(content):
+        return Message(id=content, room_id="room", user_id="alice", content=content, created_at=datetime.utcnow())
+
+    db, manager, websocket = FakeDB(), FakeManager(), FakeSocket()
+    actors = RoomActors(enabled=True, batch_window=0, max_batch=3, max_queue=5)
+    actors.start(db, manager)
+    assert actors.submit(message("a"), websocket)
+    await asyncio.sleep(0.01)
+    assert manager.frames[0]["content"] == "a" and len(actors) == 0
+
+    # Messages queued together are saved and broadcast together, in order
+    for content in "bcdef":
+        assert actors.submit(message(content), websocket)
+    assert not actors.submit(message("g"), websocket)
+    await actors.stop()
+    assert db.saved == [["a"], ["b", "c", "d"], ["e", "f"]]
+    assert manager.frames[1]["type"] == "batch"
+    assert [m["content"] for m in manager.frames[1]["messages"]] == ["b", "c", "d"]
+    assert [m["content"] for m in manager.frames[2]["messages"]] == ["e", "f"]
+
+    # Nothing new is taken while stop() drains the actors
+    actors.start(db, manager)
+    assert actors.submit(message("x"), websocket)
+    stopping = asyncio.create_task(actors.stop())
+    await asyncio.sleep(0)
+    assert actors.running and not actors.submit(message("y"), websocket)
+    await stopping
+    assert db.saved[-1] == ["x"] and len(actors) == 0
+    manager.frames.pop()
+
+    # Senders hear about a batch that couldn't be saved
+    actors.start(db, manager)
+    db.fail = True
+    actors.submit(message("h"), websocket)
+    await actors.stop()
+    assert websocket.sent == [{"type": "error", "room_id": "room", "detail": "Message could not be saved"}]
+    assert len(manager.frames) == 3 and not actors.running
+
+
+@pytest.mark.asyncio
+async def test_room_digest_mode():
+    import asyncio
+    import json
+    from datetime import datetime
+    from src.models.message import Message
+    from src.services.room_actors import RoomActors
+
+    class FakeDB:
+        def __init__(self):
+            self.saved = 0
+
+        async def save_messages(self, messages):
+            self.saved += len(messages)
+
+    class FakeManager:
+        def __init__(self):
+            self.frames = []
+
+        def member_count(self, room_id):
+            return {"big": 500, "small": 5}[room_id]
+
+        async def broadcast_json(self, room_id, frame):
+            # Slow enough for an actor to deliver while a digest goes out
+            await asyncio.sleep(0.001)
+            self.frames.append(json.loads(frame.text))
+
+    def message(room_id, n):
+        return Message(
+            id=f"{room_id}{n}", room_id=room_id, user_id="alice", content=str(n), created_at=datetime.utcnow()
+        )
+
+    # Rates are measured on this clock; the timer's interval is too long to fire, so modes change by hand
+    now = [0.0]
+    db, manager = FakeDB(), FakeManager()
+    actors = RoomActors(
+        enabled=True, batch_window=0, digest_rate=10, digest_min_members=100,
+        digest_interval=3600, digest_max_messages=5, clock=lambda: now[0]
+    )
+    actors.start(db, manager)
+    for n in range(50):
+        actors.submit(message("big", n), None)
+        actors.submit(message("small", n), None)
+    await asyncio.sleep(0.01)
+    now[0] += 1
+    assert actors.update_modes() == set()
+    # Only the busy room with enough members switches
+    assert actors.hot_rooms() == {"big"}
+
+    manager.frames.clear()
+    for n in range(50, 100):
+        actors.submit(message("big", n), None)
+    await asyncio.sleep(0.01)
+    assert manager.frames == []
+    await actors.flush_digests()
+    (digest,) = manager.frames
+    assert digest["type"] == "digest" and digest["count"] == 50 and len(digest["messages"]) == 5
+    contents = [int(m["content"]) for m in digest["messages"]]
+    assert contents == sorted(contents) and all(50 <= n < 100 for n in contents)
+    assert db.saved == 150
+
+    # The busy interval keeps the room in digest mode; a quiet one ends it
+    now[0] += 1
+    assert actors.update_modes() == set()
+    assert actors.hot_rooms() == {"big"}
+    manager.frames.clear()
+    actors.submit(message("big", 100), None)
+    await asyncio.sleep(0.01)
+    now[0] += 1
+    leaving = actors.update_modes()
+    assert leaving == {"big"} and actors.hot_rooms() == {"big"}
+
+    # A message saved while the last digest goes out is digested, not broadcast ahead of it
+    flushing = asyncio.create_task(actors.flush_digests(leaving))
+    await asyncio.sleep(0)
+    actors.submit(message("big", 101), None)
+    await flushing
+    assert actors.hot_rooms() == set()
+    actors.submit(message("big", 102), None)
+    await asyncio.sleep(0.01)
+    assert [frame["type"] for frame in manager.frames] == ["digest", "digest", "text"]
+    assert [m["content"] for frame in manager.frames[:2] for m in frame["messages"]] == ["100", "101"]
+    await actors.stop()
+
+
+def test_msgpack_protocol(monkeypatch):
+    pytest.importorskip("msgpack")
+    import json
+    from src.services import protocol
+
+    assert protocol.negotiate(["chat.msgpack", "chat.json"]) == "chat.msgpack"
+    assert protocol.negotiate(["chat.msgpack", "chat.json"], allow_msgpack=False) == "chat.json"
+    assert protocol.negotiate(["other"]) is None
+    monkeypatch.setattr(protocol, "MSGPACK_AVAILABLE", False)
+    assert protocol.negotiate(["chat.msgpack"]) is None
+
+    frame = {
+        "type": "history",
+        "room_id": "room",
+        "messages": [{"id": "m1", "content": "hi", "metadata": {"type": "kept"}, "reply_to": None}],
+        "reply_counts": {"m1": 2},
+        "users": {"alice": {"id": "alice", "username": "Alice"}}
+    }
+    packed = protocol.Frame(json.dumps(frame)).packed()
+    assert len(packed) < len(json.dumps(frame))
+    assert protocol.unpack(packed) == frame
+
+    # Message frames are packed straight from the model, with the same data as their JSON
+    from src.models.message import Message
+    from src.models.user import User
+    message = Message(id="m2", room_id="room", user_id="alice", content="hi", reply_to="m1")
+    author = User(id="alice", username="Alice", metadata={"avatar": "a.png"})
+    for single in (protocol.message_frame(message), protocol.message_frame(message, author)):
+        assert protocol.unpack(single.packed()) == json.loads(single.text)
+    batch = protocol.list_frame({"type": "batch", "room_id": "room"}, [single, single])
+    assert protocol.unpack(batch.packed()) == json.loads(batch.text)